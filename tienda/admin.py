@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Producto, Orden, DetalleOrden, Perfil, Favorito, Cupon, Review, Categoria, Variante
+from .models import Producto, Orden, DetalleOrden, Perfil, Favorito, Cupon, Review, Categoria, Variante, TrabajoImagen
 
 @admin.register(Categoria)
 class CategoriaAdmin(admin.ModelAdmin):
@@ -12,9 +12,9 @@ class VarianteInline(admin.TabularInline):
 
 @admin.register(Producto)
 class ProductoAdmin(admin.ModelAdmin):
-    list_display = ('nombre', 'categoria', 'precio', 'stock', 'en_oferta')
+    list_display = ('nombre', 'codigo', 'categoria', 'precio', 'stock', 'en_oferta')
     list_filter = ('categoria', 'en_oferta')
-    search_fields = ('nombre',)
+    search_fields = ('nombre', 'codigo')
     inlines = [VarianteInline]
 
 class DetalleOrdenInline(admin.TabularInline):
@@ -61,4 +61,10 @@ class CuponAdmin(admin.ModelAdmin):
     def resetear_historial(self, request, queryset):
         for cupon in queryset:
             cupon.usuarios_usados.clear() # Borra todas las relaciones
-        self.message_user(request, "¡Historial de usuarios borrado! Ahora pueden volver a usar estos cupones.")
\ No newline at end of file
+        self.message_user(request, "¡Historial de usuarios borrado! Ahora pueden volver a usar estos cupones.")
+
+@admin.register(TrabajoImagen)
+class TrabajoImagenAdmin(admin.ModelAdmin):
+    list_display = ('modelo', 'objeto_id', 'campo', 'estado', 'intentos', 'actualizado')
+    list_filter = ('estado', 'modelo')
+    readonly_fields = ('modelo', 'objeto_id', 'campo', 'archivo', 'ancho', 'intentos', 'error', 'creado', 'actualizado')
@@ -0,0 +1,92 @@
+"""
+Dónde vive el contenido del carrito: en la tabla ContenidoCarrito, no en la sesión.
+
+Solo se guarda lo que no se puede recalcular, (producto_id, variante_id, cantidad) por línea,
+en un texto compacto: "1718000000|12:3:2|15::1" (hora del último cambio y las líneas).
+Nombre, foto y precio se resuelven al mostrar el carrito (Carrito.lineas()).
+
+La sesión solo guarda el token del carrito (una vez, al crearlo), así que agregar o restar
+ya no reescribe la fila de la sesión en cada request. La fila vence junto con las reservas
+(VIGENCIA_RESERVA), solo se escribe cuando el contenido cambia y ninguna limpieza de cache
+se la puede llevar: las vencidas las borra el comando liberar_reservas.
+"""
+import time
+from django.utils import timezone
+from .models import ContenidoCarrito
+from .reservas import VIGENCIA_RESERVA
+
+
+def cart_id(producto_id, variante_id=None):
+    # Clave de la línea: "12" o "12_3" (la misma que usan las reservas)
+    return f"{producto_id}_{variante_id}" if variante_id else str(producto_id)
+
+
+def codificar(items, ultimo_cambio):
+    lineas = (
+        f"{item['producto_id']}:{item['variante_id'] or ''}:{item['cantidad']}" for item in items.values()
+    )
+    return '|'.join([str(int(ultimo_cambio)), *lineas])
+
+
+def decodificar(valor):
+    """
+    Devuelve ({cart_id: {'producto_id', 'variante_id', 'cantidad'}}, hora del último cambio).
+    """
+    ultimo_cambio, *lineas = valor.split('|')
+    items = {}
+    for linea in lineas:
+        producto_id, variante_id, cantidad = linea.split(':')
+        producto_id, variante_id = int(producto_id), int(variante_id) if variante_id else None
+        items[cart_id(producto_id, variante_id)] = {
+            'producto_id': producto_id, 'variante_id': variante_id, 'cantidad': int(cantidad),
+        }
+    return items, int(ultimo_cambio)
+
+
+def leer(token):
+    """
+    (items, hora del último cambio) del carrito `token`; ({}, None) si no existe o ya venció.
+    """
+    if not token:
+        return {}, None
+    valor = (
+        ContenidoCarrito.objects.filter(token=token, vence__gt=timezone.now())
+        .values_list('contenido', flat=True).first()
+    )
+    if not valor:
+        return {}, None
+    try:
+        return decodificar(valor)
+    except ValueError:
+        return {}, None
+
+
+def guardar(token, items):
+    """
+    Guarda el carrito y renueva su vencimiento. Devuelve la hora del cambio.
+    Un carrito vacío se borra.
+    """
+    ahora = int(time.time())
+    if not items:
+        borrar(token)
+        return ahora
+    datos = {'contenido': codificar(items, ahora), 'vence': timezone.now() + VIGENCIA_RESERVA}
+    # Casi siempre el carrito ya existe: un UPDATE. La primera vez, un INSERT ... ON CONFLICT
+    # por si otra request del mismo visitante lo crea al mismo tiempo
+    if not ContenidoCarrito.objects.filter(token=token).update(**datos):
+        ContenidoCarrito.objects.bulk_create(
+            [ContenidoCarrito(token=token, **datos)],
+            update_conflicts=True, unique_fields=['token'], update_fields=['contenido', 'vence'],
+        )
+    return ahora
+
+
+def borrar(token):
+    ContenidoCarrito.objects.filter(token=token).delete()
+
+
+def borrar_vencidos():
+    """
+    Borra en lote los carritos vencidos. Devuelve cuántos se borraron.
+    """
+    return ContenidoCarrito.objects.filter(vence__lte=timezone.now()).delete()[0]
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class TiendaConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tienda'
+
+    def ready(self):
+        # Conecta los receivers de señales (índice de búsqueda, conteo de consultas, etc.)
+        from . import consultas, signals  # noqa: F401
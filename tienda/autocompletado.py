@@ -0,0 +1,233 @@
+import logging
+import threading
+import time
+import uuid
+from bisect import bisect_left, insort
+from django.core.cache import cache
+from django.db import DatabaseError, connection
+from .utils import normalizar_texto
+
+logger = logging.getLogger(__name__)
+
+# Cada cuánto reconstruimos el índice aunque no haya señales
+EDAD_MAXIMA_SEGUNDOS = 300
+
+# Versión de los productos en la cache compartida: cambia con cada alta, cambio o baja de
+# un producto (no con variantes, reseñas ni compras, que el índice no guarda). Así un
+# worker se entera de lo que cambiaron los demás. Se mira como mucho cada REVISAR_CADA
+# segundos, no en cada tecla.
+CLAVE_VERSION = 'autocompletado:version'
+REVISAR_CADA = 2
+
+
+class IndiceAutocompletado:
+    """
+    Índice en memoria (uno por proceso) para el buscador del header.
+
+    Guarda una lista ordenada de claves normalizadas, una por cada palabra del
+    nombre ("anillo dorado", "dorado"), así que buscar un prefijo es una
+    búsqueda binaria: no toca la base de datos.
+    Cada producto se guarda como una tupla compacta (id, nombre, precio, imagen).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._claves = []      # [(clave, producto_id)] ordenada
+        self._productos = {}   # producto_id -> (id, nombre, precio, imagen_url)
+        self._construido_en = None
+        self._version = None
+        self._revisado_en = None
+        self._reconstruyendo = False
+        self.consultas = 0
+        self.aciertos = 0
+        self.reconstrucciones = 0
+        self.ultima_reconstruccion_ms = 0.0
+
+    @staticmethod
+    def _claves_de(producto_id, nombre):
+        palabras = normalizar_texto(nombre).split(' ')
+        return [(' '.join(palabras[i:]), producto_id) for i in range(len(palabras)) if palabras[i]]
+
+    @staticmethod
+    def _tupla(producto):
+        return (
+            producto.id,
+            producto.nombre,
+            str(producto.precio),
+            producto.imagen.url if producto.imagen else '',
+        )
+
+    def construir(self):
+        from .models import Producto
+
+        inicio = time.perf_counter()
+        version = self._version_compartida()
+        productos = {}
+        claves = []
+        for producto in Producto.objects.only('id', 'nombre', 'precio', 'imagen').iterator():
+            productos[producto.id] = self._tupla(producto)
+            claves.extend(self._claves_de(producto.id, producto.nombre))
+        claves.sort()
+
+        with self._lock:
+            self._productos = productos
+            self._claves = claves
+            self._construido_en = self._revisado_en = time.monotonic()
+            self._version = version
+            self.reconstrucciones += 1
+            self.ultima_reconstruccion_ms = (time.perf_counter() - inicio) * 1000
+
+        logger.info("Índice de autocompletado reconstruido: %d productos en %.1f ms",
+                    len(productos), self.ultima_reconstruccion_ms)
+
+    def _reconstruir_en_segundo_plano(self):
+        with self._lock:
+            if self._reconstruyendo:
+                return
+            self._reconstruyendo = True
+
+        def tarea():
+            try:
+                self.construir()
+            except DatabaseError:
+                logger.warning("Falló la reconstrucción del índice de autocompletado", exc_info=True)
+            finally:
+                self._reconstruyendo = False
+                connection.close()
+
+        threading.Thread(target=tarea, daemon=True).start()
+
+    @staticmethod
+    def _version_compartida():
+        version = cache.get(CLAVE_VERSION)
+        if version is None:
+            cache.add(CLAVE_VERSION, uuid.uuid4().hex, None)
+            version = cache.get(CLAVE_VERSION)
+        return version
+
+    def marcar_cambio(self):
+        """
+        Avisa a los demás procesos que cambió un producto. Si este índice estaba al día,
+        adopta la versión nueva: el cambio ya lo parchearon actualizar() o quitar().
+        """
+        al_dia = self._construido_en is not None and cache.get(CLAVE_VERSION) == self._version
+        version = uuid.uuid4().hex
+        cache.set(CLAVE_VERSION, version, None)
+        if al_dia:
+            self._version = version
+
+    def _vencido(self):
+        ahora = time.monotonic()
+        if self._construido_en is None or ahora - self._construido_en > EDAD_MAXIMA_SEGUNDOS:
+            return True
+        if ahora - self._revisado_en < REVISAR_CADA:
+            return False
+        # Si otro proceso cambió un producto, la versión compartida ya no coincide
+        self._revisado_en = ahora
+        return cache.get(CLAVE_VERSION) != self._version
+
+    def _preparar_busqueda(self, query):
+        """
+        Normaliza la consulta y dispara la reconstrucción si hace falta.
+        Devuelve (prefijo, hay_indice); prefijo vacío si no hay nada que buscar.
+        """
+        self.consultas += 1
+        prefijo = normalizar_texto(query)
+        if not prefijo:
+            return '', False
+
+        if self._vencido():
+            # Nadie espera la reconstrucción: se hace en segundo plano
+            self._reconstruir_en_segundo_plano()
+            return prefijo, self._construido_en is not None
+        self.aciertos += 1
+        return prefijo, True
+
+    def buscar(self, query, limite=5):
+        """
+        Devuelve hasta `limite` tuplas (id, nombre, precio, imagen) cuyo nombre
+        tiene alguna palabra que empieza con `query`.
+        """
+        prefijo, hay_indice = self._preparar_busqueda(query)
+        if not prefijo:
+            return []
+        if not hay_indice:
+            # Todavía no hay índice: respondemos con un prefijo indexado sobre nombre_busqueda
+            from .models import Producto
+            return [self._tupla(p) for p in Producto.objects.empiezan_con(prefijo).order_by('nombre_busqueda')[:limite]]
+        return self._buscar_en_indice(prefijo, limite)
+
+    async def abuscar(self, query, limite=5):
+        """
+        Igual que buscar(), para las vistas async: con el índice armado no hay nada que esperar
+        y, si todavía no existe, la consulta de respaldo usa el ORM async.
+        """
+        prefijo, hay_indice = self._preparar_busqueda(query)
+        if not prefijo:
+            return []
+        if not hay_indice:
+            from .models import Producto
+            qs = Producto.objects.empiezan_con(prefijo).order_by('nombre_busqueda')[:limite]
+            return [self._tupla(p) async for p in qs]
+        return self._buscar_en_indice(prefijo, limite)
+
+    def _buscar_en_indice(self, prefijo, limite):
+        resultados = []
+        vistos = set()
+        with self._lock:
+            i = bisect_left(self._claves, (prefijo,))
+            while i < len(self._claves) and len(resultados) < limite:
+                clave, producto_id = self._claves[i]
+                if not clave.startswith(prefijo):
+                    break
+                if producto_id not in vistos:
+                    vistos.add(producto_id)
+                    resultados.append(self._productos[producto_id])
+                i += 1
+        return resultados
+
+    def _quitar_sin_lock(self, producto_id):
+        anterior = self._productos.pop(producto_id, None)
+        if anterior is None:
+            return
+        for clave in self._claves_de(producto_id, anterior[1]):
+            i = bisect_left(self._claves, clave)
+            if i < len(self._claves) and self._claves[i] == clave:
+                del self._claves[i]
+
+    def actualizar(self, producto):
+        # Si todavía no se construyó no hay nada que parchear: se armará completo en la primera búsqueda
+        if self._construido_en is not None:
+            with self._lock:
+                self._quitar_sin_lock(producto.id)
+                self._productos[producto.id] = self._tupla(producto)
+                for clave in self._claves_de(producto.id, producto.nombre):
+                    insort(self._claves, clave)
+        self.marcar_cambio()
+
+    def quitar(self, producto_id):
+        if self._construido_en is not None:
+            with self._lock:
+                self._quitar_sin_lock(producto_id)
+        self.marcar_cambio()
+
+    def invalidar(self):
+        # Para cargas masivas (sin señales): también se rearman los índices de los demás procesos
+        with self._lock:
+            self._construido_en = None
+            self._claves = []
+            self._productos = {}
+        cache.set(CLAVE_VERSION, uuid.uuid4().hex, None)
+
+    def estadisticas(self):
+        return {
+            'productos': len(self._productos),
+            'consultas': self.consultas,
+            'aciertos': self.aciertos,
+            'tasa_aciertos': round(self.aciertos / self.consultas, 4) if self.consultas else 0,
+            'reconstrucciones': self.reconstrucciones,
+            'ultima_reconstruccion_ms': round(self.ultima_reconstruccion_ms, 2),
+        }
+
+
+indice_autocompletado = IndiceAutocompletado()
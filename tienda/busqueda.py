@@ -0,0 +1,278 @@
+import re
+from abc import ABC, abstractmethod
+from django.conf import settings
+from django.db import connection, DatabaseError
+from django.db.models import BooleanField, FloatField
+from django.db.models.expressions import RawSQL
+from .utils import normalizar_texto
+
+# Sufijos que sacamos para llevar las palabras a su raíz ("anillos" y "anillo" -> "anill").
+# Ordenados de más largo a más corto: se aplica solo el primero que coincide.
+SUFIJOS_ES = (
+    'amientos', 'imientos', 'aciones', 'uciones', 'amiento', 'imiento',
+    'amente', 'idades', 'mente', 'acion', 'ucion', 'ables', 'ibles',
+    'istas', 'idad', 'able', 'ible', 'ista', 'osos', 'osas', 'ones',
+    'oso', 'osa', 'es', 'os', 'as', 'a', 'o', 'e', 's',
+)
+
+
+def raiz_es(palabra):
+    """
+    Stemmer liviano para español: alcanza para que singular/plural y
+    masculino/femenino ("dorado", "doradas") caigan en la misma raíz.
+    """
+    for sufijo in SUFIJOS_ES:
+        if palabra.endswith(sufijo) and len(palabra) - len(sufijo) >= 3:
+            return palabra[:-len(sufijo)]
+    return palabra
+
+
+def terminos(texto):
+    """
+    Normaliza el texto y lo parte en raíces listas para indexar o buscar.
+    """
+    return [raiz_es(p) for p in re.findall(r'\w+', normalizar_texto(texto))]
+
+
+class MotorBusqueda(ABC):
+    """
+    Interfaz común de los motores de búsqueda del catálogo.
+    Los motores con índice propio guardan un documento por producto en una tabla
+    que se une a la consulta del catálogo: la coincidencia y la relevancia las
+    resuelve la base, sin tope de resultados.
+    """
+    nombre = 'base'
+
+    def indexar(self, producto):
+        pass
+
+    def indexar_lote(self, productos):
+        """
+        Indexa varios productos de una vez (importaciones). Los motores con índice lo
+        resuelven con unas pocas sentencias en lugar de dos por producto.
+        """
+        for producto in productos:
+            self.indexar(producto)
+
+    def eliminar(self, producto_id):
+        pass
+
+    def reconstruir(self, productos):
+        pass
+
+    @abstractmethod
+    def filtrar(self, queryset, query):
+        """
+        Filtra el queryset y, si el motor sabe medirla, le agrega la anotación
+        'relevancia' para poder ordenar por ella.
+        """
+
+
+class MotorSimple(MotorBusqueda):
+    """
+    Búsqueda sin índice (LIKE '%q%'). Queda como respaldo si la base no tiene FTS.
+    Compara contra el texto normalizado, así que no distingue acentos ni mayúsculas.
+    """
+    nombre = 'simple'
+
+    def filtrar(self, queryset, query):
+        # Comparamos contra las columnas normalizadas: "Dorádo" encuentra "dorado"
+        for palabra in normalizar_texto(query).split():
+            queryset = queryset.filter(texto_busqueda__contains=palabra)
+        return queryset
+
+
+class MotorSQLite(MotorBusqueda):
+    """
+    Índice FTS5 de SQLite. La tabla virtual guarda las raíces ya normalizadas
+    (usamos el rowid como id del producto) y bm25 da la relevancia.
+    """
+    nombre = 'sqlite'
+    tabla = 'tienda_producto_fts'
+
+    SQL_CREAR = (
+        "CREATE VIRTUAL TABLE IF NOT EXISTS tienda_producto_fts "
+        "USING fts5(nombre, descripcion, tokenize='unicode61 remove_diacritics 2')"
+    )
+    SQL_BORRAR = "DROP TABLE IF EXISTS tienda_producto_fts"
+
+    def indexar(self, producto):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.tabla} WHERE rowid = %s", [producto.id])
+            cursor.execute(
+                f"INSERT INTO {self.tabla} (rowid, nombre, descripcion) VALUES (%s, %s, %s)",
+                [producto.id, ' '.join(terminos(producto.nombre)), ' '.join(terminos(producto.descripcion))]
+            )
+
+    def indexar_lote(self, productos):
+        productos = list(productos)
+        if not productos:
+            return
+        with connection.cursor() as cursor:
+            # Un DELETE por tanda de ids (SQLite limita la cantidad de parámetros) y un solo executemany
+            for i in range(0, len(productos), 500):
+                tanda = productos[i:i + 500]
+                cursor.execute(
+                    f"DELETE FROM {self.tabla} WHERE rowid IN ({', '.join(['%s'] * len(tanda))})",
+                    [p.id for p in tanda]
+                )
+            cursor.executemany(
+                f"INSERT INTO {self.tabla} (rowid, nombre, descripcion) VALUES (%s, %s, %s)",
+                [(p.id, ' '.join(terminos(p.nombre)), ' '.join(terminos(p.descripcion))) for p in productos]
+            )
+
+    def eliminar(self, producto_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.tabla} WHERE rowid = %s", [producto_id])
+
+    def reconstruir(self, productos):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.tabla}")
+            cursor.executemany(
+                f"INSERT INTO {self.tabla} (rowid, nombre, descripcion) VALUES (%s, %s, %s)",
+                [
+                    (p.id, ' '.join(terminos(p.nombre)), ' '.join(terminos(p.descripcion)))
+                    for p in productos.iterator()
+                ]
+            )
+
+    def filtrar(self, queryset, query):
+        # Cada término como prefijo ("anil"*) para que también sirva mientras se escribe
+        consulta = ' '.join(f'"{t}"*' for t in terminos(query))
+        if not consulta:
+            return queryset.none()
+        # JOIN con la tabla FTS (DocumentoFTS): el MATCH va por el índice y bm25 se calcula
+        # en la misma consulta. bm25 devuelve valores negativos (más chico = más relevante);
+        # el nombre pesa 10 veces más que la descripción.
+        return queryset.filter(
+            RawSQL(f"{self.tabla} MATCH %s", [consulta], output_field=BooleanField()),
+            documento_fts__isnull=False,
+        ).annotate(
+            relevancia=RawSQL(f"-bm25({self.tabla}, 10.0, 1.0)", [], output_field=FloatField()),
+        )
+
+
+class MotorPostgres(MotorBusqueda):
+    """
+    Índice tsvector con configuración 'spanish' y un índice GIN.
+    El nombre lleva peso 'A' y la descripción peso 'B' para el ranking.
+    """
+    nombre = 'postgres'
+    tabla = 'tienda_producto_busqueda'
+
+    SQL_CREAR = (
+        "CREATE TABLE IF NOT EXISTS tienda_producto_busqueda ("
+        " producto_id bigint PRIMARY KEY REFERENCES tienda_producto(id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,"
+        " documento tsvector NOT NULL);"
+        "CREATE INDEX IF NOT EXISTS tienda_producto_busqueda_gin ON tienda_producto_busqueda USING GIN (documento);"
+    )
+    SQL_BORRAR = "DROP TABLE IF EXISTS tienda_producto_busqueda"
+
+    SQL_DOCUMENTO = (
+        "setweight(to_tsvector('spanish', %s), 'A') || setweight(to_tsvector('spanish', %s), 'B')"
+    )
+
+    def indexar(self, producto):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {self.tabla} (producto_id, documento) VALUES (%s, {self.SQL_DOCUMENTO}) "
+                "ON CONFLICT (producto_id) DO UPDATE SET documento = EXCLUDED.documento",
+                [producto.id, normalizar_texto(producto.nombre), normalizar_texto(producto.descripcion)]
+            )
+
+    def indexar_lote(self, productos):
+        productos = list(productos)
+        if not productos:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {self.tabla} (producto_id, documento) VALUES (%s, {self.SQL_DOCUMENTO}) "
+                "ON CONFLICT (producto_id) DO UPDATE SET documento = EXCLUDED.documento",
+                [(p.id, normalizar_texto(p.nombre), normalizar_texto(p.descripcion)) for p in productos]
+            )
+
+    def eliminar(self, producto_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.tabla} WHERE producto_id = %s", [producto_id])
+
+    def reconstruir(self, productos):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.tabla}")
+            cursor.executemany(
+                f"INSERT INTO {self.tabla} (producto_id, documento) VALUES (%s, {self.SQL_DOCUMENTO})",
+                [
+                    (p.id, normalizar_texto(p.nombre), normalizar_texto(p.descripcion))
+                    for p in productos.iterator()
+                ]
+            )
+
+    def filtrar(self, queryset, query):
+        # El stemming lo hace Postgres; nosotros solo limpiamos y armamos "termino:*" para prefijos
+        palabras = re.findall(r'\w+', normalizar_texto(query))
+        if not palabras:
+            return queryset.none()
+        consulta = ' & '.join(f'{p}:*' for p in palabras)
+        # JOIN con la tabla del tsvector (DocumentoTsvector): @@ usa el índice GIN y ts_rank ordena
+        return queryset.filter(
+            RawSQL(f"{self.tabla}.documento @@ to_tsquery('spanish', %s)", [consulta], output_field=BooleanField()),
+            documento_tsvector__isnull=False,
+        ).annotate(
+            relevancia=RawSQL(f"ts_rank({self.tabla}.documento, to_tsquery('spanish', %s))", [consulta],
+                              output_field=FloatField()),
+        )
+
+
+MOTORES = {
+    'simple': MotorSimple,
+    'sqlite': MotorSQLite,
+    'postgres': MotorPostgres,
+}
+
+_motor = None
+
+
+def motor_para(conexion):
+    """
+    Elige el motor según la base de datos. Si la tabla del índice no existe
+    (por ejemplo, SQLite compilado sin FTS5) usamos el motor simple.
+    """
+    elegido = getattr(settings, 'TIENDA_MOTOR_BUSQUEDA', 'auto')
+    if elegido == 'auto':
+        elegido = {'sqlite': 'sqlite', 'postgresql': 'postgres'}.get(conexion.vendor, 'simple')
+
+    motor = MOTORES[elegido]
+    if motor is not MotorSimple and motor.tabla not in conexion.introspection.table_names():
+        motor = MotorSimple
+    return motor()
+
+
+def obtener_motor():
+    global _motor
+    if _motor is None:
+        _motor = motor_para(connection)
+    return _motor
+
+
+def crear_indice(conexion):
+    """
+    Crea la tabla del índice para la base actual. Devuelve False si la base no lo soporta.
+    """
+    motor = {'sqlite': MotorSQLite, 'postgresql': MotorPostgres}.get(conexion.vendor)
+    if motor is None:
+        return False
+    try:
+        with conexion.cursor() as cursor:
+            cursor.execute(motor.SQL_CREAR)
+    except DatabaseError:
+        if conexion.vendor != 'sqlite':
+            raise
+        # SQLite compilado sin FTS5: seguimos con el motor simple
+        return False
+    return True
+
+
+def borrar_indice(conexion):
+    motor = {'sqlite': MotorSQLite, 'postgresql': MotorPostgres}.get(conexion.vendor)
+    if motor is not None:
+        with conexion.cursor() as cursor:
+            cursor.execute(motor.SQL_BORRAR)
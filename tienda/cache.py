@@ -0,0 +1,164 @@
+import hashlib
+import math
+import os
+import random
+import tempfile
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+
+# Generación del catálogo. Todas las claves de fragmentos la incluyen, así que invalidar
+# todo el catálogo es avanzarla: las claves viejas quedan huérfanas y la cache las
+# descarta sola al vencer. El valor de verdad es una fila de Generacion (el UPDATE
+# valor = valor + 1 es atómico); la cache guarda una copia para no consultar en cada request.
+CLAVE_GENERACION = 'catalogo:generacion'
+
+# Tiempo máximo de vida de un fragmento (la invalidación real la hace la generación)
+TIEMPO_FRAGMENTOS = 60 * 60
+
+# obtener_o_calcular(): cuánto puede tardar un cálculo antes de que otro lo dé por perdido,
+# y cuánto espera (en total) quien no tiene ni un valor viejo que devolver
+TIEMPO_LOCK = 60
+ESPERA_MAXIMA = 10
+INTERVALO_ESPERA = 0.05
+
+
+def leer_generacion(nombre):
+    from .models import Generacion
+
+    # Arranca desde la hora actual (en ms) y no desde 1: si la fila se pierde
+    # (base nueva, flush) nunca volvemos a un número ya usado en la cache
+    generacion, _ = Generacion.objects.get_or_create(nombre=nombre, defaults={'valor': int(time.time() * 1000)})
+    return generacion.valor
+
+
+def avanzar_generacion(nombre):
+    """
+    Suma uno a la generación `nombre` en la base y devuelve el valor nuevo.
+    """
+    from .models import Generacion
+
+    if not Generacion.objects.filter(nombre=nombre).update(valor=F('valor') + 1):
+        return leer_generacion(nombre)
+    return Generacion.objects.values_list('valor', flat=True).get(nombre=nombre)
+
+
+def generacion_catalogo():
+    generacion = cache.get(CLAVE_GENERACION)
+    if generacion is None:
+        cache.add(CLAVE_GENERACION, leer_generacion(CLAVE_GENERACION), None)
+        generacion = cache.get(CLAVE_GENERACION)
+    return generacion
+
+
+async def ageneracion_catalogo():
+    """
+    generacion_catalogo() para las vistas async: cache y base con sus versiones async.
+    """
+    from .models import Generacion
+
+    generacion = await cache.aget(CLAVE_GENERACION)
+    if generacion is None:
+        fila, _ = await Generacion.objects.aget_or_create(
+            nombre=CLAVE_GENERACION, defaults={'valor': int(time.time() * 1000)}
+        )
+        await cache.aadd(CLAVE_GENERACION, fila.valor, None)
+        generacion = await cache.aget(CLAVE_GENERACION)
+    return generacion
+
+
+def invalidar_catalogo():
+    """
+    Pasa a una nueva generación: todos los fragmentos del catálogo quedan viejos.
+    """
+    generacion = avanzar_generacion(CLAVE_GENERACION)
+    cache.set(CLAVE_GENERACION, generacion, None)
+    return generacion
+
+
+def _ruta_lock(clave):
+    carpeta = getattr(settings, 'TIENDA_LOCKS_DIR', os.path.join(tempfile.gettempdir(), 'tormenta_locks'))
+    os.makedirs(carpeta, exist_ok=True)
+    # Con el prefijo de la cache: dos bases en la misma máquina no comparten locks
+    return os.path.join(carpeta, hashlib.md5(cache.make_key(clave).encode()).hexdigest() + '.lock')
+
+
+def tomar_lock(clave, tiempo=TIEMPO_LOCK):
+    """
+    Lock entre procesos de la misma máquina: un archivo creado con O_CREAT | O_EXCL
+    (crearlo es atómico, cache.add en FileBasedCache no). Devuelve la ruta para
+    soltar_lock() o None si lo tiene otro. Un lock de más de `tiempo` segundos es de
+    un proceso que murió a mitad del cálculo: se borra y se vuelve a intentar.
+    """
+    ruta = _ruta_lock(clave)
+    for _ in range(2):
+        try:
+            os.close(os.open(ruta, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return ruta
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(ruta) < tiempo:
+                    return None
+                os.remove(ruta)
+            except FileNotFoundError:
+                pass  # lo soltaron justo ahora: reintentamos
+    return None
+
+
+def soltar_lock(ruta):
+    try:
+        os.remove(ruta)
+    except FileNotFoundError:
+        pass
+
+
+def clave_versionada(nombre, *partes):
+    resumen = hashlib.md5(repr(partes).encode()).hexdigest()
+    return f"catalogo:{generacion_catalogo()}:{nombre}:{resumen}"
+
+
+def obtener_o_calcular(clave, calcular, timeout, beta=1.0):
+    """
+    Como cache.get_or_set(), pero sin estampidas cuando la clave vence o es nueva:
+
+    - Se guarda (valor, vence, costo) y se recalcula un poco antes de `vence`, con una
+      probabilidad que crece a medida que se acerca y según lo que costó calcularlo
+      (XFetch): los procesos no llegan todos juntos al vencimiento.
+    - Solo recalcula quien consigue el lock (tomar_lock). Los demás devuelven el valor
+      anterior, que la cache conserva un `timeout` más; si no hay valor anterior, esperan
+      a que aparezca (hasta ESPERA_MAXIMA segundos) y recién ahí lo calculan ellos.
+    """
+    guardado = cache.get(clave)
+    if guardado is not None:
+        valor, vence, costo = guardado
+        if time.time() - costo * beta * math.log(1 - random.random()) < vence:
+            return valor
+
+    lock = tomar_lock(clave)
+    if lock is None:
+        if guardado is not None:
+            # Otro proceso ya lo está recalculando: mientras tanto sirve el valor anterior
+            return guardado[0]
+        for _ in range(int(ESPERA_MAXIMA / INTERVALO_ESPERA)):
+            time.sleep(INTERVALO_ESPERA)
+            guardado = cache.get(clave)
+            if guardado is not None:
+                return guardado[0]
+        return calcular()
+
+    try:
+        inicio = time.time()
+        valor = calcular()
+        costo = time.time() - inicio
+        cache.set(clave, (valor, time.time() + timeout, costo), timeout * 2)
+    finally:
+        soltar_lock(lock)
+    return valor
+
+
+def fragmento_versionado(nombre, partes, calcular, timeout=TIEMPO_FRAGMENTOS):
+    """
+    Devuelve el valor cacheado para (generación actual, nombre, partes) o lo calcula y lo guarda.
+    """
+    return obtener_o_calcular(clave_versionada(nombre, *partes), calcular, timeout)
@@ -0,0 +1,34 @@
+from django.db.models import Count, Q, Sum
+from .models import CAMPOS_CALIFICACIONES
+
+
+def recalcular_calificaciones(Producto=None, Review=None):
+    """
+    Vuelve a calcular desde cero los contadores de reseñas de todos los productos.
+    Los modelos se pueden pasar para usarlo desde una migración.
+    """
+    if Producto is None:
+        from .models import Producto, Review
+
+    conteos = {
+        fila['producto_id']: fila
+        for fila in Review.objects.order_by().values('producto_id').annotate(
+            cantidad=Count('id'),
+            suma=Sum('calificacion'),
+            **{f'e{i}': Count('id', filter=Q(calificacion=i)) for i in range(1, 6)},
+        )
+    }
+
+    productos = list(Producto.objects.only('id'))
+    for producto in productos:
+        fila = conteos.get(producto.id, {})
+        producto.calificaciones_cantidad = fila.get('cantidad', 0)
+        producto.calificaciones_suma = fila.get('suma') or 0
+        producto.calificacion_promedio = (
+            producto.calificaciones_suma / producto.calificaciones_cantidad if producto.calificaciones_cantidad else 0
+        )
+        for i in range(1, 6):
+            setattr(producto, f'estrellas_{i}', fila.get(f'e{i}', 0))
+
+    Producto.objects.bulk_update(productos, list(CAMPOS_CALIFICACIONES), batch_size=500)
+    return len(productos)
@@ -1,138 +1,200 @@
-from datetime import timedelta, datetime
+import uuid
+from datetime import datetime, timezone as dt_timezone
 from decimal import Decimal
-from django.conf import settings
 from tienda.models import Producto, Variante
-from django.utils import timezone
+from . import almacen_carrito, reservas
 
 class Carrito:
+    """
+    El carrito del visitante. El contenido vive en tienda/almacen_carrito.py (tabla ContenidoCarrito),
+    la sesión solo guarda el token que lo identifica (el mismo de las reservas de stock).
+    self.carrito es {cart_id: {"producto_id", "variante_id", "cantidad"}}.
+    """
+
     def __init__(self, request):
         self.request = request
         self.session = request.session
-        carrito = self.session.get("carrito")
-        ultimo_acceso = self.session.get("carrito_ultimo_acceso")
-
-        if ultimo_acceso:
-            try:
-                # Usamos timezone.now() que es "aware" (tiene zona horaria)
-                ahora = timezone.now()
-                # Parseamos la fecha guardada (isoformat guarda la info de zona horaria si se usó timezone)
-                tiempo_ultimo = datetime.fromisoformat(ultimo_acceso)
-                
-                # Si pasaron más de 2 horas (7200 segundos)
-                if ahora - tiempo_ultimo > timedelta(hours=2):
-                    carrito = {} # Vaciamos localmente
-                    self.session["carrito"] = {} # Vaciamos en sesión
-                    if "carrito_ultimo_acceso" in self.session:
-                        del self.session["carrito_ultimo_acceso"]
-            except (ValueError, TypeError): 
-                # TypeError captura errores de comparación naive/aware
-                pass
-
-        if not carrito:
-            carrito = self.session["carrito"] = {}
-            
-        self.carrito = carrito
+        # Si pasaron más de 2 horas desde el último cambio, el almacén lo da por vencido
+        # (las reservas vencen a la vez). Se lee una vez por request: la vista y la barra
+        # crean su propio Carrito pero comparten la lectura
+        token = self.session.get("carrito_token")
+        leido = getattr(request, '_contenido_carrito', None)
+        if leido is None or leido[0] != token:
+            leido = request._contenido_carrito = (token, *almacen_carrito.leer(token))
+        self.carrito = {clave: dict(item) for clave, item in leido[1].items()}
+        self._ultimo_cambio = leido[2]
+
+        if "carrito" in self.session:
+            self._migrar_de_la_sesion()
+
+        # Para escribir solo si el contenido cambió de verdad
+        self._guardado = almacen_carrito.codificar(self.carrito, 0)
+
+    def _migrar_de_la_sesion(self):
+        # Carritos creados cuando el contenido se guardaba en la sesión: se pasan al almacén una vez
+        viejo = self.session.pop("carrito") or {}
+        self.session.pop("carrito_ultimo_acceso", None)
+        for item in viejo.values():
+            clave = almacen_carrito.cart_id(item["producto_id"], item.get("variante_id"))
+            self.carrito[clave] = {
+                "producto_id": item["producto_id"],
+                "variante_id": item.get("variante_id"),
+                "cantidad": int(item["cantidad"]),
+            }
+        if self.carrito:
+            self._ultimo_cambio = almacen_carrito.guardar(self.token, self.carrito)
+            self._recordar_contenido()
+
+    @property
+    def token(self):
+        # Identifica las reservas de stock de este carrito (la sesión puede no tener clave todavía)
+        token = self.session.get("carrito_token")
+        if not token:
+            token = self.session["carrito_token"] = uuid.uuid4().hex
+        return token
+
+    @property
+    def ultimo_acceso(self):
+        # Hora del último cambio (de ahí corre el vencimiento de 2 horas); None si está vacío
+        if self._ultimo_cambio is None:
+            return None
+        return datetime.fromtimestamp(self._ultimo_cambio, tz=dt_timezone.utc)
+
+    @staticmethod
+    def nombre_linea(producto, variante=None):
+        return f"{producto.nombre} ({variante.nombre})" if variante else producto.nombre
 
     def agregar(self, producto, variante=None):
-        # 1. Definir precio base
-        if producto.en_oferta and producto.precio_oferta:
-            precio_final = producto.precio_oferta
-        else:
-            precio_final = producto.precio
-        
-        # 2. Definir ID única y Nombre
-        if variante:
-            cart_id = f"{producto.id}_{variante.id}" # ID única para la variante
-            nombre_mostrar = f"{producto.nombre} ({variante.nombre})"
-            # Si la variante tuviera precio distinto, se cambiaría aquí
-        else:
-            cart_id = str(producto.id) # ID normal para producto simple
-            nombre_mostrar = producto.nombre
+        """
+        Suma una unidad y la reserva. Lanza ValueError si no queda stock libre.
+        """
+        cart_id = almacen_carrito.cart_id(producto.id, variante.id if variante else None)
+
+        # Reservar la nueva cantidad antes de tocar el carrito
+        cantidad = self.carrito[cart_id]["cantidad"] + 1 if cart_id in self.carrito else 1
+        reservas.reservar(self.token, cart_id, producto, variante, cantidad, self.nombre_linea(producto, variante))
 
-        # 3. Agregar o Incrementar (Lógica Unificada)
+        # Agregar o Incrementar (Lógica Unificada)
         if cart_id not in self.carrito:
             self.carrito[cart_id] = {
                 "producto_id": producto.id,
                 "variante_id": variante.id if variante else None,
-                "nombre": nombre_mostrar,
-                "precio": str(precio_final),
                 "cantidad": 1,
-                "imagen": producto.imagen.url if producto.imagen else ""
             }
         else:
             self.carrito[cart_id]["cantidad"] += 1
-        
+
         self.guardar()
 
     def guardar(self):
-        self.session["carrito_ultimo_acceso"] = timezone.now().isoformat()
-        self.session["carrito"] = self.carrito
-        self.session.modified = True
+        self._olvidar_lineas()
+        codificado = almacen_carrito.codificar(self.carrito, 0)
+        if codificado == self._guardado:
+            return
+        reservas.renovar(self.token)
+        self._ultimo_cambio = almacen_carrito.guardar(self.token, self.carrito)
+        self._guardado = codificado
+        self._recordar_contenido()
 
     def eliminar(self, producto, variante=None):
-        if variante:
-            cart_id = f"{producto.id}_{variante.id}"
-        else:
-            cart_id = str(producto.id)
+        cart_id = almacen_carrito.cart_id(producto.id, variante.id if variante else None)
 
         if cart_id in self.carrito:
             del self.carrito[cart_id]
+            reservas.liberar(self.token, cart_id)
             self.guardar()
 
     def restar(self, producto, variante=None):
-        if variante:
-            cart_id = f"{producto.id}_{variante.id}"
-        else:
-            cart_id = str(producto.id)
+        cart_id = almacen_carrito.cart_id(producto.id, variante.id if variante else None)
 
         if cart_id in self.carrito:
             self.carrito[cart_id]["cantidad"] -= 1
             if self.carrito[cart_id]["cantidad"] < 1:
                 self.eliminar(producto, variante)
             else:
+                # Devolver unidades nunca falla: no hace falta validar
+                reservas.reservar(self.token, cart_id, producto, variante,
+                                  self.carrito[cart_id]["cantidad"], self.nombre_linea(producto, variante), validar=False)
                 self.guardar()
 
     def vaciar(self):
-        self.session["carrito"] = {}
-        if "carrito_ultimo_acceso" in self.session:
-            del self.session["carrito_ultimo_acceso"]
-        self.session.modified = True
-    
-    def obtener_total(self):
-            total = Decimal("0.00")
-            ids_a_eliminar = [] # Lista para limpiar productos que ya no existen en BD
-
-            for cart_id, item in self.carrito.items():
-                try:
-                    # 1. Obtenemos el producto real de la BD
-                    producto = Producto.objects.get(id=item["producto_id"])
-                    
-                    # 2. Determinamos el precio real actual
-                    if producto.en_oferta and producto.precio_oferta:
-                        precio_real = producto.precio_oferta
-                    else:
-                        precio_real = producto.precio
-                    
-                    # (Nota: Si las variantes tuvieran sobreprecio, aquí sumaríamos esa lógica)
-                    
-                    # 3. Sumamos al total
-                    total += precio_real * item["cantidad"]
-                    
-                    # Opcional: Actualizamos el precio en la sesión para que el usuario lo vea actualizado
-                    # en la lista de items sin recargar toda la lógica visual
-                    item["precio"] = str(precio_real)
-
-                except Producto.DoesNotExist:
-                    # Si el producto fue borrado de la tienda, lo marcamos para quitar del carrito
-                    ids_a_eliminar.append(cart_id)
-            
-            # Limpieza de items huerfanos
-            if ids_a_eliminar:
-                for cart_id in ids_a_eliminar:
-                    del self.carrito[cart_id]
-                self.guardar()
+        self._olvidar_lineas()
+        reservas.liberar(self.token)
+        almacen_carrito.borrar(self.token)
+        self.carrito = {}
+        self._ultimo_cambio = None
+        self._guardado = almacen_carrito.codificar(self.carrito, 0)
+        self._recordar_contenido()
+
+    def _recordar_contenido(self):
+        # Lo que leerá el próximo Carrito de este request
+        self.request._contenido_carrito = (
+            self.token, {clave: dict(item) for clave, item in self.carrito.items()}, self._ultimo_cambio,
+        )
+
+    def _olvidar_lineas(self):
+        # El carrito cambió: la próxima llamada a lineas() (o la barra) vuelve a consultar
+        self.request.__dict__.pop('_lineas_carrito', None)
+        self.request.__dict__.pop('_datos_encabezado', None)
+
+    def lineas(self):
+        """
+        Resuelve todas las líneas del carrito con dos consultas (una para productos
+        y otra para variantes) y guarda el resultado en el request: la vista y el
+        context processor crean su propio Carrito pero comparten estas líneas.
+
+        Cada línea es un dict con el item guardado, el producto, la variante, el nombre
+        y la foto para mostrar, la cantidad, el precio actual, el subtotal y el stock
+        disponible para este carrito (stock menos lo que reservaron los demás; una consulta más).
+        Los items cuyo producto o variante ya no existe se quitan del carrito.
+        """
+        lineas = getattr(self.request, '_lineas_carrito', None)
+        if lineas is not None:
+            return lineas
+
+        ids_productos = {item["producto_id"] for item in self.carrito.values()}
+        ids_variantes = {item["variante_id"] for item in self.carrito.values() if item.get("variante_id")}
+        productos = Producto.objects.in_bulk(ids_productos) if ids_productos else {}
+        variantes = Variante.objects.in_bulk(ids_variantes) if ids_variantes else {}
+        reservado = reservas.reservas_vigentes(ids_productos, excluir_token=self.token) if ids_productos else {}
 
-            return total
-    
-        
-   
\ No newline at end of file
+        lineas = []
+        ids_a_eliminar = []  # Productos o variantes que ya no existen en BD
+        for cart_id, item in self.carrito.items():
+            producto = productos.get(item["producto_id"])
+            variante = variantes.get(item["variante_id"]) if item.get("variante_id") else None
+            if producto is None or (item.get("variante_id") and variante is None):
+                ids_a_eliminar.append(cart_id)
+                continue
+
+            cantidad = int(item["cantidad"])
+            precio = producto.precio_actual
+            # (Nota: Si las variantes tuvieran sobreprecio, aquí sumaríamos esa lógica)
+            lineas.append({
+                "cart_id": cart_id,
+                "item": item,
+                "producto": producto,
+                "variante": variante,
+                "nombre": self.nombre_linea(producto, variante),
+                "imagen": producto.imagen.url if producto.imagen else "",
+                "cantidad": cantidad,
+                "precio": precio,
+                "subtotal": precio * cantidad,
+                "stock": (variante.stock if variante else producto.stock)
+                         - reservado.get((producto.id, variante.id if variante else None), 0),
+            })
+
+        # Limpieza de items huerfanos
+        if ids_a_eliminar:
+            for cart_id in ids_a_eliminar:
+                del self.carrito[cart_id]
+            self.guardar()
+
+        self.request._lineas_carrito = lineas
+        return lineas
+
+    def obtener_total(self):
+        total = Decimal("0.00")
+        for linea in self.lineas():
+            total += linea["subtotal"]
+        return total
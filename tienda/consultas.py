@@ -0,0 +1,194 @@
+"""
+Cuántas consultas hace cada request, cuánto tardan y cuáles se repiten (N+1).
+
+- Cada conexión a la base lleva un execute_wrapper (se instala al conectarse) que anota
+  las consultas en el registro de la request actual. El registro vive en una ContextVar,
+  así que también cuenta lo que corre en los hilos de sync_to_async (vistas async).
+- La "huella" de una consulta es su SQL sin valores: el mismo SELECT repetido con
+  otro id es la misma huella. Varias veces la misma huella en una request es un N+1
+  (BEGIN, COMMIT y los savepoints cuentan como consultas pero no tienen huella).
+- PresupuestoConsultasMiddleware compara con el presupuesto declarado para la URL
+  (setting TIENDA_PRESUPUESTO_CONSULTAS, por nombre de URL), avisa en el log y, con
+  TIENDA_PRESUPUESTO_ESTRICTO, lanza PresupuestoExcedido (los tests fallan). Solo se
+  instala con TIENDA_PRESUPUESTO_ACTIVO (por defecto, DEBUG): en producción no se cuenta
+  nada y el execute_wrapper se limita a ver que no hay registro.
+  Con TIENDA_CONSULTAS_ENCABEZADO agrega X-Consultas, X-Consultas-Ms y X-Consultas-Repetidas.
+- Para los tests: PresupuestoConsultasMixin.assertPresupuesto(...).
+"""
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+# A partir de cuántas veces la misma huella en una request la tomamos como N+1
+UMBRAL_REPETIDAS = 3
+
+_registro_actual = ContextVar('registro_consultas', default=None)
+
+_LISTA_PARAMETROS = re.compile(r"\(\s*%s(?:\s*,\s*%s)*\s*\)")
+_LITERALES = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_ESPACIOS = re.compile(r"\s+")
+# BEGIN, COMMIT y los savepoints se repiten en cualquier request con varias transacciones: no son N+1
+_TRANSACCION = re.compile(r"\s*(?:BEGIN|COMMIT|ROLLBACK|SAVEPOINT|RELEASE)\b", re.IGNORECASE)
+
+
+class PresupuestoExcedido(AssertionError):
+    pass
+
+
+def huella(sql):
+    """
+    El SQL sin valores: IN (%s, %s, %s) queda IN (...) y los números y textos sueltos, '?'.
+    """
+    sql = _LISTA_PARAMETROS.sub('(...)', sql)
+    sql = _LITERALES.sub('?', sql)
+    return _ESPACIOS.sub(' ', sql).strip()
+
+
+class RegistroConsultas:
+
+    def __init__(self, padre=None):
+        self.padre = padre
+        self.cantidad = 0
+        self.segundos = 0.0
+        self.huellas = Counter()
+
+    def anotar(self, sql, segundos):
+        registro = self
+        while registro is not None:
+            registro.cantidad += 1
+            registro.segundos += segundos
+            if not _TRANSACCION.match(sql):
+                registro.huellas[huella(sql)] += 1
+            registro = registro.padre
+
+    @property
+    def milisegundos(self):
+        return self.segundos * 1000
+
+    def repetidas(self, umbral=UMBRAL_REPETIDAS):
+        """
+        [(huella, veces)] de las consultas que se repitieron al menos `umbral` veces, de más a menos.
+        """
+        return [(sql, veces) for sql, veces in self.huellas.most_common() if veces >= umbral]
+
+    def resumen(self, limite=3):
+        lineas = [f"{self.cantidad} consultas en {self.milisegundos:.1f} ms"]
+        for sql, veces in self.repetidas()[:limite]:
+            lineas.append(f"  {veces}x {sql[:200]}")
+        return '\n'.join(lineas)
+
+
+@contextmanager
+def contar_consultas():
+    """
+    with contar_consultas() as registro: ... -> registro.cantidad, registro.repetidas()
+    Se pueden anidar: lo que cuenta el de adentro también lo cuenta el de afuera.
+    """
+    registro = RegistroConsultas(padre=_registro_actual.get())
+    token = _registro_actual.set(registro)
+    try:
+        yield registro
+    finally:
+        _registro_actual.reset(token)
+
+
+def _medir(execute, sql, params, many, context):
+    registro = _registro_actual.get()
+    if registro is None:
+        return execute(sql, params, many, context)
+    inicio = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        registro.anotar(sql, time.perf_counter() - inicio)
+
+
+@receiver(connection_created)
+def instalar_en_conexion(sender, connection, **kwargs):
+    # connection_created se repite si la conexión se reabre: se instala una sola vez
+    if _medir not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_medir)
+
+
+def presupuesto_de(request):
+    """
+    Máximo de consultas declarado para la URL de esta request (por nombre), o None.
+    """
+    coincidencia = getattr(request, 'resolver_match', None)
+    if coincidencia is None:
+        return None
+    return getattr(settings, 'TIENDA_PRESUPUESTO_CONSULTAS', {}).get(coincidencia.view_name)
+
+
+class PresupuestoConsultasMiddleware:
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'TIENDA_PRESUPUESTO_ACTIVO', settings.DEBUG):
+            # Django lo saca de la cadena: ni contar ni revisar en cada request
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with contar_consultas() as registro:
+            respuesta = self.get_response(request)
+        return self._revisar(request, respuesta, registro)
+
+    async def __acall__(self, request):
+        with contar_consultas() as registro:
+            respuesta = await self.get_response(request)
+        return self._revisar(request, respuesta, registro)
+
+    def _revisar(self, request, respuesta, registro):
+        repetidas = registro.repetidas()
+        if getattr(settings, 'TIENDA_CONSULTAS_ENCABEZADO', settings.DEBUG):
+            respuesta['X-Consultas'] = registro.cantidad
+            respuesta['X-Consultas-Ms'] = f"{registro.milisegundos:.1f}"
+            respuesta['X-Consultas-Repetidas'] = repetidas[0][1] if repetidas else 0
+
+        presupuesto = presupuesto_de(request)
+        problemas = []
+        if presupuesto is not None and registro.cantidad > presupuesto:
+            problemas.append(f"supera el presupuesto de {presupuesto} consultas")
+        if repetidas:
+            problemas.append("repite consultas (N+1)")
+        if problemas:
+            mensaje = f"{request.method} {request.path} {' y '.join(problemas)}: {registro.resumen()}"
+            if getattr(settings, 'TIENDA_PRESUPUESTO_ESTRICTO', False):
+                raise PresupuestoExcedido(mensaje)
+            logger.warning(mensaje)
+        return respuesta
+
+
+class PresupuestoConsultasMixin:
+    """
+    Para TestCase: falla si el bloque hace más consultas que `maximo` o repite alguna
+    al menos `umbral` veces.
+
+        with self.assertPresupuesto(6):
+            self.client.get(reverse('mis_compras'))
+    """
+
+    @contextmanager
+    def assertPresupuesto(self, maximo=None, umbral=UMBRAL_REPETIDAS):
+        with contar_consultas() as registro:
+            yield registro
+        if maximo is not None and registro.cantidad > maximo:
+            self.fail(f"Se esperaban como mucho {maximo} consultas. {registro.resumen()}")
+        if registro.repetidas(umbral):
+            self.fail(f"Consultas repetidas (N+1). {registro.resumen()}")
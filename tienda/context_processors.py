@@ -1,13 +1,82 @@
+from functools import cached_property
+from django.core.files.storage import default_storage
 from .carrito import Carrito
+from .models import Perfil
+
+
+class DatosEncabezado:
+    """
+    Lo que muestra la barra de todas las páginas: carrito, favoritos y foto del usuario.
+    Cada dato se calcula la primera vez que un template lo lee y queda guardado
+    para el resto de la request (ver datos_encabezado).
+    """
+
+    def __init__(self, request):
+        self.request = request
+
+    @cached_property
+    def carrito(self):
+        return Carrito(self.request)
+
+    @cached_property
+    def carrito_lineas(self):
+        # Sale del almacén del carrito: una consulta, y ninguna si el visitante no tiene carrito
+        return len(self.carrito.carrito)
+
+    @cached_property
+    def carrito_cantidad(self):
+        return sum(item['cantidad'] for item in self.carrito.carrito.values())
+
+    @cached_property
+    def carrito_total(self):
+        # Dos o tres consultas; las líneas quedan en el request y la vista del carrito las reutiliza
+        return self.carrito.obtener_total()
+
+    @cached_property
+    def favoritos_ids(self):
+        # Una consulta para toda la página: las tarjetas preguntan "joya.id in favoritos_ids"
+        usuario = self.request.user
+        if not usuario.is_authenticated:
+            return frozenset()
+        return frozenset(usuario.favoritos.values_list('producto_id', flat=True))
+
+    @cached_property
+    def favoritos_cantidad(self):
+        return len(self.favoritos_ids)
+
+    @cached_property
+    def avatar_url(self):
+        usuario = self.request.user
+        if not usuario.is_authenticated:
+            return ''
+        try:
+            foto = usuario.perfil.foto
+        except Perfil.DoesNotExist:
+            return ''
+        if not foto:
+            return ''
+        # La derivada más chica alcanza para el círculo de la barra
+        manifiesto = usuario.perfil.foto_derivadas or {}
+        formatos = manifiesto.get('formatos') or {}
+        if manifiesto.get('origen') == foto.name and formatos:
+            return default_storage.url(next(iter(formatos.values()))[0]['nombre'])
+        return foto.url
+
+
+def datos_encabezado(request):
+    datos = getattr(request, '_datos_encabezado', None)
+    if datos is None:
+        datos = request._datos_encabezado = DatosEncabezado(request)
+    return datos
+
 
 def carrito_context(request):
     """
-    Context processor para disponibilizar datos del carrito en todos los templates.
+    Context processor para disponibilizar datos del carrito y del usuario en todos los templates
+    ({{ encabezado.carrito_lineas }}, {{ encabezado.carrito_total }}, {{ encabezado.avatar_url }}...).
+    Cada dato se calcula recién cuando un template lo lee: una página (o un fragmento AJAX)
+    que no los muestra no paga nada.
     """
-    carrito = Carrito(request)
-    cantidad_total = sum(int(item['cantidad']) for item in carrito.carrito.values())
-    
-    return {
-        'carrito_total_monto': carrito.obtener_total(),
-        'carrito_cantidad_items': cantidad_total
-    }
+    if not hasattr(request, 'session'):
+        return {}
+    return {'encabezado': datos_encabezado(request)}
@@ -0,0 +1,29 @@
+import copy
+import os
+import tempfile
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class EjecutorPruebas(DiscoverRunner):
+    """
+    El runner de siempre, pero la cache en disco y los locks van a una carpeta temporal
+    que se borra al terminar: la cache de settings es compartida por todos los procesos
+    de la máquina y los tests la vacían (cache.clear()) y la llenan con datos de la base de prueba.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._carpeta = tempfile.TemporaryDirectory(prefix='tormenta_tests_')
+        caches = copy.deepcopy(settings.CACHES)
+        for nombre, ajustes in caches.items():
+            if ajustes['BACKEND'].endswith('FileBasedCache'):
+                ajustes['LOCATION'] = os.path.join(self._carpeta.name, nombre)
+        self._ajustes = override_settings(CACHES=caches, TIENDA_LOCKS_DIR=os.path.join(self._carpeta.name, 'locks'))
+        self._ajustes.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._ajustes.disable()
+        self._carpeta.cleanup()
+        super().teardown_test_environment(**kwargs)
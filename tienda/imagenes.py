@@ -0,0 +1,356 @@
+import base64
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+from io import BytesIO
+from PIL import Image
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from concurrent.futures import ThreadPoolExecutor
+from django.apps import apps
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .utils import comprimir_imagen, reducir_imagen, tamano_visible, ImagenDemasiadoGrande
+from .storage import hash_contenido, liberar_archivo, tocar
+
+logger = logging.getLogger(__name__)
+
+# Cómo se comprimen las fotos subidas (setting TIENDA_IMAGENES_MODO):
+#   'sincronico': dentro del save(), como siempre (lo usan los tests)
+#   'hilo': se guarda el original y un hilo del mismo proceso la comprime al confirmar la transacción
+#   'cola': se guarda el original y la comprime el comando procesar_imagenes (cron o worker aparte)
+MODO_SINCRONICO = 'sincronico'
+MODO_HILO = 'hilo'
+MODO_COLA = 'cola'
+
+# Reintentos antes de dejar un trabajo en ERROR
+MAX_INTENTOS = 3
+
+# Un trabajo que sigue en PROCESANDO después de esto quedó huérfano (se cortó el hilo o se
+# reinició el worker): procesar_pendientes lo vuelve a encolar
+TIEMPO_MAXIMO_PROCESANDO = timedelta(minutes=10)
+
+# En modo 'hilo' no hace falta cron para los reintentos ni los colgados: cada proceso barre
+# los pendientes (procesar_pendientes) a lo sumo una vez cada BARRIDO_CADA segundos, al
+# encolar o cuando falla un trabajo, y vuelve a barrer mientras quede alguno sin terminar
+BARRIDO_CADA = 60
+
+# Escalera de anchos y formatos de las derivadas (settings TIENDA_IMAGENES_ANCHOS / _FORMATOS).
+# El orden de los formatos es el de preferencia: el último es el de respaldo del <img>.
+ANCHOS_DERIVADAS = (200, 400, 800, 1600)
+FORMATOS_DERIVADAS = ('webp', 'jpeg')
+CALIDAD = {'jpeg': 82, 'webp': 78, 'avif': 55}
+CARPETA_DERIVADAS = 'derivadas'
+
+# Marcador de baja calidad (LQIP): la foto a 20 px, borrosa, embebida en el HTML como data URI.
+# Pesa unos cientos de bytes y se ve mientras carga la foto de verdad.
+ANCHO_MARCADOR = 20
+
+_ejecutor = None
+_lock_ejecutor = threading.Lock()
+_ultimo_barrido = None
+_barrido_programado = False
+
+
+def modo():
+    return getattr(settings, 'TIENDA_IMAGENES_MODO', MODO_HILO)
+
+
+def _obtener_ejecutor():
+    global _ejecutor
+    with _lock_ejecutor:
+        if _ejecutor is None:
+            _ejecutor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'TIENDA_IMAGENES_HILOS', 2),
+                thread_name_prefix='imagenes',
+            )
+    return _ejecutor
+
+
+def anchos_derivadas():
+    return tuple(getattr(settings, 'TIENDA_IMAGENES_ANCHOS', ANCHOS_DERIVADAS))
+
+
+def formatos_derivadas():
+    # Solo los que este Pillow sabe escribir (AVIF depende de cómo se compiló)
+    formatos = getattr(settings, 'TIENDA_IMAGENES_FORMATOS', FORMATOS_DERIVADAS)
+    Image.init()
+    return tuple(f for f in formatos if f.upper() in Image.SAVE)
+
+
+def generar_marcador(img):
+    """
+    Data URI con la foto reducida a ANCHO_MARCADOR px (WebP si este Pillow lo escribe, si no JPEG).
+    """
+    alto = max(1, round(img.height * ANCHO_MARCADOR / img.width))
+    miniatura = img.resize((ANCHO_MARCADOR, alto), Image.Resampling.BILINEAR, reducing_gap=2.0)
+    formato = 'webp' if 'WEBP' in Image.SAVE else 'jpeg'
+    if formato == 'jpeg' and miniatura.mode != 'RGB':
+        miniatura = miniatura.convert('RGB')
+    salida = BytesIO()
+    miniatura.save(salida, format=formato.upper(), quality=40)
+    return f"data:image/{formato};base64,{base64.b64encode(salida.getvalue()).decode('ascii')}"
+
+
+def generar_derivadas(archivo, anchos=None, formatos=None):
+    """
+    Genera versiones de `archivo` en cada ancho de la escalera (sin agrandar) y en cada formato,
+    más el marcador borroso. Los nombres salen del hash del contenido, así que volver a generar
+    la misma foto no crea archivos nuevos. Devuelve el manifiesto que se guarda en el modelo:
+    {'origen': nombre, 'ancho': w, 'alto': h, 'lqip': 'data:image/webp;base64,...',
+     'formatos': {'webp': [{'ancho': 400, 'nombre': ...}], ...}}
+    """
+    anchos = anchos or anchos_derivadas()
+    formatos = formatos or formatos_derivadas()
+    # Las derivadas ya tienen nombres derivados del hash: van al storage común, sin renombrar
+    storage = default_storage
+
+    # Se lee por partes para el hash y se decodifica ya reducida al ancho más grande:
+    # una foto de 48 MP del celular nunca se carga entera en memoria
+    archivo.open('rb')
+    try:
+        resumen = hash_contenido(archivo)[:16]
+        img = Image.open(archivo)
+        ancho_original, alto_original = tamano_visible(img)
+        img = reducir_imagen(img, max(anchos))
+    finally:
+        archivo.close()
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA' if 'transparency' in img.info or img.mode in ('LA', 'P') else 'RGB')
+
+    # Nunca agrandamos: el ancho original entra como último escalón si la escalera lo supera
+    escalera = sorted({a for a in anchos if a < ancho_original} | {min(ancho_original, max(anchos))})
+
+    manifiesto = {
+        'origen': archivo.name, 'ancho': ancho_original, 'alto': alto_original,
+        'lqip': generar_marcador(img), 'formatos': {},
+    }
+    for formato in formatos:
+        versiones = []
+        for ancho in escalera:
+            nombre = f"{CARPETA_DERIVADAS}/{resumen}-{ancho}.{'jpg' if formato == 'jpeg' else formato}"
+            # Si ya existe (otra foto con el mismo contenido) se toca, como en AlmacenamientoPorContenido
+            if not tocar(storage, nombre):
+                alto = max(1, round(img.height * ancho / img.width))
+                version = img.resize((ancho, alto), Image.Resampling.LANCZOS, reducing_gap=3.0) if ancho != img.width else img
+                if formato == 'jpeg' and version.mode != 'RGB':
+                    version = version.convert('RGB')
+                salida = BytesIO()
+                version.save(salida, format=formato.upper(), quality=CALIDAD.get(formato, 80), optimize=True)
+                storage.save(nombre, ContentFile(salida.getvalue()))
+            versiones.append({'ancho': ancho, 'nombre': nombre})
+        manifiesto['formatos'][formato] = versiones
+    return manifiesto
+
+
+def actualizar_derivadas(instancia, campo):
+    """
+    Genera las derivadas de la imagen actual y guarda el manifiesto con un update()
+    condicional (solo si la imagen no cambió mientras tanto). Devuelve el manifiesto o None.
+    """
+    archivo = getattr(instancia, campo)
+    if not archivo:
+        return None
+    manifiesto = generar_derivadas(archivo)
+    cambiadas = type(instancia).objects.filter(pk=instancia.pk, **{campo: archivo.name}).update(
+        **{f'{campo}_derivadas': manifiesto}
+    )
+    if not cambiadas:
+        return None
+    setattr(instancia, f'{campo}_derivadas', manifiesto)
+    return manifiesto
+
+
+def encolar_compresion(instancia, campo, ancho):
+    """
+    Registra la compresión de `instancia.<campo>` (ya guardada con el original).
+    En modo 'hilo' la lanza en segundo plano cuando se confirma la transacción;
+    en modo 'sincronico' la hace en el momento.
+    """
+    from .models import TrabajoImagen
+
+    trabajo = TrabajoImagen.objects.create(
+        modelo=instancia._meta.label,
+        objeto_id=instancia.pk,
+        campo=campo,
+        archivo=getattr(instancia, campo).name,
+        ancho=ancho,
+    )
+    if modo() == MODO_HILO:
+        transaction.on_commit(lambda: _lanzar_en_hilo(trabajo.id))
+    elif modo() == MODO_SINCRONICO:
+        procesar_trabajo(trabajo.id)
+        # El original ya no existe: la instancia tiene que ver el archivo optimizado
+        instancia.refresh_from_db(fields=[campo, f'{campo}_derivadas'])
+    return trabajo
+
+
+def _lanzar_en_hilo(trabajo_id):
+    _obtener_ejecutor().submit(_procesar_en_hilo, trabajo_id)
+    # De paso, lo que otros dejaron pendiente
+    barrer_pendientes()
+
+
+def _procesar_en_hilo(trabajo_id):
+    try:
+        if procesar_trabajo(trabajo_id) is False:
+            # Volvió a PENDIENTE (o quedó en ERROR): el reintento lo hace el barrido
+            _programar_barrido()
+    finally:
+        # Cada hilo abre su propia conexión: la cerramos para no dejarla colgada
+        connection.close()
+
+
+def barrer_pendientes():
+    """
+    Modo 'hilo': procesa en segundo plano lo que quedó pendiente (reintentos y trabajos
+    de un worker que se reinició), si no se barrió hace menos de BARRIDO_CADA segundos.
+    """
+    global _ultimo_barrido
+    with _lock_ejecutor:
+        ahora = time.monotonic()
+        if _ultimo_barrido is not None and ahora - _ultimo_barrido < BARRIDO_CADA:
+            return False
+        _ultimo_barrido = ahora
+    _obtener_ejecutor().submit(_barrer_en_hilo)
+    return True
+
+
+def _programar_barrido():
+    # Un solo barrido en espera por proceso; el hilo del Timer no frena el apagado
+    global _barrido_programado
+    with _lock_ejecutor:
+        if _barrido_programado:
+            return
+        _barrido_programado = True
+
+    def disparar():
+        global _barrido_programado
+        with _lock_ejecutor:
+            _barrido_programado = False
+        barrer_pendientes()
+
+    timer = threading.Timer(BARRIDO_CADA, disparar)
+    timer.daemon = True
+    timer.start()
+
+
+def _barrer_en_hilo():
+    from .models import TrabajoImagen
+
+    try:
+        procesar_pendientes()
+        # Quedan reintentos o trabajos que todavía no llegan a TIEMPO_MAXIMO_PROCESANDO: otra vuelta más tarde
+        if TrabajoImagen.objects.filter(estado__in=['PENDIENTE', 'PROCESANDO']).exists():
+            _programar_barrido()
+    except Exception:
+        logger.exception("Falló el barrido de imágenes pendientes")
+    finally:
+        connection.close()
+
+
+def procesar_trabajo(trabajo_id):
+    """
+    Genera las derivadas a partir del original (para tener los anchos grandes)
+    y después lo reemplaza por la versión comprimida.
+    Devuelve True si el trabajo quedó LISTO, False si falló y None si ya lo tomó otro worker.
+    """
+    from .models import TrabajoImagen
+    from .cache import invalidar_catalogo
+
+    # Lo tomamos de forma atómica: si otro worker ya lo agarró, no hacemos nada
+    tomado = TrabajoImagen.objects.filter(id=trabajo_id, estado='PENDIENTE').update(
+        estado='PROCESANDO', intentos=F('intentos') + 1, tomado_en=timezone.now()
+    )
+    if not tomado:
+        return None
+    trabajo = TrabajoImagen.objects.get(id=trabajo_id)
+    modelo = apps.get_model(trabajo.modelo)
+
+    try:
+        instancia = modelo.objects.filter(pk=trabajo.objeto_id).first()
+        archivo = getattr(instancia, trabajo.campo) if instancia else None
+        if archivo is None or archivo.name != trabajo.archivo:
+            # Se borró el objeto o ya subieron otra foto (que tiene su propio trabajo)
+            trabajo.estado = 'LISTO'
+            trabajo.save(update_fields=['estado', 'actualizado'])
+            return True
+
+        manifiesto = generar_derivadas(archivo)
+
+        archivo.open('rb')
+        try:
+            optimizada = comprimir_imagen(archivo, nuevo_ancho=trabajo.ancho)
+        finally:
+            archivo.close()
+        original = archivo.name
+        if optimizada is not archivo:
+            archivo.save(os.path.basename(optimizada.name), optimizada, save=False)
+        # update() condicional: no pisa una foto que se haya subido mientras tanto
+        # y no vuelve a pasar por save() (que encolaría otro trabajo)
+        manifiesto['origen'] = archivo.name
+        cambiadas = modelo.objects.filter(pk=instancia.pk, **{trabajo.campo: original}).update(
+            **{trabajo.campo: archivo.name, f'{trabajo.campo}_derivadas': manifiesto}
+        )
+        if cambiadas:
+            invalidar_catalogo()
+
+        trabajo.estado = 'LISTO'
+        trabajo.error = ''
+        trabajo.save(update_fields=['estado', 'error', 'actualizado'])
+
+        # Con el trabajo cerrado ya nadie apunta al archivo que sobra (salvo otra fila con la misma foto)
+        if archivo.name != original:
+            liberar_archivo(archivo.storage, original if cambiadas else archivo.name, tocado_antes_de=trabajo.tomado_en)
+        return True
+    except Exception as e:
+        logger.exception("Falló la compresión de %s", trabajo)
+        # Una foto demasiado grande va a fallar siempre: no tiene sentido reintentarla
+        reintentar = trabajo.intentos < MAX_INTENTOS and not isinstance(e, ImagenDemasiadoGrande)
+        trabajo.estado = 'PENDIENTE' if reintentar else 'ERROR'
+        trabajo.error = str(e)
+        trabajo.save(update_fields=['estado', 'error', 'actualizado'])
+        return False
+
+
+def recuperar_colgados():
+    """
+    Vuelve a encolar los trabajos que quedaron en PROCESANDO más de TIEMPO_MAXIMO_PROCESANDO
+    (o los pasa a ERROR si ya usaron todos sus intentos). Devuelve cuántos recuperó.
+    """
+    from .models import TrabajoImagen
+
+    limite = timezone.now() - TIEMPO_MAXIMO_PROCESANDO
+    # Los tomados antes de que existiera tomado_en solo tienen la fecha de creación
+    colgados = TrabajoImagen.objects.filter(
+        Q(tomado_en__lt=limite) | Q(tomado_en__isnull=True, creado__lt=limite), estado='PROCESANDO',
+    )
+    agotados = colgados.filter(intentos__gte=MAX_INTENTOS).update(
+        estado='ERROR', error="Se cortó el proceso en cada intento", actualizado=timezone.now()
+    )
+    return agotados + colgados.update(estado='PENDIENTE', actualizado=timezone.now())
+
+
+def procesar_pendientes(limite=None):
+    """
+    Procesa los trabajos pendientes en orden de llegada, incluidos los que quedaron
+    colgados en PROCESANDO. Devuelve (listos, fallidos).
+    """
+    from .models import TrabajoImagen
+
+    recuperar_colgados()
+    ids = TrabajoImagen.objects.filter(estado='PENDIENTE').order_by('id').values_list('id', flat=True)
+    if limite:
+        ids = ids[:limite]
+    listos = fallidos = 0
+    for trabajo_id in list(ids):
+        resultado = procesar_trabajo(trabajo_id)
+        if resultado:
+            listos += 1
+        elif resultado is False:
+            fallidos += 1
+    return listos, fallidos
@@ -0,0 +1,334 @@
+"""
+Alta masiva de productos desde una planilla (CSV o JSONL) con sus fotos.
+
+Las fotos se comprimen en un pool de procesos (una foto por núcleo) y los productos
+y variantes se escriben de a lotes con bulk_create/bulk_update, cada lote en su
+propia transacción. El código (SKU) identifica cada producto, así que volver a
+correr la misma planilla actualiza en lugar de duplicar: si se corta a la mitad,
+alcanza con relanzarla (las fotos de los productos que ya la tienen no se vuelven a procesar).
+Si un lote falla, se borran las fotos que ese lote dejó escritas y que nadie más usa.
+"""
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from django.db import connections, transaction
+from django.utils.text import slugify
+
+# Columnas de la planilla. Obligatorias: codigo, nombre y precio.
+#   variantes: "Talle 6:3 | Talle 7:2" en CSV, o [{"nombre": "Talle 6", "stock": 3}, ...] en JSONL
+#   imagen: ruta relativa a la carpeta de imágenes (por defecto, la de la planilla)
+COLUMNAS = ('codigo', 'nombre', 'precio', 'stock', 'categoria', 'descripcion', 'precio_oferta', 'imagen', 'variantes')
+
+TAMANO_LOTE = 500
+ANCHO_PRODUCTO = 800  # El mismo que usa Producto.save()
+
+# Campos que la importación pisa en los productos que ya existían
+CAMPOS_IMPORTADOS = (
+    'nombre', 'precio', 'stock', 'categoria', 'descripcion', 'en_oferta', 'precio_oferta',
+    'nombre_busqueda', 'texto_busqueda',
+)
+
+
+@dataclass
+class ResultadoImportacion:
+    creados: int = 0
+    actualizados: int = 0
+    variantes: int = 0
+    imagenes: int = 0
+    filas: int = 0
+    errores: list = field(default_factory=list)
+
+
+# --- LECTURA DE LA PLANILLA ---
+def leer_filas(ruta):
+    """
+    Devuelve (numero_de_linea, dict) por cada fila del CSV o JSONL, sin cargar el archivo entero.
+    """
+    with open(ruta, encoding='utf-8-sig', newline='') as archivo:
+        if ruta.lower().endswith(('.jsonl', '.json')):
+            for numero, linea in enumerate(archivo, start=1):
+                if linea.strip():
+                    yield numero, json.loads(linea)
+        else:
+            # La línea 1 es el encabezado
+            for numero, fila in enumerate(csv.DictReader(archivo), start=2):
+                yield numero, fila
+
+
+def _decimal(valor, columna):
+    try:
+        return Decimal(str(valor).strip().replace(',', '.'))
+    except (InvalidOperation, ValueError):
+        raise ValueError(f"{columna} inválido: {valor!r}")
+
+
+def _variantes(valor):
+    if not valor:
+        return []
+    if isinstance(valor, str):
+        valor = [
+            dict(zip(('nombre', 'stock'), parte.rsplit(':', 1))) if ':' in parte else {'nombre': parte}
+            for parte in (p.strip() for p in valor.split('|')) if parte
+        ]
+    return [{'nombre': str(v['nombre']).strip(), 'stock': int(v.get('stock') or 0)} for v in valor]
+
+
+def normalizar_fila(fila):
+    """
+    Valida una fila y la lleva a tipos de Python. Lanza ValueError con un mensaje para el informe.
+    """
+    datos = {k: (v.strip() if isinstance(v, str) else v) for k, v in fila.items() if k in COLUMNAS}
+    for obligatoria in ('codigo', 'nombre', 'precio'):
+        if datos.get(obligatoria) in (None, ''):
+            raise ValueError(f"falta la columna {obligatoria}")
+
+    variantes = _variantes(datos.get('variantes'))
+    precio_oferta = _decimal(datos['precio_oferta'], 'precio_oferta') if datos.get('precio_oferta') else None
+    stock = datos.get('stock')
+    return {
+        'codigo': str(datos['codigo']),
+        'nombre': datos['nombre'],
+        'precio': _decimal(datos['precio'], 'precio'),
+        # Sin stock explícito, el de las variantes
+        'stock': int(stock) if stock not in (None, '') else sum(v['stock'] for v in variantes),
+        'categoria': datos.get('categoria') or None,
+        'descripcion': datos.get('descripcion') or '',
+        'precio_oferta': precio_oferta,
+        'imagen': datos.get('imagen') or None,
+        'variantes': variantes,
+    }
+
+
+# --- FOTOS (corre en los procesos del pool) ---
+def _inicializar_proceso():
+    # Los procesos nuevos (spawn/forkserver) arrancan sin Django configurado
+    import django
+    django.setup()
+
+
+def procesar_foto(ruta):
+    """
+    Genera las derivadas de la foto y usa la de ANCHO_PRODUCTO en JPEG como imagen del producto
+    (el original se decodifica una sola vez). Devuelve (nombre en el storage, manifiesto de derivadas).
+    No toca la base de datos.
+    """
+    from django.core.files import File
+    from django.core.files.storage import default_storage
+    from .imagenes import generar_derivadas
+    from .storage import almacenamiento_media
+    from .utils import comprimir_imagen
+
+    # Las derivadas salen del original (para tener los anchos grandes); generar_derivadas lo cierra
+    manifiesto = generar_derivadas(File(open(ruta, 'rb'), name=ruta))
+    destino = f"joyas/{os.path.splitext(os.path.basename(ruta))[0]}.jpg"
+    ancho = min(ANCHO_PRODUCTO, manifiesto['ancho'])
+    derivada = next((v['nombre'] for v in manifiesto['formatos'].get('jpeg', []) if v['ancho'] == ancho), None)
+    if derivada:
+        with default_storage.open(derivada, 'rb') as archivo:
+            nombre = almacenamiento_media.save(destino, archivo)
+    else:
+        # La escalera configurada no tiene ese ancho en JPEG: se comprime aparte, como antes
+        with open(ruta, 'rb') as archivo:
+            optimizada = comprimir_imagen(File(archivo, name=os.path.basename(ruta)), nuevo_ancho=ANCHO_PRODUCTO)
+            nombre = almacenamiento_media.save(f"joyas/{os.path.basename(optimizada.name)}", optimizada)
+    manifiesto['origen'] = nombre
+    return nombre, manifiesto
+
+
+def _procesar_foto_segura(ruta):
+    # Las excepciones tienen que volver como texto: algunas no se pueden serializar entre procesos
+    try:
+        return procesar_foto(ruta)
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def descartar_fotos(fotos):
+    """
+    Borra las fotos de un lote que no se llegó a guardar (y sus derivadas), salvo las que
+    ya usa otra fila: los nombres salen del contenido, así que pueden estar compartidas.
+    """
+    from django.core.files.storage import default_storage
+    from .storage import almacenamiento_media, archivos_referenciados
+
+    referencias = archivos_referenciados()
+    for nombre, manifiesto in fotos.values():
+        if not referencias[nombre]:
+            almacenamiento_media.delete(nombre)
+        for versiones in manifiesto['formatos'].values():
+            for version in versiones:
+                if not referencias[version['nombre']]:
+                    default_storage.delete(version['nombre'])
+
+
+# --- ESCRITURA DE LOS LOTES ---
+def _categorias(nombres):
+    """
+    {texto de la planilla: id} creando las que falten. Se aceptan el slug o el nombre.
+    """
+    from .models import Categoria
+
+    slugs = {nombre: slugify(nombre) for nombre in nombres if nombre}
+    existentes = Categoria.objects.in_bulk(set(slugs.values()), field_name='slug')
+    faltantes = {slug: nombre for nombre, slug in slugs.items() if slug not in existentes}
+    if faltantes:
+        Categoria.objects.bulk_create(
+            [Categoria(nombre=nombre, slug=slug) for slug, nombre in faltantes.items()], ignore_conflicts=True
+        )
+        existentes = Categoria.objects.in_bulk(set(slugs.values()), field_name='slug')
+    return {nombre: existentes[slug].id for nombre, slug in slugs.items()}
+
+
+def _importar_lote(filas, fotos, resultado):
+    """
+    Escribe un lote ya validado. `fotos` es {ruta: (nombre, manifiesto)} para las que se procesaron.
+    Devuelve los ids de las categorías cuyos relacionados hay que recalcular.
+    """
+    from .busqueda import obtener_motor
+    from .models import Producto, Variante
+
+    categorias = _categorias({fila['categoria'] for fila in filas})
+    existentes = Producto.objects.in_bulk([fila['codigo'] for fila in filas], field_name='codigo')
+    tocadas = {p.categoria_id for p in existentes.values()}
+
+    nuevos, actualizados = [], []
+    for fila in filas:
+        producto = existentes.get(fila['codigo']) or Producto(codigo=fila['codigo'])
+        producto.nombre = fila['nombre']
+        producto.precio = fila['precio']
+        producto.stock = fila['stock']
+        producto.categoria_id = categorias.get(fila['categoria'])
+        producto.descripcion = fila['descripcion']
+        producto.precio_oferta = fila['precio_oferta']
+        producto.en_oferta = fila['precio_oferta'] is not None
+        # bulk_create/bulk_update no pasan por save(): las claves de búsqueda se calculan a mano
+        producto.actualizar_claves_busqueda()
+        if fila['imagen'] in fotos:
+            producto.imagen, producto.imagen_derivadas = fotos[fila['imagen']]
+        tocadas.add(producto.categoria_id)
+        (actualizados if producto.pk else nuevos).append(producto)
+
+    campos = list(CAMPOS_IMPORTADOS)
+    if fotos:
+        campos += ['imagen', 'imagen_derivadas']
+
+    with transaction.atomic():
+        Producto.objects.bulk_create(nuevos)
+        Producto.objects.bulk_update(actualizados, campos)
+
+        # Variantes: se actualiza el stock de las que ya existen (por nombre) y se crean las nuevas
+        productos = {p.codigo: p for p in nuevos + actualizados}
+        actuales = {
+            (v.producto_id, v.nombre): v
+            for v in Variante.objects.filter(producto__in=[p.pk for p in actualizados])
+        }
+        variantes_nuevas, variantes_actualizadas = [], []
+        for fila in filas:
+            producto = productos[fila['codigo']]
+            for datos in fila['variantes']:
+                variante = actuales.get((producto.pk, datos['nombre']))
+                if variante is None:
+                    variantes_nuevas.append(Variante(producto=producto, nombre=datos['nombre'], stock=datos['stock']))
+                else:
+                    variante.stock = datos['stock']
+                    variantes_actualizadas.append(variante)
+        Variante.objects.bulk_create(variantes_nuevas)
+        Variante.objects.bulk_update(variantes_actualizadas, ['stock'])
+
+        # Lo que harían las señales de post_save, de una vez por lote
+        obtener_motor().indexar_lote(productos.values())
+
+    resultado.creados += len(nuevos)
+    resultado.actualizados += len(actualizados)
+    resultado.variantes += len(variantes_nuevas) + len(variantes_actualizadas)
+    return tocadas
+
+
+def importar(ruta, carpeta_imagenes=None, procesos=None, lote=TAMANO_LOTE, reemplazar_imagenes=False, progreso=None):
+    """
+    Importa la planilla `ruta`. `procesos` es el tamaño del pool de fotos
+    (None = un proceso por núcleo; 1 = en este mismo proceso, sin pool).
+    `progreso(resultado, segundos)` se llama después de cada lote.
+    Devuelve un ResultadoImportacion.
+    """
+    from .autocompletado import indice_autocompletado
+    from .cache import invalidar_catalogo
+    from .models import Producto
+    from .relacionados import recalcular_categoria
+
+    carpeta_imagenes = carpeta_imagenes or os.path.dirname(os.path.abspath(ruta))
+    procesos = procesos or os.cpu_count() or 1
+    resultado = ResultadoImportacion()
+    inicio = time.monotonic()
+    categorias_tocadas = set()
+
+    pool = None
+    if procesos > 1:
+        # Los hijos no usan la base, pero no tienen por qué heredar las conexiones abiertas
+        connections.close_all()
+        pool = ProcessPoolExecutor(max_workers=procesos, initializer=_inicializar_proceso)
+
+    try:
+        filas = leer_filas(ruta)
+        while True:
+            crudas = list(islice(filas, lote))
+            if not crudas:
+                break
+            resultado.filas += len(crudas)
+
+            validas = {}
+            for numero, cruda in crudas:
+                try:
+                    fila = normalizar_fila(cruda)
+                except (ValueError, TypeError, KeyError) as e:
+                    resultado.errores.append((numero, str(e)))
+                    continue
+                if fila['imagen']:
+                    fila['imagen'] = os.path.join(carpeta_imagenes, fila['imagen'])
+                # Si un código se repite en el lote, gana la última fila
+                validas[fila['codigo']] = (numero, fila)
+
+            # Fotos: solo las de productos nuevos o sin foto (salvo que se pida reemplazarlas)
+            con_foto = set(
+                Producto.objects.filter(codigo__in=validas.keys()).exclude(imagen='').exclude(imagen=None)
+                .values_list('codigo', flat=True)
+            )
+            rutas = sorted({
+                fila['imagen'] for codigo, (_, fila) in validas.items()
+                if fila['imagen'] and (reemplazar_imagenes or codigo not in con_foto)
+            })
+            procesadas = pool.map(_procesar_foto_segura, rutas) if pool else map(_procesar_foto_segura, rutas)
+            fotos = {}
+            for ruta_foto, (nombre, detalle) in zip(rutas, procesadas):
+                if nombre is None:
+                    # El producto se importa igual, sin foto
+                    numeros = [n for n, fila in validas.values() if fila['imagen'] == ruta_foto]
+                    resultado.errores.extend((n, f"imagen {ruta_foto}: {detalle}") for n in numeros)
+                else:
+                    fotos[ruta_foto] = (nombre, detalle)
+            resultado.imagenes += len(fotos)
+
+            if validas:
+                try:
+                    categorias_tocadas |= _importar_lote([fila for _, fila in validas.values()], fotos, resultado)
+                except Exception:
+                    # Las fotos se escribieron antes de la transacción del lote: sin sus filas quedarían huérfanas
+                    descartar_fotos(fotos)
+                    raise
+            if progreso:
+                progreso(resultado, time.monotonic() - inicio)
+    finally:
+        if pool:
+            pool.shutdown()
+
+    # Lo que las señales hacen producto por producto, una sola vez al final
+    for categoria_id in categorias_tocadas:
+        recalcular_categoria(categoria_id)
+    indice_autocompletado.invalidar()
+    invalidar_catalogo()
+    return resultado
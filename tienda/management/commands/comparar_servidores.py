@@ -0,0 +1,161 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import quote
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from tienda.medicion import percentil
+from tienda.models import Producto
+
+# Cómo se levanta cada despliegue. Los dos con la misma cantidad de procesos.
+SERVIDORES = {
+    'wsgi': ['-m', 'gunicorn', 'tormenta.wsgi:application', '--workers', '{trabajadores}',
+             '--bind', '127.0.0.1:{puerto}'],
+    'asgi': ['-m', 'uvicorn', 'tormenta.asgi:application', '--workers', '{trabajadores}',
+             '--host', '127.0.0.1', '--port', '{puerto}', '--no-access-log'],
+}
+
+
+def _esperar_puerto(puerto, proceso, limite=30):
+    fin = time.monotonic() + limite
+    while time.monotonic() < fin:
+        if proceso.poll() is not None:
+            return False
+        try:
+            socket.create_connection(('127.0.0.1', puerto), timeout=0.5).close()
+            return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def _pedir(puerto, ruta, demora):
+    """
+    Hace un GET y devuelve (segundos, status). Con `demora` el cliente manda la request
+    en dos partes separadas por esa pausa, como un celular con mala señal.
+    """
+    inicio = time.perf_counter()
+    status = 0
+    try:
+        with socket.create_connection(('127.0.0.1', puerto), timeout=30) as conexion:
+            conexion.sendall(f"GET {ruta} HTTP/1.1\r\n".encode())
+            if demora:
+                time.sleep(demora)
+            conexion.sendall(b"Host: 127.0.0.1\r\nConnection: close\r\n\r\n")
+            # Leemos hasta que el servidor cierra (Connection: close)
+            respuesta = bytearray()
+            while bloque := conexion.recv(65536):
+                respuesta += bloque
+        status = int(respuesta.split(b' ', 2)[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return time.perf_counter() - inicio, status
+
+
+class Command(BaseCommand):
+    help = (
+        "Levanta la tienda con gunicorn (WSGI) y con uvicorn (ASGI, vistas async) en esta máquina, "
+        "les manda la misma carga a las páginas de solo lectura y compara requests por segundo y p50/p99."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrencia', type=int, default=32, help="Clientes simultáneos.")
+        parser.add_argument('--segundos', type=float, default=15, help="Duración de cada medición.")
+        parser.add_argument('--trabajadores', type=int, default=2, help="Procesos de cada servidor.")
+        parser.add_argument('--puerto', type=int, default=8765)
+        parser.add_argument('--cliente-lento', type=int, default=0, metavar='MS',
+                            help="Pausa a mitad de cada request (clientes lentos). 0 = clientes rápidos.")
+        parser.add_argument('--solo', choices=sorted(SERVIDORES), help="Medir un solo despliegue.")
+        parser.add_argument('--json', dest='salida_json', help="Guardar los resultados en este archivo.")
+
+    def _rutas(self):
+        producto = Producto.objects.order_by('id').first()
+        if producto is None:
+            raise CommandError("No hay productos: cargá el catálogo antes (por ejemplo con importar_productos).")
+        return ['/', f'/producto/{producto.id}/', f'/busqueda-ajax/?q={quote(producto.nombre[:4])}', '/sitemap.xml']
+
+    def _medir(self, modo, rutas, options):
+        puerto = options['puerto']
+        comando = [sys.executable] + [
+            parte.format(trabajadores=options['trabajadores'], puerto=puerto) for parte in SERVIDORES[modo]
+        ]
+        entorno = dict(os.environ)
+        entorno.pop('TIENDA_ASGI', None)
+        if modo == 'asgi':
+            entorno['TIENDA_ASGI'] = '1'
+        proceso = subprocess.Popen(comando, cwd=settings.BASE_DIR, env=entorno,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        try:
+            if not _esperar_puerto(puerto, proceso):
+                proceso.kill()
+                error = proceso.communicate()[1].decode(errors='replace').strip().splitlines()
+                raise CommandError(f"No arrancó el servidor {modo}: {error[-1] if error else 'sin salida'}")
+
+            # Una vuelta para calentar (templates, índice del buscador, cache)
+            for ruta in rutas:
+                _pedir(puerto, ruta, 0)
+
+            demora = options['cliente_lento'] / 1000
+            fin = time.monotonic() + options['segundos']
+            latencias, errores = [], 0
+            candado = threading.Lock()
+
+            def cliente(numero):
+                nonlocal errores
+                i = numero
+                while time.monotonic() < fin:
+                    segundos, status = _pedir(puerto, rutas[i % len(rutas)], demora)
+                    i += 1
+                    with candado:
+                        latencias.append(segundos)
+                        if status != 200:
+                            errores += 1
+
+            inicio = time.perf_counter()
+            hilos = [threading.Thread(target=cliente, args=(n,)) for n in range(options['concurrencia'])]
+            for hilo in hilos:
+                hilo.start()
+            for hilo in hilos:
+                hilo.join()
+            duracion = time.perf_counter() - inicio
+        finally:
+            proceso.terminate()
+            try:
+                proceso.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proceso.kill()
+
+        latencias.sort()
+        return {
+            'requests': len(latencias),
+            'errores': errores,
+            'por_segundo': round(len(latencias) / duracion, 1),
+            'p50_ms': round(percentil(latencias, 50) * 1000, 1),
+            'p99_ms': round(percentil(latencias, 99) * 1000, 1),
+        }
+
+    def handle(self, *args, **options):
+        rutas = self._rutas()
+        modos = [options['solo']] if options['solo'] else list(SERVIDORES)
+        self.stdout.write(
+            f"{options['concurrencia']} clientes, {options['segundos']:g} s, {options['trabajadores']} procesos, "
+            f"cliente lento: {options['cliente_lento']} ms. Rutas: {', '.join(rutas)}"
+        )
+        self.stdout.write(f"{'servidor':<9} {'req/s':>8} {'p50 ms':>9} {'p99 ms':>9} {'requests':>9} {'errores':>8}")
+
+        resultados = {}
+        for modo in modos:
+            r = resultados[modo] = self._medir(modo, rutas, options)
+            self.stdout.write(
+                f"{modo:<9} {r['por_segundo']:>8} {r['p50_ms']:>9} {r['p99_ms']:>9} {r['requests']:>9} {r['errores']:>8}"
+            )
+
+        if options['salida_json']:
+            with open(options['salida_json'], 'w') as archivo:
+                json.dump({'parametros': {k: options[k] for k in ('concurrencia', 'segundos', 'trabajadores',
+                                                                   'cliente_lento')},
+                           'rutas': rutas, 'resultados': resultados}, archivo, indent=2)
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from tienda.imagenes import actualizar_derivadas
+from tienda.models import Producto, Perfil
+
+
+class Command(BaseCommand):
+    help = (
+        "Genera las versiones responsivas (anchos y formatos) y el marcador borroso de las fotos "
+        "que ya están subidas. Las que tienen derivadas pero no marcador también se completan."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--todas', action='store_true',
+                            help="Regenera también las que ya tienen derivadas (por ejemplo, si cambió la escalera de anchos).")
+
+    def handle(self, *args, **options):
+        for modelo, campo in ((Producto, 'imagen'), (Perfil, 'foto')):
+            generadas = omitidas = 0
+            for objeto in modelo.objects.exclude(**{campo: ''}).exclude(**{f'{campo}__isnull': True}).iterator():
+                archivo = getattr(objeto, campo)
+                manifiesto = getattr(objeto, f'{campo}_derivadas') or {}
+                # Las derivadas que ya existen no se vuelven a escribir: completar el marcador es barato
+                al_dia = manifiesto.get('origen') == archivo.name and 'lqip' in manifiesto
+                if not options['todas'] and al_dia:
+                    omitidas += 1
+                    continue
+                try:
+                    actualizar_derivadas(objeto, campo)
+                    generadas += 1
+                except (OSError, ValueError) as e:
+                    self.stderr.write(f"{modelo.__name__} #{objeto.pk}: no se pudo procesar {archivo.name} ({e})")
+            self.stdout.write(self.style.SUCCESS(
+                f"{modelo._meta.verbose_name_plural}: {generadas} generadas, {omitidas} ya estaban al día."
+            ))
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+from tienda.importacion import TAMANO_LOTE, importar
+
+
+class Command(BaseCommand):
+    help = (
+        "Importa productos, variantes y fotos desde un CSV o JSONL (columnas: codigo, nombre, precio, stock, "
+        "categoria, descripcion, precio_oferta, imagen, variantes). Se puede relanzar: actualiza por código."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('archivo', help="Planilla .csv o .jsonl")
+        parser.add_argument('--imagenes', help="Carpeta de las fotos (por defecto, la de la planilla).")
+        parser.add_argument('--procesos', type=int, default=None,
+                            help="Procesos para comprimir fotos (por defecto, uno por núcleo; 1 = sin pool).")
+        parser.add_argument('--lote', type=int, default=TAMANO_LOTE, help="Filas por transacción.")
+        parser.add_argument('--reemplazar-imagenes', action='store_true',
+                            help="Vuelve a procesar las fotos de los productos que ya tienen una.")
+
+    def handle(self, *args, **options):
+        def progreso(resultado, segundos):
+            self.stdout.write(
+                f"{resultado.filas} filas ({resultado.creados} nuevos, {resultado.actualizados} actualizados, "
+                f"{resultado.imagenes} fotos) en {segundos:.1f} s"
+            )
+
+        try:
+            resultado = importar(
+                options['archivo'],
+                carpeta_imagenes=options['imagenes'],
+                procesos=options['procesos'],
+                lote=options['lote'],
+                reemplazar_imagenes=options['reemplazar_imagenes'],
+                progreso=progreso,
+            )
+        except (OSError, ValueError) as e:
+            raise CommandError(f"No se pudo leer {options['archivo']}: {e}")
+
+        for numero, error in resultado.errores:
+            self.stderr.write(f"Línea {numero}: {error}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Importación terminada: {resultado.creados} productos nuevos, {resultado.actualizados} actualizados, "
+            f"{resultado.variantes} variantes y {resultado.imagenes} fotos. Filas con errores: {len(resultado.errores)}."
+        ))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from tienda.almacen_carrito import borrar_vencidos
+from tienda.reservas import liberar_vencidas
+
+
+class Command(BaseCommand):
+    help = (
+        "Borra en lote las reservas de stock vencidas y el contenido de los carritos abandonados. "
+        "Pensado para correr con cron."
+    )
+
+    def handle(self, *args, **options):
+        cantidad = liberar_vencidas()
+        carritos = borrar_vencidos()
+        self.stdout.write(self.style.SUCCESS(
+            f"Se liberaron {cantidad} reservas vencidas y se borraron {carritos} carritos vencidos."
+        ))
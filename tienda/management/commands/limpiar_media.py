@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+from tienda.storage import recolectar_huerfanos
+
+
+class Command(BaseCommand):
+    help = "Borra de media/ los archivos que ya no usa ningún producto, perfil ni trabajo de imagen pendiente."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--simular', action='store_true', help="Solo informa lo que se borraría.")
+        parser.add_argument('--antiguedad', type=int, default=3600,
+                            help="No tocar archivos más nuevos que estos segundos (subidas en curso). Por defecto 1 hora.")
+
+    def handle(self, *args, **options):
+        cantidad, liberados = recolectar_huerfanos(options['antiguedad'], simular=options['simular'])
+        verbo = "Se borrarían" if options['simular'] else "Se borraron"
+        self.stdout.write(self.style.SUCCESS(f"{verbo} {cantidad} archivos huérfanos ({filesizeformat(liberados)})."))
@@ -0,0 +1,105 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from django.conf import settings
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from PIL import Image
+from tienda.imagenes import anchos_derivadas
+from tienda.utils import comprimir_imagen, reducir_imagen
+
+EXTENSIONES = ('.jpg', '.jpeg', '.jfif', '.png', '.webp', '.gif', '.bmp', '.tif', '.tiff')
+
+
+def _rss_pico_kb():
+    # En Linux ru_maxrss viene en KB (en macOS, en bytes)
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico // 1024 if sys.platform == 'darwin' else pico
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide tiempo y memoria pico (RSS) de procesar cada foto de una carpeta. "
+        "Cada foto se procesa en un proceso aparte para que el pico de una no tape al de la siguiente."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('carpeta', nargs='?', default=os.path.join(settings.BASE_DIR, 'imagenes'))
+        parser.add_argument('--ancho', type=int, default=800, help="Ancho de la versión comprimida (800 = productos).")
+        parser.add_argument('--sin-reduccion', action='store_true',
+                            help="Decodifica cada foto entera antes de achicarla (como antes), para comparar.")
+        # Uso interno: el proceso hijo que mide una sola foto
+        parser.add_argument('--archivo', help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['archivo']:
+            return self._medir_una(options['archivo'], options['ancho'], options['sin_reduccion'])
+
+        archivos = sorted(
+            os.path.join(raiz, nombre)
+            for raiz, _, nombres in os.walk(options['carpeta'])
+            for nombre in nombres if nombre.lower().endswith(EXTENSIONES)
+        )
+        if not archivos:
+            self.stdout.write(self.style.WARNING("No hay imágenes para medir."))
+            return
+
+        manage = os.path.join(settings.BASE_DIR, 'manage.py')
+        self.stdout.write(f"{'archivo':<45} {'pixeles':>11} {'seg':>7} {'RSS pico':>9} {'+trabajo':>9}")
+        total_segundos = pico_maximo = 0
+        for ruta in archivos:
+            comando = [sys.executable, manage, 'medir_imagenes', '--archivo', ruta, '--ancho', str(options['ancho'])]
+            if options['sin_reduccion']:
+                comando.append('--sin-reduccion')
+            resultado = subprocess.run(comando, capture_output=True, text=True)
+            nombre = os.path.relpath(ruta, options['carpeta'])[-45:]
+            try:
+                datos = json.loads(resultado.stdout.strip().splitlines()[-1])
+            except (ValueError, IndexError):
+                self.stdout.write(self.style.ERROR(f"{nombre:<45} falló: {resultado.stderr.strip()[-200:]}"))
+                continue
+            if 'error' in datos:
+                self.stdout.write(self.style.ERROR(f"{nombre:<45} {datos['error']}"))
+                continue
+            total_segundos += datos['segundos']
+            pico_maximo = max(pico_maximo, datos['rss_pico_kb'])
+            self.stdout.write(
+                f"{nombre:<45} {datos['pixeles']:>11} {datos['segundos']:>7.3f} "
+                f"{datos['rss_pico_kb'] / 1024:>7.1f}MB {(datos['rss_pico_kb'] - datos['rss_base_kb']) / 1024:>7.1f}MB"
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(archivos)} fotos en {total_segundos:.2f} s. RSS pico máximo: {pico_maximo / 1024:.1f} MB."
+        ))
+
+    def _medir_una(self, ruta, ancho, sin_reduccion):
+        # Lo mismo que hace un trabajo de imagen: la versión comprimida y la base de las derivadas
+        rss_base = _rss_pico_kb()
+        inicio = time.perf_counter()
+        try:
+            with Image.open(ruta) as img:
+                pixeles = f"{img.width}x{img.height}"
+            if sin_reduccion:
+                for ancho_objetivo in (ancho, max(anchos_derivadas())):
+                    with Image.open(ruta) as img:
+                        img.load()
+                        if img.width > ancho_objetivo:
+                            img.resize((ancho_objetivo, round(img.height * ancho_objetivo / img.width)),
+                                       Image.Resampling.LANCZOS)
+            else:
+                with open(ruta, 'rb') as archivo:
+                    comprimir_imagen(File(archivo, name=os.path.basename(ruta)), nuevo_ancho=ancho)
+                with Image.open(ruta) as img:
+                    reducir_imagen(img, max(anchos_derivadas()))
+        except Exception as e:
+            self.stdout.write(json.dumps({'error': str(e)}))
+            return
+        self.stdout.write(json.dumps({
+            'pixeles': pixeles,
+            'segundos': time.perf_counter() - inicio,
+            'rss_base_kb': rss_base,
+            'rss_pico_kb': _rss_pico_kb(),
+        }))
@@ -0,0 +1,134 @@
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import django
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+from tienda.medicion import Medicion, catalogo_sembrado, sembrar
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                              capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except OSError:
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Siembra un catálogo sintético (siempre el mismo para la misma semilla) en una base aparte, "
+        "recorre catálogo, detalle, buscador, carrito, checkout y dashboard y reporta requests por segundo, "
+        "p50/p95/p99 y consultas por request en JSON, para comparar entre commits."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--productos', type=int, default=1000, help="Tamaño del catálogo (1000, 10000, 100000...).")
+        parser.add_argument('--repeticiones', type=int, default=100, help="Requests por escenario.")
+        parser.add_argument('--semilla', type=int, default=1)
+        parser.add_argument('--escenarios', nargs='+', choices=Medicion.ESCENARIOS, help="Por defecto, todos.")
+        parser.add_argument('--sin-cache', action='store_true', help="Vacía la cache antes de cada request.")
+        parser.add_argument('--conservar-base', action='store_true',
+                            help="No borra la base de la medición: la próxima corrida con los mismos "
+                                 "--productos y --semilla no vuelve a sembrar.")
+        parser.add_argument('--json', dest='salida_json', help="Guardar el resultado en este archivo.")
+        parser.add_argument('--comparar', help="JSON de una corrida anterior para mostrar la diferencia.")
+
+    def handle(self, *args, **options):
+        anterior = None
+        if options['comparar']:
+            try:
+                with open(options['comparar']) as archivo:
+                    anterior = json.load(archivo)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"No se pudo leer {options['comparar']}: {e}")
+
+        # Nunca sobre la base de verdad: una base de prueba aparte (en SQLite, un archivo temporal)
+        # y una cache propia para que las generaciones del catálogo no se mezclen
+        nombre_original = connection.settings_dict['NAME']
+        if connection.vendor == 'sqlite':
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(
+                tempfile.gettempdir(), 'tormenta_medicion.sqlite3'
+            )
+        carpeta_cache = tempfile.mkdtemp(prefix='tormenta_medicion_')
+        caches = {
+            alias: {**config, 'LOCATION': os.path.join(carpeta_cache, alias)}
+            for alias, config in settings.CACHES.items()
+        }
+
+        conservar = options['conservar_base']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False, keepdb=conservar)
+        try:
+            with override_settings(DEBUG=False, CACHES=caches):
+                resultado = self._medir(options)
+        finally:
+            connection.creation.destroy_test_db(nombre_original, verbosity=0, keepdb=conservar)
+            shutil.rmtree(carpeta_cache, ignore_errors=True)
+
+        if options['salida_json']:
+            with open(options['salida_json'], 'w') as archivo:
+                json.dump(resultado, archivo, indent=2, ensure_ascii=False)
+            self.stdout.write(self.style.SUCCESS(f"Resultado guardado en {options['salida_json']}"))
+        else:
+            self.stdout.write(json.dumps(resultado, indent=2, ensure_ascii=False))
+
+        if anterior:
+            self._comparar(anterior, resultado)
+
+    def _medir(self, options):
+        productos, semilla = options['productos'], options['semilla']
+        siembra = None
+        if catalogo_sembrado(productos, semilla):
+            self.stdout.write(f"Catálogo de {productos} productos (semilla {semilla}) ya sembrado.")
+        else:
+            call_command('flush', interactive=False, verbosity=0)
+            inicio = time.perf_counter()
+            siembra = sembrar(productos, semilla, progreso=lambda mensaje: self.stdout.write(f"  {mensaje}"))
+            siembra['segundos'] = round(time.perf_counter() - inicio, 1)
+
+        medicion = Medicion(options['repeticiones'], semilla, sin_cache=options['sin_cache'])
+        self.stdout.write(f"{'escenario':<18} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'consultas':>10}")
+
+        def progreso(escenario, r):
+            self.stdout.write(
+                f"{escenario:<18} {r['por_segundo']:>8} {r['p50_ms']:>8} {r['p95_ms']:>8} {r['p99_ms']:>8} "
+                f"{r['consultas_media']:>10}"
+            )
+
+        escenarios = medicion.correr(options['escenarios'], progreso=progreso)
+        return {
+            'meta': {
+                'commit': _commit(),
+                'fecha': timezone.now().isoformat(timespec='seconds'),
+                'productos': productos,
+                'semilla': semilla,
+                'repeticiones': options['repeticiones'],
+                'sin_cache': options['sin_cache'],
+                'base': connection.vendor,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+            },
+            'siembra': siembra,
+            'escenarios': escenarios,
+        }
+
+    def _comparar(self, anterior, actual):
+        self.stdout.write(f"\nContra {anterior['meta'].get('commit') or 'la corrida anterior'}:")
+        self.stdout.write(f"{'escenario':<18} {'p95 antes':>10} {'p95 ahora':>10} {'cambio':>8} {'consultas':>12}")
+        for escenario, ahora in actual['escenarios'].items():
+            antes = anterior.get('escenarios', {}).get(escenario)
+            if not antes:
+                continue
+            cambio = (ahora['p95_ms'] - antes['p95_ms']) / antes['p95_ms'] * 100 if antes['p95_ms'] else 0
+            self.stdout.write(
+                f"{escenario:<18} {antes['p95_ms']:>10} {ahora['p95_ms']:>10} {cambio:>+7.0f}% "
+                f"{antes['consultas_media']:>5} → {ahora['consultas_media']:<5}"
+            )
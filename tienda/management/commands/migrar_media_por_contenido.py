@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from tienda.models import Producto, Perfil
+from tienda.storage import es_nombre_por_contenido, liberar_archivo
+
+
+class Command(BaseCommand):
+    help = (
+        "Pasa las fotos subidas antes del almacenamiento por contenido a su nombre por hash. "
+        "Los duplicados quedan apuntando a un único archivo y las copias sobrantes se borran."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--simular', action='store_true', help="Solo informa qué archivos se moverían.")
+
+    def handle(self, *args, **options):
+        for modelo, campo in ((Producto, 'imagen'), (Perfil, 'foto')):
+            movidos = 0
+            for objeto in modelo.objects.exclude(**{campo: ''}).exclude(**{f'{campo}__isnull': True}).iterator():
+                archivo = getattr(objeto, campo)
+                if es_nombre_por_contenido(archivo.name):
+                    continue
+                if not archivo.storage.exists(archivo.name):
+                    self.stderr.write(f"{modelo.__name__} #{objeto.pk}: falta el archivo {archivo.name}")
+                    continue
+                if options['simular']:
+                    self.stdout.write(f"{archivo.name}")
+                    movidos += 1
+                    continue
+
+                anterior = archivo.name
+                with archivo.storage.open(anterior, 'rb') as contenido:
+                    nuevo = archivo.storage.save(anterior, contenido)
+                if nuevo != anterior:
+                    cambios = {campo: nuevo}
+                    manifiesto = getattr(objeto, f'{campo}_derivadas') or {}
+                    if manifiesto.get('origen') == anterior:
+                        cambios[f'{campo}_derivadas'] = dict(manifiesto, origen=nuevo)
+                    modelo.objects.filter(pk=objeto.pk, **{campo: anterior}).update(**cambios)
+                    liberar_archivo(archivo.storage, anterior)
+                movidos += 1
+
+            total = modelo.objects.exclude(**{campo: ''}).exclude(**{f'{campo}__isnull': True})
+            archivos = total.values_list(campo, flat=True).distinct().count()
+            deduplicados = total.count() - archivos
+            self.stdout.write(self.style.SUCCESS(
+                f"{modelo._meta.verbose_name_plural}: {movidos} archivos migrados; "
+                f"{deduplicados} filas comparten archivo con otra."
+            ))
@@ -0,0 +1,33 @@
+import time
+from django.core.management.base import BaseCommand
+from tienda.imagenes import procesar_pendientes, recuperar_colgados
+from tienda.models import TrabajoImagen
+
+
+class Command(BaseCommand):
+    help = "Comprime las imágenes pendientes (modo 'cola', o lo que quedó sin hacer si se reinició el proceso)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limite', type=int, default=None, help="Máximo de trabajos a procesar en esta pasada.")
+        parser.add_argument('--continuo', action='store_true', help="Sigue esperando trabajos nuevos (worker).")
+        parser.add_argument('--reintentar', action='store_true',
+                            help="Vuelve a encolar los trabajos en ERROR. Los colgados en PROCESANDO se "
+                                 "recuperan siempre.")
+
+    def handle(self, *args, **options):
+        if options['reintentar']:
+            reencolados = TrabajoImagen.objects.filter(estado='ERROR').update(estado='PENDIENTE', intentos=0)
+            self.stdout.write(f"Se volvieron a encolar {reencolados} trabajos.")
+
+        colgados = recuperar_colgados()
+        if colgados:
+            self.stdout.write(f"Se recuperaron {colgados} trabajos colgados en PROCESANDO.")
+
+        while True:
+            listos, fallidos = procesar_pendientes(options['limite'])
+            if listos or fallidos or not options['continuo']:
+                self.stdout.write(self.style.SUCCESS(f"Imágenes comprimidas: {listos}. Fallidas: {fallidos}."))
+            if not options['continuo']:
+                break
+            if not listos and not fallidos:
+                time.sleep(2)
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from tienda.calificaciones import recalcular_calificaciones
+
+
+class Command(BaseCommand):
+    help = "Recalcula desde cero los contadores de reseñas (cantidad, suma, promedio e histograma) de cada producto."
+
+    def handle(self, *args, **options):
+        cantidad = recalcular_calificaciones()
+        self.stdout.write(self.style.SUCCESS(f"Calificaciones recalculadas para {cantidad} productos."))
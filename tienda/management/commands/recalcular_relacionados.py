@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from tienda.relacionados import recalcular_todo
+
+
+class Command(BaseCommand):
+    help = "Recalcula desde cero la tabla de productos relacionados (por ejemplo, después de un loaddata)."
+
+    def handle(self, *args, **options):
+        cantidad = recalcular_todo()
+        self.stdout.write(self.style.SUCCESS(f"Relacionados recalculados para {cantidad} productos."))
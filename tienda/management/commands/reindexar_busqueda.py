@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from tienda.busqueda import obtener_motor
+from tienda.models import Producto
+
+
+class Command(BaseCommand):
+    help = "Reconstruye desde cero el índice de búsqueda de productos (por ejemplo, después de un loaddata)."
+
+    def handle(self, *args, **options):
+        motor = obtener_motor()
+        if motor.nombre == 'simple':
+            self.stdout.write(self.style.WARNING("La base de datos no tiene índice de texto completo; no hay nada que reconstruir."))
+            return
+
+        motor.reconstruir(Producto.objects.only('id', 'nombre', 'descripcion'))
+        self.stdout.write(self.style.SUCCESS(f"Índice '{motor.nombre}' reconstruido ({Producto.objects.count()} productos)."))
@@ -0,0 +1,164 @@
+"""
+Sirve MEDIA_ROOT (fotos de productos, perfiles y derivadas) también en producción.
+
+- ETag fuerte y Last-Modified: el navegador revalida con If-None-Match / If-Modified-Since y recibe 304.
+- Range: un rango por pedido (206), que es lo que piden los navegadores.
+- Los archivos con nombre por contenido (joyas/3f/3fa9...jpg, derivadas/3fa9...-400.webp)
+  no cambian nunca: se cachean un año como inmutables.
+- Si hay un nginx o Apache adelante (setting TIENDA_MEDIA_MODO = 'x-accel' / 'x-sendfile'),
+  Django solo decide y el proxy manda los bytes.
+"""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+from django.core.exceptions import SuspiciousFileOperation
+from .storage import es_nombre_por_contenido
+from .imagenes import CARPETA_DERIVADAS
+
+MODO_DJANGO = 'django'
+MODO_X_ACCEL = 'x-accel'        # nginx: location interna con alias a MEDIA_ROOT
+MODO_X_SENDFILE = 'x-sendfile'  # Apache (mod_xsendfile) o lighttpd
+
+CACHE_INMUTABLE = 'public, max-age=31536000, immutable'
+# Los nombres viejos (anteriores al almacenamiento por contenido) se pueden pisar: se revalidan
+CACHE_REVALIDAR = 'public, max-age=3600'
+
+TAMANO_BLOQUE = 64 * 1024
+
+# derivadas/3fa9c1d2e4b5a6f7-400.webp (ver imagenes.generar_derivadas)
+PATRON_DERIVADA = re.compile(rf'^{CARPETA_DERIVADAS}/[0-9a-f]{{16}}-\d+\.\w+$')
+PATRON_RANGO = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def modo():
+    return getattr(settings, 'TIENDA_MEDIA_MODO', MODO_DJANGO)
+
+
+def es_inmutable(ruta):
+    return es_nombre_por_contenido(ruta) or bool(PATRON_DERIVADA.match(ruta))
+
+
+def etag_de(ruta, estado):
+    # El nombre de un archivo por contenido ya es su hash; el resto, fecha y tamaño (como Apache)
+    if es_inmutable(ruta):
+        return f'"{os.path.splitext(os.path.basename(ruta))[0]}"'
+    return f'"{estado.st_mtime_ns:x}-{estado.st_size:x}"'
+
+
+def rango_pedido(request, etag, ultima_modificacion, tamano):
+    """
+    (inicio, fin) inclusivos del Range pedido, None si hay que mandar el archivo entero
+    o 'insatisfacible' si el rango cae fuera del archivo.
+    Varios rangos en un mismo pedido se responden con el archivo entero (lo permite la RFC 9110).
+    """
+    encabezado = request.headers.get('Range')
+    if not encabezado or tamano == 0:
+        return None
+    si_rango = request.headers.get('If-Range')
+    if si_rango:
+        # Solo si la copia parcial del cliente es exactamente esta versión (RFC 9110: la fecha
+        # tiene que coincidir con Last-Modified); si no, va entero
+        fecha = parse_http_date_safe(si_rango)
+        if si_rango != etag and fecha != int(ultima_modificacion):
+            return None
+
+    encontrado = PATRON_RANGO.match(encabezado.strip())
+    if not encontrado or encontrado.groups() == ('', ''):
+        return None
+    inicio, fin = encontrado.groups()
+    if inicio == '':
+        # bytes=-500: los últimos 500
+        inicio, fin = max(tamano - int(fin), 0), tamano - 1
+    else:
+        inicio, fin = int(inicio), min(int(fin), tamano - 1) if fin else tamano - 1
+    if inicio >= tamano or inicio > fin:
+        return 'insatisfacible'
+    return inicio, fin
+
+
+def _bloques(archivo, cantidad):
+    try:
+        while cantidad > 0:
+            bloque = archivo.read(min(TAMANO_BLOQUE, cantidad))
+            if not bloque:
+                break
+            cantidad -= len(bloque)
+            yield bloque
+    finally:
+        archivo.close()
+
+
+@require_safe
+def servir_media(request, ruta):
+    try:
+        completa = safe_join(settings.MEDIA_ROOT, ruta)
+    except SuspiciousFileOperation:
+        raise Http404("Archivo inexistente")
+    try:
+        estado = os.stat(completa)
+    except OSError:
+        raise Http404("Archivo inexistente")
+    if not os.path.isfile(completa):
+        raise Http404("Archivo inexistente")
+
+    etag = etag_de(ruta, estado)
+    encabezados = {
+        'ETag': etag,
+        'Last-Modified': http_date(estado.st_mtime),
+        'Cache-Control': CACHE_INMUTABLE if es_inmutable(ruta) else CACHE_REVALIDAR,
+        'Accept-Ranges': 'bytes',
+    }
+
+    # 304 (o 412) si el cliente ya tiene esta versión
+    condicional = get_conditional_response(request, etag=etag, last_modified=int(estado.st_mtime))
+    if condicional is not None:
+        for clave in ('ETag', 'Last-Modified', 'Cache-Control'):
+            condicional[clave] = encabezados[clave]
+        return condicional
+
+    tipo, codificacion = mimetypes.guess_type(completa)
+    tipo = tipo or 'application/octet-stream'
+
+    if modo() in (MODO_X_ACCEL, MODO_X_SENDFILE):
+        # El proxy resuelve Range y manda el archivo; nosotros solo ponemos los encabezados.
+        # La ruta va codificada (espacios, acentos): nginx y mod_xsendfile la decodifican
+        respuesta = HttpResponse(content_type=tipo, headers=encabezados)
+        if modo() == MODO_X_ACCEL:
+            prefijo = getattr(settings, 'TIENDA_MEDIA_PREFIJO_INTERNO', '/media-interna/')
+            respuesta['X-Accel-Redirect'] = quote(f"{prefijo.rstrip('/')}/{ruta}")
+        else:
+            respuesta['X-Sendfile'] = quote(completa)
+        return respuesta
+
+    rango = rango_pedido(request, etag, estado.st_mtime, estado.st_size)
+    if rango == 'insatisfacible':
+        respuesta = HttpResponse(status=416, headers=encabezados)
+        respuesta['Content-Range'] = f'bytes */{estado.st_size}'
+        return respuesta
+
+    if request.method == 'HEAD':
+        respuesta = HttpResponse(content_type=tipo, headers=encabezados)
+        respuesta['Content-Length'] = estado.st_size
+        return respuesta
+
+    archivo = open(completa, 'rb')
+    if rango is None:
+        respuesta = FileResponse(archivo, content_type=tipo, headers=encabezados)
+    else:
+        inicio, fin = rango
+        archivo.seek(inicio)
+        respuesta = StreamingHttpResponse(
+            _bloques(archivo, fin - inicio + 1), status=206, content_type=tipo, headers=encabezados
+        )
+        respuesta['Content-Range'] = f'bytes {inicio}-{fin}/{estado.st_size}'
+        respuesta['Content-Length'] = fin - inicio + 1
+    if codificacion:
+        respuesta['Content-Encoding'] = codificacion
+    return respuesta
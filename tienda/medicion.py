@@ -0,0 +1,259 @@
+"""
+Benchmark reproducible de la tienda (lo usa el comando medir_tienda).
+
+sembrar() arma un catálogo sintético con una semilla fija: los mismos productos, variantes,
+reviews y órdenes cada vez, de a lotes con bulk_create. Medicion recorre las páginas
+principales con el cliente de tests de Django (sin red: se mide la aplicación, no el servidor)
+y, por escenario, junta latencias, consultas a la base (tienda/consultas.py) y consultas repetidas.
+El resultado es un dict listo para guardar como JSON y comparar entre commits.
+"""
+import random
+import time
+from decimal import Decimal
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import Client
+from django.urls import reverse
+from .consultas import contar_consultas
+
+TAMANO_LOTE = 2000
+
+CATEGORIAS = ('Anillos', 'Collares', 'Aros', 'Pulseras', 'Dijes', 'Relojes', 'Tobilleras', 'Broches')
+ADJETIVOS = ('Dorado', 'Plateado', 'Liso', 'Trenzado', 'Vintage', 'Minimal', 'Brillante', 'Mate', 'Doble', 'Fino')
+MATERIALES = ('Oro 18k', 'Plata 925', 'Acero', 'Perlas', 'Cuarzo', 'Circonias', 'Cristal', 'Nácar')
+TALLES = ('Chico', 'Mediano', 'Grande')
+ESTADOS_ORDEN = ('PENDIENTE', 'PAGADO', 'ENVIADO', 'ENTREGADO', 'CANCELADO')
+
+# Stock de los productos que se compran una y otra vez en el escenario de checkout
+STOCK_COMPRAS = 10 ** 6
+DATOS_CHECKOUT = {'direccion': 'Calle Falsa 123', 'ciudad': 'Springfield', 'codigo_postal': '1000', 'telefono': '1'}
+
+
+def percentil(valores, p):
+    # Rango más cercano sobre la lista ya ordenada
+    if not valores:
+        return 0.0
+    return valores[min(len(valores) - 1, max(0, round(p / 100 * len(valores)) - 1))]
+
+
+def codigo_de(semilla, numero):
+    return f"M{semilla}-{numero:06d}"
+
+
+def catalogo_sembrado(productos, semilla):
+    """
+    True si la base ya tiene exactamente el catálogo de esta semilla (para no volver a sembrar).
+    """
+    from .models import Producto
+
+    return (
+        Producto.objects.count() == productos
+        and Producto.objects.filter(codigo__startswith=f"M{semilla}-").count() == productos
+    )
+
+
+def sembrar(productos=1000, semilla=1, progreso=None):
+    """
+    Carga `productos` productos con variantes (uno de cada tres), reviews (uno de cada cinco)
+    y un historial de órdenes (una cada diez productos), más los índices que arman las señales.
+    Siempre genera lo mismo para la misma semilla. Devuelve las cantidades creadas.
+    """
+    from .autocompletado import indice_autocompletado
+    from .busqueda import obtener_motor
+    from .cache import invalidar_catalogo
+    from .calificaciones import recalcular_calificaciones
+    from .models import Categoria, DetalleOrden, Orden, Perfil, Producto, Review, Variante
+    from .relacionados import recalcular_todo
+
+    rng = random.Random(semilla)
+    informar = progreso or (lambda mensaje: None)
+
+    categorias = [Categoria.objects.get_or_create(slug=nombre.lower(), defaults={'nombre': nombre})[0]
+                  for nombre in CATEGORIAS]
+
+    # Compradores: un hash de contraseña para todos (hashear miles de veces tarda minutos)
+    clave = make_password('medicion')
+    cantidad_usuarios = max(20, productos // 100)
+    User.objects.bulk_create([
+        User(username=f"comprador_{semilla}_{i}", password=clave) for i in range(cantidad_usuarios)
+    ], ignore_conflicts=True)
+    usuarios = list(User.objects.filter(username__startswith=f"comprador_{semilla}_").values_list('id', flat=True))
+    Perfil.objects.bulk_create([Perfil(usuario_id=u) for u in usuarios], ignore_conflicts=True)
+
+    creados = 0
+    while creados < productos:
+        lote = []
+        for numero in range(creados, min(creados + TAMANO_LOTE, productos)):
+            categoria = rng.choice(categorias)
+            precio = Decimal(rng.randrange(2000, 200000, 500))
+            en_oferta = rng.random() < 0.1
+            producto = Producto(
+                codigo=codigo_de(semilla, numero),
+                nombre=f"{categoria.nombre[:-1]} {rng.choice(ADJETIVOS)} {rng.choice(MATERIALES)} {numero}",
+                descripcion=f"{rng.choice(ADJETIVOS)} de {rng.choice(MATERIALES).lower()}, hecho a mano.",
+                precio=precio,
+                en_oferta=en_oferta,
+                precio_oferta=(precio * Decimal('0.8')).quantize(Decimal('1')) if en_oferta else None,
+                stock=rng.randint(0, 40),
+                categoria=categoria,
+            )
+            # bulk_create no pasa por save(): las claves de búsqueda se calculan a mano
+            producto.actualizar_claves_busqueda()
+            lote.append(producto)
+        Producto.objects.bulk_create(lote)
+        creados += len(lote)
+        informar(f"{creados}/{productos} productos")
+
+    ids = list(Producto.objects.filter(codigo__startswith=f"M{semilla}-").order_by('codigo').values_list('id', 'precio'))
+
+    variantes, reviews = [], []
+    for producto_id, _ in ids:
+        if rng.random() < 1 / 3:
+            for talle in rng.sample(TALLES, rng.randint(2, 3)):
+                variantes.append(Variante(producto_id=producto_id, nombre=talle, stock=rng.randint(0, 10)))
+        if rng.random() < 1 / 5:
+            for usuario_id in rng.sample(usuarios, rng.randint(1, 5)):
+                reviews.append(Review(producto_id=producto_id, usuario_id=usuario_id,
+                                      calificacion=rng.randint(1, 5), comentario="Muy linda."))
+    Variante.objects.bulk_create(variantes, batch_size=TAMANO_LOTE)
+    Review.objects.bulk_create(reviews, batch_size=TAMANO_LOTE)
+    informar(f"{len(variantes)} variantes y {len(reviews)} reviews")
+
+    ordenes = [
+        Orden(usuario_id=rng.choice(usuarios), total=0, estado=rng.choice(ESTADOS_ORDEN), **DATOS_CHECKOUT)
+        for _ in range(max(1, productos // 10))
+    ]
+    Orden.objects.bulk_create(ordenes, batch_size=TAMANO_LOTE)
+    detalles = []
+    for orden in ordenes:
+        for producto_id, precio in rng.sample(ids, min(len(ids), rng.randint(1, 4))):
+            cantidad = rng.randint(1, 3)
+            detalles.append(DetalleOrden(orden=orden, producto_id=producto_id, cantidad=cantidad, precio_unitario=precio))
+            orden.total += precio * cantidad
+    DetalleOrden.objects.bulk_create(detalles, batch_size=TAMANO_LOTE)
+    Orden.objects.bulk_update(ordenes, ['total'], batch_size=TAMANO_LOTE)
+    informar(f"{len(ordenes)} órdenes con {len(detalles)} items")
+
+    # Lo que harían las señales de post_save, de una vez
+    recalcular_calificaciones()
+    recalcular_todo()
+    motor = obtener_motor()
+    if motor.nombre != 'simple':
+        motor.reconstruir(Producto.objects.only('id', 'nombre', 'descripcion'))
+    indice_autocompletado.invalidar()
+    invalidar_catalogo()
+    informar("índices de búsqueda, relacionados y calificaciones listos")
+
+    return {
+        'productos': productos, 'variantes': len(variantes), 'reviews': len(reviews),
+        'ordenes': len(ordenes), 'usuarios': len(usuarios),
+    }
+
+
+class Medicion:
+    """
+    Recorre cada escenario `repeticiones` veces (más una vuelta de calentamiento que no cuenta).
+    Con `sin_cache` se vacía la cache antes de cada request: se mide el camino frío.
+    """
+
+    ESCENARIOS = ('catalogo', 'detalle', 'buscar', 'ver_carrito', 'finalizar_compra', 'dashboard')
+
+    def __init__(self, repeticiones=100, semilla=1, sin_cache=False):
+        from .models import Producto
+
+        self.repeticiones = repeticiones
+        self.sin_cache = sin_cache
+        self.rng = random.Random(semilla)
+        self.ids = list(Producto.objects.order_by('id').values_list('id', flat=True))
+        if not self.ids:
+            raise ValueError("No hay productos: hay que sembrar el catálogo antes de medir.")
+        muestra = self.rng.sample(self.ids, min(200, len(self.ids)))
+        self.nombres = list(Producto.objects.filter(id__in=muestra).order_by('id').values_list('nombre', flat=True))
+
+        # Un puñado de productos con stock de sobra para comprar en cada vuelta
+        self.para_comprar = self.ids[:5]
+        Producto.objects.filter(id__in=self.para_comprar).update(stock=STOCK_COMPRAS)
+
+        comprador, _ = User.objects.get_or_create(username='medicion_comprador')
+        administrador, _ = User.objects.get_or_create(username='medicion_admin', defaults={'is_staff': True})
+        self.anonimo = Client()
+        self.comprador = Client()
+        self.comprador.force_login(comprador)
+        self.administrador = Client()
+        self.administrador.force_login(administrador)
+
+        # El carrito que se mira en ver_carrito: cinco líneas
+        for producto_id in self.para_comprar:
+            self.comprador.get(reverse('agregar_carrito', args=[producto_id]))
+
+    # Cada escenario devuelve (cliente, método, url, datos); lo que prepara antes no se mide
+    def _catalogo(self):
+        filtros = self.rng.choice([
+            {}, {'orden': 'precio_asc'}, {'categoria': self.rng.choice(CATEGORIAS).lower()},
+            {'min_price': 10000, 'max_price': 60000}, {'q': self.rng.choice(ADJETIVOS)},
+        ])
+        return self.anonimo, 'get', reverse('catalogo'), filtros
+
+    def _detalle(self):
+        return self.anonimo, 'get', reverse('detalle', args=[self.rng.choice(self.ids)]), {}
+
+    def _buscar(self):
+        palabra = self.rng.choice(self.rng.choice(self.nombres).split())
+        return self.anonimo, 'get', reverse('buscar_productos_ajax'), {'q': palabra[:self.rng.randint(3, 6)]}
+
+    def _ver_carrito(self):
+        return self.comprador, 'get', reverse('ver_carrito'), {}
+
+    def _finalizar_compra(self):
+        for producto_id in self.rng.sample(self.para_comprar, 2):
+            self.comprador.get(reverse('agregar_carrito', args=[producto_id]))
+        return self.comprador, 'post', reverse('finalizar_compra'), DATOS_CHECKOUT
+
+    def _dashboard(self):
+        return self.administrador, 'get', reverse('dashboard_admin'), {}
+
+    def medir(self, escenario):
+        preparar = getattr(self, f'_{escenario}')
+        latencias, consultas, segundos_db = [], [], []
+        errores = repetidas = 0
+        for vuelta in range(self.repeticiones + 1):
+            cliente, metodo, url, datos = preparar()
+            if self.sin_cache:
+                cache.clear()
+            with contar_consultas() as registro:
+                inicio = time.perf_counter()
+                respuesta = getattr(cliente, metodo)(url, datos)
+                segundos = time.perf_counter() - inicio
+            if vuelta == 0:
+                continue  # calentamiento
+            latencias.append(segundos)
+            consultas.append(registro.cantidad)
+            segundos_db.append(registro.segundos)
+            repetidas = max(repetidas, max(registro.huellas.values(), default=0))
+            if respuesta.status_code >= 400:
+                errores += 1
+
+        total = sum(latencias)
+        latencias.sort()
+        return {
+            'requests': len(latencias),
+            'errores': errores,
+            'por_segundo': round(len(latencias) / total, 1) if total else 0.0,
+            'media_ms': round(total / len(latencias) * 1000, 2),
+            'p50_ms': round(percentil(latencias, 50) * 1000, 2),
+            'p95_ms': round(percentil(latencias, 95) * 1000, 2),
+            'p99_ms': round(percentil(latencias, 99) * 1000, 2),
+            'consultas_media': round(sum(consultas) / len(consultas), 1),
+            'consultas_max': max(consultas),
+            'db_ms_media': round(sum(segundos_db) / len(segundos_db) * 1000, 2),
+            'max_repeticiones_consulta': repetidas,
+        }
+
+    def correr(self, escenarios=None, progreso=None):
+        resultados = {}
+        for escenario in escenarios or self.ESCENARIOS:
+            resultados[escenario] = self.medir(escenario)
+            if progreso:
+                progreso(escenario, resultados[escenario])
+        return resultados
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0013_alter_orden_fecha_alter_producto_stock_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(fields=['precio', 'id'], name='producto_precio_id_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+from django.db import migrations
+
+
+def crear_indice(apps, schema_editor):
+    from tienda.busqueda import crear_indice, motor_para
+
+    if crear_indice(schema_editor.connection):
+        Producto = apps.get_model('tienda', 'Producto')
+        motor_para(schema_editor.connection).reconstruir(Producto.objects.all())
+
+
+def borrar_indice(apps, schema_editor):
+    from tienda.busqueda import borrar_indice
+
+    borrar_indice(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0014_producto_precio_id_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indice, borrar_indice),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations
+
+
+def rellenar_claves(apps, schema_editor):
+    from tienda.utils import normalizar_texto
+
+    Producto = apps.get_model('tienda', 'Producto')
+    productos = list(Producto.objects.only('id', 'nombre', 'descripcion'))
+    for producto in productos:
+        producto.nombre_busqueda = normalizar_texto(producto.nombre)
+        producto.texto_busqueda = normalizar_texto(f"{producto.nombre} {producto.descripcion}")
+    Producto.objects.bulk_update(productos, ['nombre_busqueda', 'texto_busqueda'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0016_producto_claves_busqueda'),
+    ]
+
+    operations = [
+        migrations.RunPython(rellenar_claves, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations
+
+
+def rellenar_relacionados(apps, schema_editor):
+    from tienda.relacionados import recalcular_todo
+
+    recalcular_todo(
+        apps.get_model('tienda', 'Producto'),
+        apps.get_model('tienda', 'ProductoRelacionado'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0018_producto_relacionado'),
+    ]
+
+    operations = [
+        migrations.RunPython(rellenar_relacionados, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations
+
+
+def rellenar_calificaciones(apps, schema_editor):
+    from tienda.calificaciones import recalcular_calificaciones
+
+    recalcular_calificaciones(
+        apps.get_model('tienda', 'Producto'),
+        apps.get_model('tienda', 'Review'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0020_producto_calificaciones'),
+    ]
+
+    operations = [
+        migrations.RunPython(rellenar_calificaciones, migrations.RunPython.noop),
+    ]
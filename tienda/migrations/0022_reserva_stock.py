@@ -0,0 +1,30 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0021_rellenar_calificaciones'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReservaStock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token_carrito', models.CharField(max_length=32)),
+                ('linea', models.CharField(help_text='Clave de la línea en el carrito (ej: 12 o 12_3)', max_length=50)),
+                ('cantidad', models.PositiveIntegerField()),
+                ('vence', models.DateTimeField(db_index=True)),
+                ('producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservas', to='tienda.producto')),
+                ('variante', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='reservas', to='tienda.variante')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['producto', 'variante', 'vence'], name='reserva_producto_vence_idx')],
+                'constraints': [models.UniqueConstraint(fields=('token_carrito', 'linea'), name='reserva_linea_unica')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0022_reserva_stock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrabajoImagen',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('modelo', models.CharField(help_text='app_label.Modelo (ej: tienda.Producto)', max_length=100)),
+                ('objeto_id', models.PositiveBigIntegerField()),
+                ('campo', models.CharField(max_length=50)),
+                ('archivo', models.CharField(help_text='Nombre del original subido', max_length=255)),
+                ('ancho', models.PositiveIntegerField()),
+                ('estado', models.CharField(choices=[('PENDIENTE', 'Pendiente'), ('PROCESANDO', 'Procesando'), ('LISTO', 'Listo'), ('ERROR', 'Error')], db_index=True, default='PENDIENTE', max_length=20)),
+                ('intentos', models.PositiveSmallIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('creado', models.DateTimeField(auto_now_add=True)),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
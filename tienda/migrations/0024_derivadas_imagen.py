@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0023_trabajo_imagen'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='perfil',
+            name='foto_derivadas',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='producto',
+            name='imagen_derivadas',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:03
+
+import tienda.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0024_derivadas_imagen'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='perfil',
+            name='foto',
+            field=models.ImageField(blank=True, null=True, storage=tienda.storage.AlmacenamientoPorContenido(), upload_to='perfiles/', verbose_name='Foto de Perfil'),
+        ),
+        migrations.AlterField(
+            model_name='producto',
+            name='imagen',
+            field=models.ImageField(blank=True, null=True, storage=tienda.storage.AlmacenamientoPorContenido(), upload_to='joyas/'),
+        ),
+    ]
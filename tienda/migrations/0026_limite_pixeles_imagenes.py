@@ -0,0 +1,25 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:09
+
+import tienda.storage
+import tienda.utils
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0025_almacenamiento_por_contenido'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='perfil',
+            name='foto',
+            field=models.ImageField(blank=True, null=True, storage=tienda.storage.AlmacenamientoPorContenido(), upload_to='perfiles/', validators=[tienda.utils.validar_tamano_imagen], verbose_name='Foto de Perfil'),
+        ),
+        migrations.AlterField(
+            model_name='producto',
+            name='imagen',
+            field=models.ImageField(blank=True, null=True, storage=tienda.storage.AlmacenamientoPorContenido(), upload_to='joyas/', validators=[tienda.utils.validar_tamano_imagen]),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0026_limite_pixeles_imagenes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='producto',
+            name='codigo',
+            field=models.CharField(blank=True, max_length=50, null=True, unique=True, verbose_name='Código / SKU'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0027_producto_codigo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Generacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=50, unique=True)),
+                ('valor', models.BigIntegerField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0028_generacion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContenidoCarrito',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=32, unique=True)),
+                ('contenido', models.TextField()),
+                ('vence', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0029_contenido_carrito'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentoFTS',
+            fields=[
+                ('producto', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='documento_fts', serialize=False, to='tienda.producto')),
+            ],
+            options={
+                'db_table': 'tienda_producto_fts',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='DocumentoTsvector',
+            fields=[
+                ('producto', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='documento_tsvector', serialize=False, to='tienda.producto')),
+            ],
+            options={
+                'db_table': 'tienda_producto_busqueda',
+                'managed': False,
+            },
+        ),
+    ]
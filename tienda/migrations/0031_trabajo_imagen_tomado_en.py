@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 14:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0030_documentos_busqueda'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trabajoimagen',
+            name='tomado_en',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations
+
+
+def recalcular_calificaciones(apps, schema_editor):
+    # Los contadores pudieron desfasarse (o quedar negativos) antes de que registrar_calificacion
+    # se topara en 0: se rearman desde las reseñas
+    from tienda.calificaciones import recalcular_calificaciones
+
+    recalcular_calificaciones(
+        apps.get_model('tienda', 'Producto'),
+        apps.get_model('tienda', 'Review'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0031_trabajo_imagen_tomado_en'),
+    ]
+
+    operations = [
+        migrations.RunPython(recalcular_calificaciones, migrations.RunPython.noop),
+    ]
@@ -4,8 +4,13 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.db.models.signals import post_save
 from django.dispatch import receiver
-from django.db.models import Q
-from .utils import comprimir_imagen
+from django.db import connection
+from django.db.models import Case, When, Value, Count, Q, F, IntegerField, FloatField
+from django.db.models.functions import Cast, NullIf, Coalesce, Greatest
+from .utils import normalizar_texto, validar_tamano_imagen
+from . import imagenes
+from .storage import almacenamiento_media
+from .rastreo import RastreoCambiosMixin
 
 class Categoria(models.Model):
     nombre = models.CharField(max_length=50)
@@ -18,15 +23,40 @@ class Categoria(models.Model):
         verbose_name = "Categoría"
         verbose_name_plural = "Categorías"
 
+# Contadores de reseñas de Producto: solo los actualiza registrar_calificacion() (o el recálculo completo)
+CAMPOS_CALIFICACIONES = (
+    'calificaciones_cantidad', 'calificaciones_suma', 'calificacion_promedio',
+    'estrellas_1', 'estrellas_2', 'estrellas_3', 'estrellas_4', 'estrellas_5',
+)
+
+# Columnas que se escriben con update() desde afuera del save() (reseñas, worker de imágenes)
+CAMPOS_MANTENIDOS_APARTE = CAMPOS_CALIFICACIONES + ('imagen_derivadas',)
+
+# Límites de las franjas de precio del histograma del catálogo: [0, 5000), [5000, 10000), ... [100000, ∞)
+RANGOS_PRECIO = (0, 5000, 10000, 20000, 50000, 100000)
+
 class ProductoQuerySet(models.QuerySet):
     def buscar(self, query):
         if query:
-            return self.filter(
-                Q(nombre__icontains=query) | 
-                Q(descripcion__icontains=query)
-            )
+            # El motor (FTS5, tsvector o LIKE) depende de la base de datos; ver tienda/busqueda.py
+            from .busqueda import obtener_motor
+            return obtener_motor().filtrar(self, query)
         return self
 
+    def empiezan_con(self, texto):
+        """
+        Productos cuyo nombre normalizado empieza con `texto` (sin importar acentos ni mayúsculas).
+        Es una búsqueda por rango sobre un índice, no un LIKE '%q%'.
+        """
+        prefijo = normalizar_texto(texto)
+        if not prefijo:
+            return self
+        if connection.vendor == 'sqlite':
+            # El LIKE de SQLite no usa índices (es case-insensitive); un rango sí
+            return self.filter(nombre_busqueda__gte=prefijo, nombre_busqueda__lt=prefijo + '\uffff')
+        # En PostgreSQL Django crea el índice varchar_pattern_ops que sirve para LIKE 'q%'
+        return self.filter(nombre_busqueda__startswith=prefijo)
+
     def filtrar_por_categoria(self, categoria_slug):
         if categoria_slug:
             return self.filter(categoria__slug=categoria_slug)
@@ -40,22 +70,101 @@ class ProductoQuerySet(models.QuerySet):
             qs = qs.filter(precio__lte=max_price)
         return qs
 
+    def facetas(self, categoria_id=None, rangos=RANGOS_PRECIO):
+        """
+        Cuenta productos por categoría, en stock, en oferta y por franja de precio
+        con UNA sola consulta agrupada por (categoría, franja).
+        Los conteos por categoría usan todo el queryset; el resto se limita a
+        `categoria_id` si viene, para que reflejen la categoría elegida.
+        """
+        franja = Case(
+            *[When(precio__lt=limite, then=Value(i)) for i, limite in enumerate(rangos[1:])],
+            default=Value(len(rangos) - 1),
+            output_field=IntegerField(),
+        )
+        filas = (
+            self.order_by()
+            .annotate(franja=franja)
+            .values('categoria_id', 'franja')
+            .annotate(
+                total=Count('id'),
+                en_stock=Count('id', filter=Q(stock__gt=0)),
+                en_oferta=Count('id', filter=Q(en_oferta=True)),
+            )
+        )
+
+        resultado = {
+            'total': 0,
+            'en_stock': 0,
+            'en_oferta': 0,
+            'categorias': {},
+            'precios': [
+                {'desde': desde, 'hasta': hasta, 'cantidad': 0}
+                for desde, hasta in zip(rangos, list(rangos[1:]) + [None])
+            ],
+        }
+        for fila in filas:
+            categorias = resultado['categorias']
+            categorias[fila['categoria_id']] = categorias.get(fila['categoria_id'], 0) + fila['total']
+            if categoria_id is not None and fila['categoria_id'] != categoria_id:
+                continue
+            resultado['total'] += fila['total']
+            resultado['en_stock'] += fila['en_stock']
+            resultado['en_oferta'] += fila['en_oferta']
+            resultado['precios'][fila['franja']]['cantidad'] += fila['total']
+        return resultado
+
+    def registrar_calificacion(self, estrellas, signo=1):
+        """
+        Suma (signo=1) o resta (signo=-1) una reseña de `estrellas` a los contadores
+        de los productos del queryset, con un solo UPDATE atómico basado en F().
+        Al restar no se baja de 0: si los contadores ya estaban desfasados, el
+        recálculo completo (comando recalcular_calificaciones) los corrige.
+        """
+        def sumar(campo, delta):
+            valor = F(campo) + delta
+            return Greatest(valor, Value(0)) if delta < 0 else valor
+
+        cantidad = sumar('calificaciones_cantidad', signo)
+        suma = sumar('calificaciones_suma', signo * estrellas)
+        return self.update(**{
+            'calificaciones_cantidad': cantidad,
+            'calificaciones_suma': suma,
+            f'estrellas_{estrellas}': sumar(f'estrellas_{estrellas}', signo),
+            # El lado derecho de un UPDATE ve los valores viejos: el promedio se arma con las mismas expresiones
+            'calificacion_promedio': Coalesce(
+                Cast(suma, FloatField()) / NullIf(cantidad, 0), Value(0.0), output_field=FloatField()
+            ),
+        })
+
     def ordenar(self, orden):
+        # El 'id' desempata los precios iguales: la paginación por cursor necesita un orden total
         if orden == 'precio_asc':
-            return self.order_by('precio')
+            return self.order_by('precio', 'id')
         elif orden == 'precio_desc':
-            return self.order_by('-precio')
+            return self.order_by('-precio', '-id')
+        elif orden == 'calificacion':
+            return self.order_by('-calificacion_promedio', '-id')
+        elif orden == 'relevancia' and 'relevancia' in self.query.annotations:
+            # Solo existe si antes se llamó a buscar() con un motor de texto completo
+            return self.order_by('-relevancia', '-id')
         # Por defecto ordenamos por ID descendente (más nuevos primero)
         return self.order_by('-id')
 
-class Producto(models.Model):
+class Producto(RastreoCambiosMixin, models.Model):
     nombre = models.CharField(max_length=200)
+    # Código del proveedor o SKU: identifica el producto al reimportar la planilla (comando importar_productos)
+    codigo = models.CharField(max_length=50, unique=True, null=True, blank=True, verbose_name="Código / SKU")
     precio = models.DecimalField(max_digits=10, decimal_places=2)
     
     categoria = models.ForeignKey(Categoria, on_delete=models.SET_NULL, null=True, blank=True, related_name='productos')
     
     descripcion = models.TextField(blank=True)
-    imagen = models.ImageField(upload_to='joyas/', null=True, blank=True)
+    # Los archivos se nombran por su contenido: subir dos veces la misma foto no la duplica
+    imagen = models.ImageField(upload_to='joyas/', storage=almacenamiento_media, null=True, blank=True,
+                               validators=[validar_tamano_imagen])
+    # Manifiesto de versiones en varios anchos y formatos (lo arma tienda/imagenes.py)
+    imagen_derivadas = models.JSONField(default=dict, blank=True, editable=False)
     
     # El stock global se mantiene, pero la variante tendrá prioridad si existe
     stock = models.IntegerField(default=1, db_index=True)
@@ -63,25 +172,128 @@ class Producto(models.Model):
     en_oferta = models.BooleanField(default=False, verbose_name="¿Está en Oferta?")
     precio_oferta = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, verbose_name="Precio Rebajado")
 
+    # Claves de búsqueda precalculadas (minúsculas, sin acentos, espacios colapsados).
+    # Se mantienen solas en save(); no se editan a mano.
+    nombre_busqueda = models.CharField(max_length=200, db_index=True, editable=False, default="")
+    texto_busqueda = models.TextField(editable=False, default="")
+
+    # Resumen de las reseñas, mantenido por señales (ver tienda/signals.py).
+    # Evita un aggregate por producto en la ficha y permite ordenar el catálogo por estrellas.
+    calificaciones_cantidad = models.PositiveIntegerField(default=0, editable=False)
+    calificaciones_suma = models.PositiveIntegerField(default=0, editable=False)
+    calificacion_promedio = models.FloatField(default=0, editable=False)
+    estrellas_1 = models.PositiveIntegerField(default=0, editable=False)
+    estrellas_2 = models.PositiveIntegerField(default=0, editable=False)
+    estrellas_3 = models.PositiveIntegerField(default=0, editable=False)
+    estrellas_4 = models.PositiveIntegerField(default=0, editable=False)
+    estrellas_5 = models.PositiveIntegerField(default=0, editable=False)
+
     objects = ProductoQuerySet.as_manager()
 
+    class Meta:
+        indexes = [
+            # Índice compuesto para paginar por cursor los órdenes por precio
+            models.Index(fields=['precio', 'id'], name='producto_precio_id_idx'),
+            # Ídem para el orden "Mejor valorados"
+            models.Index(fields=['calificacion_promedio', 'id'], name='producto_calificacion_id_idx'),
+        ]
+
+    def actualizar_claves_busqueda(self):
+        self.nombre_busqueda = normalizar_texto(self.nombre)
+        self.texto_busqueda = normalizar_texto(f"{self.nombre} {self.descripcion}")
+
+    @property
+    def precio_actual(self):
+        # Precio que se cobra hoy: el rebajado si la oferta está activa
+        if self.en_oferta and self.precio_oferta:
+            return self.precio_oferta
+        return self.precio
+
+    def resumen_calificaciones(self):
+        """
+        Promedio, cantidad e histograma de estrellas (de 5 a 1) sin consultar las reseñas.
+        """
+        histograma = []
+        for estrellas in range(5, 0, -1):
+            cantidad = getattr(self, f'estrellas_{estrellas}')
+            histograma.append({
+                'estrellas': estrellas,
+                'cantidad': cantidad,
+                'porcentaje': round(100 * cantidad / self.calificaciones_cantidad) if self.calificaciones_cantidad else 0,
+            })
+        return {
+            'promedio': round(self.calificacion_promedio, 1),
+            'cantidad': self.calificaciones_cantidad,
+            'histograma': histograma,
+        }
+
+    # Solo se escriben las columnas que cambiaron (RastreoCambiosMixin). Los contadores de
+    # reseñas y las derivadas de la imagen nunca: se mantienen con update() desde afuera del save()
+    guardar_solo_cambiados = True
+    campos_fuera_del_save = CAMPOS_MANTENIDOS_APARTE
+
     def save(self, *args, **kwargs):
-        # Si hay imagen y es nueva (o ha cambiado), la comprimimos
-        if self.imagen:
-            # Verificamos si la imagen está siendo modificada comparando con la instancia en BD
-            try:
-                this = Producto.objects.get(id=self.id)
-                if this.imagen != self.imagen:
-                    self.imagen = comprimir_imagen(self.imagen, nuevo_ancho=800)
-            except Producto.DoesNotExist:
-                # Es un producto nuevo
-                self.imagen = comprimir_imagen(self.imagen, nuevo_ancho=800)
-        
+        self.actualizar_claves_busqueda()
+        # Comparamos contra lo que se cargó de la base (sin volver a consultarla)
+        cambiados = self.campos_cambiados()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'nombre', 'descripcion'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'nombre_busqueda', 'texto_busqueda'}
+
+        # Si hay imagen y es nueva (o ha cambiado), se comprime después de guardar
+        imagen_nueva = bool(self.imagen) and (cambiados is None or 'imagen' in cambiados)
+
         super().save(*args, **kwargs)
 
+        # Se guarda el original; la compresión y las derivadas se hacen fuera de la request (tienda/imagenes.py)
+        if imagen_nueva:
+            imagenes.encolar_compresion(self, 'imagen', 800)
+
     def __str__(self):
         return f"{self.nombre} - ${self.precio}"
     
+class DocumentoFTS(models.Model):
+    """
+    La tabla virtual FTS5 del buscador en SQLite (la crea tienda/busqueda.py, no Django).
+    Está declarada solo para poder unirla a Producto en las consultas: ver MotorSQLite.
+    """
+    producto = models.OneToOneField(Producto, on_delete=models.DO_NOTHING, primary_key=True, db_column='rowid',
+                                    db_constraint=False, related_name='documento_fts')
+
+    class Meta:
+        managed = False
+        db_table = 'tienda_producto_fts'
+
+class DocumentoTsvector(models.Model):
+    """
+    La tabla con el tsvector de cada producto en PostgreSQL (la crea tienda/busqueda.py).
+    Declarada para unirla a Producto en las consultas: ver MotorPostgres.
+    """
+    producto = models.OneToOneField(Producto, on_delete=models.DO_NOTHING, primary_key=True,
+                                    db_constraint=False, related_name='documento_tsvector')
+
+    class Meta:
+        managed = False
+        db_table = 'tienda_producto_busqueda'
+
+class ProductoRelacionado(models.Model):
+    """
+    Vecinos precalculados de cada producto (misma categoría, precio más parecido).
+    Lo mantiene tienda/relacionados.py; la ficha del producto los lee con una sola consulta.
+    """
+    producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='vecinos')
+    relacionado = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='+')
+    posicion = models.PositiveSmallIntegerField()
+
+    class Meta:
+        ordering = ['producto', 'posicion']
+        constraints = [
+            models.UniqueConstraint(fields=['producto', 'posicion'], name='producto_relacionado_posicion_unica'),
+        ]
+
+    def __str__(self):
+        return f"{self.producto_id} -> {self.relacionado_id} (#{self.posicion})"
+
 class Variante(models.Model):
     producto = models.ForeignKey(Producto, related_name='variantes', on_delete=models.CASCADE)
     nombre = models.CharField(max_length=50, help_text="Ej: Talla S, Rojo, 15ml")
@@ -90,6 +302,42 @@ class Variante(models.Model):
     def __str__(self):
         return f"{self.producto.nombre} - {self.nombre}"
     
+class ReservaStock(models.Model):
+    """
+    Unidades apartadas por un carrito hasta que vence (se renueva cada vez que el carrito cambia).
+    El stock disponible para los demás es stock - reservas vigentes; ver tienda/reservas.py.
+    """
+    token_carrito = models.CharField(max_length=32)
+    linea = models.CharField(max_length=50, help_text="Clave de la línea en el carrito (ej: 12 o 12_3)")
+    producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='reservas')
+    variante = models.ForeignKey(Variante, on_delete=models.CASCADE, null=True, blank=True, related_name='reservas')
+    cantidad = models.PositiveIntegerField()
+    vence = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['token_carrito', 'linea'], name='reserva_linea_unica'),
+        ]
+        indexes = [
+            # Suma de reservas vigentes por producto/variante
+            models.Index(fields=['producto', 'variante', 'vence'], name='reserva_producto_vence_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.cantidad} x {self.producto_id} (carrito {self.token_carrito[:8]}, vence {self.vence:%H:%M})"
+
+class ContenidoCarrito(models.Model):
+    """
+    Lo que tiene cada carrito, en el texto compacto de tienda/almacen_carrito.py.
+    La sesión guarda solo el token. Vence junto con las reservas del carrito.
+    """
+    token = models.CharField(max_length=32, unique=True)
+    contenido = models.TextField()
+    vence = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"Carrito {self.token[:8]} (vence {self.vence:%H:%M})"
+
 class Cupon(models.Model):
     codigo = models.CharField(max_length=50, unique=True, help_text="Ej: VERANO2025")
     descuento = models.IntegerField(help_text="Porcentaje de descuento (0-100)")
@@ -140,7 +388,7 @@ class DetalleOrden(models.Model):
             return f"{self.cantidad} x {self.producto.nombre} ({self.variante.nombre})"
         return f"{self.cantidad} x {self.producto.nombre}"
     
-class Perfil(models.Model):
+class Perfil(RastreoCambiosMixin, models.Model):
     # Relación 1 a 1: Un usuario tiene UN solo perfil
     usuario = models.OneToOneField(User, on_delete=models.CASCADE, related_name='perfil')
     
@@ -149,20 +397,23 @@ class Perfil(models.Model):
     direccion = models.CharField(max_length=150, blank=True, null=True, verbose_name="Dirección de Envío")
     ciudad = models.CharField(max_length=100, blank=True, null=True, verbose_name="Ciudad")
     codigo_postal = models.CharField(max_length=20, blank=True, null=True, verbose_name="Código Postal")
-    foto = models.ImageField(upload_to='perfiles/', blank=True, null=True, verbose_name="Foto de Perfil")
+    foto = models.ImageField(upload_to='perfiles/', storage=almacenamiento_media, blank=True, null=True, verbose_name="Foto de Perfil",
+                             validators=[validar_tamano_imagen])
+    foto_derivadas = models.JSONField(default=dict, blank=True, editable=False)
+
+    guardar_solo_cambiados = True
+    campos_fuera_del_save = ('foto_derivadas',)
 
     def save(self, *args, **kwargs):
-        if self.foto:
-            try:
-                this = Perfil.objects.get(id=self.id)
-                if this.foto != self.foto:
-                    # Para perfil usamos 300px, suficiente para el círculo
-                    self.foto = comprimir_imagen(self.foto, nuevo_ancho=300)
-            except Perfil.DoesNotExist:
-                self.foto = comprimir_imagen(self.foto, nuevo_ancho=300)
+        cambiados = self.campos_cambiados()
+        foto_nueva = bool(self.foto) and (cambiados is None or 'foto' in cambiados)
 
         super().save(*args, **kwargs)
 
+        # Para perfil usamos 300px, suficiente para el círculo
+        if foto_nueva:
+            imagenes.encolar_compresion(self, 'foto', 300)
+
     def __str__(self):
         return f"Perfil de {self.usuario.username}"
 
@@ -174,10 +425,51 @@ def crear_perfil_automatico(sender, instance, created, **kwargs):
 
 @receiver(post_save, sender=User)
 def guardar_perfil_automatico(sender, instance, **kwargs):
-    # Verificamos si existe el perfil antes de guardar para evitar errores raros
-    if hasattr(instance, 'perfil'):
+    # Solo si el perfil ya está cargado en el usuario y se le cambió algo:
+    # así un login (que guarda last_login) no consulta ni guarda el perfil
+    if User.perfil.is_cached(instance) and instance.perfil.campos_cambiados():
         instance.perfil.save()
 
+class Generacion(models.Model):
+    """
+    Contador que solo avanza (ver tienda/cache.py). Avanza con un UPDATE valor = valor + 1,
+    así que dos invalidaciones al mismo tiempo nunca se pisan.
+    """
+    nombre = models.CharField(max_length=50, unique=True)
+    valor = models.BigIntegerField()
+
+    def __str__(self):
+        return f"{self.nombre} = {self.valor}"
+
+class TrabajoImagen(models.Model):
+    """
+    Compresión de una imagen pendiente de hacer fuera de la request.
+    La encola imagenes.encolar_compresion y la procesa un hilo del proceso
+    o el comando procesar_imagenes.
+    """
+    ESTADOS = [
+        ('PENDIENTE', 'Pendiente'),
+        ('PROCESANDO', 'Procesando'),
+        ('LISTO', 'Listo'),
+        ('ERROR', 'Error'),
+    ]
+
+    modelo = models.CharField(max_length=100, help_text="app_label.Modelo (ej: tienda.Producto)")
+    objeto_id = models.PositiveBigIntegerField()
+    campo = models.CharField(max_length=50)
+    archivo = models.CharField(max_length=255, help_text="Nombre del original subido")
+    ancho = models.PositiveIntegerField()
+    estado = models.CharField(max_length=20, choices=ESTADOS, default='PENDIENTE', db_index=True)
+    intentos = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    # Cuándo lo tomó un worker: si sigue en PROCESANDO mucho después, el worker murió
+    tomado_en = models.DateTimeField(null=True, blank=True)
+    creado = models.DateTimeField(auto_now_add=True)
+    actualizado = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.modelo} #{self.objeto_id} {self.campo} ({self.get_estado_display()})"
+
 class Favorito(models.Model):
     usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='favoritos')
     producto = models.ForeignKey(Producto, on_delete=models.CASCADE)
@@ -190,7 +482,7 @@ class Favorito(models.Model):
     def __str__(self):
         return f"{self.usuario.username} ❤️ {self.producto.nombre}"
     
-class Review(models.Model):
+class Review(RastreoCambiosMixin, models.Model):
     producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='reviews')
     usuario = models.ForeignKey(User, on_delete=models.CASCADE)
     comentario = models.TextField(verbose_name="Tu opinión")
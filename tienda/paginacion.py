@@ -0,0 +1,139 @@
+import base64
+import json
+from decimal import Decimal, InvalidOperation
+from django.db.models import Q
+
+# Cantidad de joyas por página del catálogo
+PRODUCTOS_POR_PAGINA = 24
+
+# Para cada modo de `ProductoQuerySet.ordenar` guardamos las columnas que forman
+# la clave del cursor y si se recorren de forma descendente.
+# El 'id' siempre va al final para desempatar (dos joyas pueden costar lo mismo).
+CLAVES_ORDEN = {
+    'reciente': (('id', True),),
+    'precio_asc': (('precio', False), ('id', False)),
+    'precio_desc': (('precio', True), ('id', True)),
+    'relevancia': (('relevancia', True), ('id', True)),
+    'calificacion': (('calificacion_promedio', True), ('id', True)),
+}
+
+# Cómo volver a convertir cada valor guardado en el cursor
+TIPOS_CLAVE = {
+    'id': int,
+    'precio': Decimal,
+    'relevancia': float,
+    'calificacion_promedio': float,
+}
+
+
+def codificar_cursor(orden, valores):
+    """
+    Convierte la posición de la última joya mostrada en un texto seguro para la URL.
+    """
+    datos = json.dumps({'o': orden, 'v': [str(v) for v in valores]}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(datos.encode()).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor, orden):
+    """
+    Devuelve la lista de valores guardados en el cursor, o None si el cursor
+    es inválido o pertenece a otro orden (en ese caso se arranca desde la página 1).
+    """
+    if not cursor:
+        return None
+    try:
+        relleno = '=' * (-len(cursor) % 4)
+        datos = json.loads(base64.urlsafe_b64decode(cursor + relleno))
+        if datos.get('o') != orden or len(datos['v']) != len(CLAVES_ORDEN[orden]):
+            return None
+        return [
+            TIPOS_CLAVE[campo](valor)
+            for (campo, _), valor in zip(CLAVES_ORDEN[orden], datos['v'])
+        ]
+    except (ValueError, TypeError, KeyError, InvalidOperation, AttributeError):
+        return None
+
+
+def filtro_despues_de(orden, valores):
+    """
+    Arma el WHERE de "todo lo que viene después" del cursor, en lugar de un OFFSET.
+    Para (precio, id) ascendente queda: precio > p OR (precio = p AND id > i)
+    """
+    condicion = Q()
+    iguales = {}
+    for (campo, descendente), valor in zip(CLAVES_ORDEN[orden], valores):
+        lookup = 'lt' if descendente else 'gt'
+        condicion |= Q(**iguales, **{f'{campo}__{lookup}': valor})
+        iguales[campo] = valor
+    return condicion
+
+
+class PaginaCursor:
+    """
+    Página del catálogo paginada por cursor (keyset).
+    La consulta se ejecuta recién cuando el template lee los productos,
+    así que construirla no cuesta nada si nadie la usa.
+    """
+
+    def __init__(self, queryset, orden, cursor=None, por_pagina=PRODUCTOS_POR_PAGINA):
+        if orden not in CLAVES_ORDEN:
+            orden = 'reciente'
+        # Sin búsqueda de texto completo no hay relevancia: ordenar() ya cayó en '-id'
+        if orden == 'relevancia' and 'relevancia' not in queryset.query.annotations:
+            orden = 'reciente'
+        self.queryset = queryset
+        self.orden = orden
+        self.cursor = cursor
+        self.por_pagina = por_pagina
+        self._productos = None
+        self._hay_mas = False
+
+    def _consulta(self):
+        qs = self.queryset
+        valores = decodificar_cursor(self.cursor, self.orden)
+        if valores is not None:
+            qs = qs.filter(filtro_despues_de(self.orden, valores))
+        # Pedimos una joya de más para saber si existe una página siguiente
+        return qs[:self.por_pagina + 1]
+
+    def _guardar(self, productos):
+        self._hay_mas = len(productos) > self.por_pagina
+        self._productos = productos[:self.por_pagina]
+
+    def _cargar(self):
+        if self._productos is None:
+            self._guardar(list(self._consulta()))
+
+    async def acargar(self):
+        """
+        Trae la página con el ORM async (desde una vista async, antes de renderizar).
+        """
+        if self._productos is None:
+            self._guardar([producto async for producto in self._consulta()])
+
+    @property
+    def productos(self):
+        self._cargar()
+        return self._productos
+
+    @property
+    def hay_mas(self):
+        self._cargar()
+        return self._hay_mas
+
+    @property
+    def siguiente_cursor(self):
+        if not self.hay_mas:
+            return None
+        ultimo = self.productos[-1]
+        valores = [getattr(ultimo, campo) for campo, _ in CLAVES_ORDEN[self.orden]]
+        return codificar_cursor(self.orden, valores)
+
+    def __iter__(self):
+        return iter(self.productos)
+
+    def __len__(self):
+        return len(self.productos)
+
+    def __bool__(self):
+        return bool(self.productos)
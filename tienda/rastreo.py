@@ -0,0 +1,114 @@
+import copy
+from contextlib import nullcontext
+from django.core.files import File
+from django.db import DatabaseError, connections, router, transaction
+from django.db.models import FileField
+
+
+def _normalizar(valor):
+    # De los archivos solo importa el nombre; los JSON se copian para detectar cambios hechos "en el lugar"
+    if isinstance(valor, File):
+        return valor.name
+    if isinstance(valor, (dict, list)):
+        return copy.deepcopy(valor)
+    return valor
+
+
+class RastreoCambiosMixin:
+    """
+    Guarda los valores con que se cargó la instancia de la base, para saber qué
+    cambió sin volver a consultarla. Se usa antes de models.Model:
+
+        class Producto(RastreoCambiosMixin, models.Model): ...
+
+    Solo se registran los campos que se cargaron (los diferidos con only()/defer()
+    no cuentan como cambiados). La foto se actualiza después de save() y de refresh_from_db().
+
+    Con `guardar_solo_cambiados`, save() sin update_fields escribe solo las columnas que
+    cambiaron, menos `campos_fuera_del_save` (las que se mantienen con update() desde afuera).
+    Si no cambió nada se escriben todas las columnas menos esas y los archivos: las señales
+    se disparan igual, pero una instancia vieja no pisa lo que se actualizó por afuera.
+    """
+    guardar_solo_cambiados = False
+    campos_fuera_del_save = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        instancia._guardar_originales()
+        return instancia
+
+    def _guardar_originales(self):
+        self._originales = {
+            campo.attname: _normalizar(self.__dict__[campo.attname])
+            for campo in self._meta.concrete_fields
+            if campo.attname in self.__dict__
+        }
+
+    def campos_cambiados(self):
+        """
+        Nombres de los campos que cambiaron desde que se cargó (o guardó) la instancia.
+        Devuelve None si la instancia es nueva y todavía no hay nada con qué comparar.
+        """
+        originales = getattr(self, '_originales', None)
+        if self._state.adding or originales is None:
+            return None
+        return {
+            campo.name
+            for campo in self._meta.concrete_fields
+            if campo.attname in originales and campo.attname in self.__dict__
+            and _normalizar(self.__dict__[campo.attname]) != originales[campo.attname]
+        }
+
+    def cambio(self, *campos):
+        cambiados = self.campos_cambiados()
+        return cambiados is None or bool(cambiados & set(campos))
+
+    def valor_original(self, campo):
+        return getattr(self, '_originales', {}).get(self._meta.get_field(campo).attname)
+
+    def _campos_a_guardar(self):
+        # Lo que cambió, menos lo que se mantiene aparte. Si no cambió nada, igual se escribe
+        # (para que el save() dispare sus señales) pero sin los campos mantenidos aparte ni los
+        # archivos: una instancia vieja pisaría los contadores o volvería a poner una foto ya reemplazada
+        cambiados = self.campos_cambiados()
+        if cambiados is None:
+            return None
+        fuera = set(self.campos_fuera_del_save)
+        if cambiados - fuera:
+            return cambiados - fuera
+        return {
+            campo.name for campo in self._meta.concrete_fields
+            if not campo.primary_key and campo.name not in fuera and not isinstance(campo, FileField)
+        }
+
+    def _do_update(self, *args, **kwargs):
+        # save() necesita saber si el UPDATE encontró la fila (Django solo lanza DatabaseError)
+        actualizadas = super()._do_update(*args, **kwargs)
+        self._fila_encontrada = bool(actualizadas)
+        return actualizadas
+
+    def save(self, *args, **kwargs):
+        campos = None
+        if self.guardar_solo_cambiados and kwargs.get('update_fields') is None and not args:
+            campos = self._campos_a_guardar()
+        if campos:
+            # Dentro de un atomic el error marcaría toda la transacción: lo aislamos en un savepoint
+            using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+            aislado = transaction.atomic(using=using) if connections[using].in_atomic_block else nullcontext()
+            self._fila_encontrada = None
+            try:
+                with aislado:
+                    super().save(*args, update_fields=campos, **kwargs)
+            except DatabaseError:
+                # Solo si el UPDATE no encontró la fila (la borraron): como un save() normal, se vuelve a insertar
+                if self._fila_encontrada is not False:
+                    raise
+                super().save(*args, **kwargs)
+        else:
+            super().save(*args, **kwargs)
+        self._guardar_originales()
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self._guardar_originales()
@@ -0,0 +1,116 @@
+import random
+from bisect import bisect_left
+from decimal import Decimal
+
+# Cuántos vecinos guardamos por producto y cuántos mostramos en la ficha
+VECINOS_POR_PRODUCTO = 12
+RELACIONADOS_MOSTRADOS = 4
+
+# Franja de precio "parecido": entre la mitad y el doble del precio del producto
+FRANJA_MINIMA = Decimal('0.5')
+FRANJA_MAXIMA = Decimal('2.0')
+
+
+def _distancia(precio, otro):
+    # Relación entre precios (siempre >= 1): 100 vs 200 y 200 vs 100 están igual de lejos
+    return max(precio, otro) / max(min(precio, otro), Decimal('0.01'))
+
+
+def vecinos_por_producto(productos, k=VECINOS_POR_PRODUCTO):
+    """
+    Recibe filas (id, precio, stock) de UNA categoría y devuelve {id: [ids vecinos]}
+    con los `k` productos en stock de precio más parecido, del más cercano al más lejano.
+    Como los candidatos están ordenados por precio, alcanza con abrirse hacia los dos lados.
+    """
+    candidatos = sorted((precio, pk) for pk, precio, stock in productos if stock > 0)
+    precios = [precio for precio, _ in candidatos]
+
+    resultado = {}
+    for pk, precio, _ in productos:
+        derecha = bisect_left(precios, precio)
+        izquierda = derecha - 1
+        vecinos = []
+        while len(vecinos) < k and (izquierda >= 0 or derecha < len(candidatos)):
+            if derecha >= len(candidatos) or (
+                izquierda >= 0 and _distancia(precio, precios[izquierda]) <= _distancia(precio, precios[derecha])
+            ):
+                elegido = candidatos[izquierda][1]
+                izquierda -= 1
+            else:
+                elegido = candidatos[derecha][1]
+                derecha += 1
+            if elegido != pk:
+                vecinos.append(elegido)
+        resultado[pk] = vecinos
+    return resultado
+
+
+def recalcular_categoria(categoria_id, Producto=None, ProductoRelacionado=None):
+    """
+    Recalcula los vecinos de todos los productos de una categoría (None = sin categoría).
+    Los modelos se pueden pasar para usarlo desde una migración.
+    """
+    if Producto is None:
+        from .models import Producto, ProductoRelacionado
+
+    filas = list(Producto.objects.filter(categoria_id=categoria_id).values_list('id', 'precio', 'stock'))
+    vecinos = vecinos_por_producto(filas)
+
+    ProductoRelacionado.objects.filter(producto_id__in=vecinos.keys()).delete()
+    ProductoRelacionado.objects.bulk_create(
+        [
+            ProductoRelacionado(producto_id=pk, relacionado_id=vecino, posicion=posicion)
+            for pk, lista in vecinos.items()
+            for posicion, vecino in enumerate(lista)
+        ],
+        batch_size=1000,
+    )
+    return len(filas)
+
+
+def recalcular_todo(Producto=None, ProductoRelacionado=None):
+    if Producto is None:
+        from .models import Producto, ProductoRelacionado
+
+    categorias = Producto.objects.order_by().values_list('categoria_id', flat=True).distinct()
+    return sum(recalcular_categoria(c, Producto, ProductoRelacionado) for c in list(categorias))
+
+
+def relacionados_de(producto, cantidad=RELACIONADOS_MOSTRADOS):
+    """
+    Devuelve `cantidad` productos relacionados con una sola consulta por índice.
+    Rotan al azar entre los vecinos precalculados, prefiriendo los de precio parecido.
+    """
+    vecinos = [fila.relacionado for fila in _vecinos_en_stock(producto)]
+    return _elegir(producto, vecinos, cantidad)
+
+
+async def arelacionados_de(producto, cantidad=RELACIONADOS_MOSTRADOS):
+    """
+    relacionados_de() con el ORM async, para las vistas de tienda/vistas_async.py.
+    """
+    vecinos = [fila.relacionado async for fila in _vecinos_en_stock(producto)]
+    return _elegir(producto, vecinos, cantidad)
+
+
+def _vecinos_en_stock(producto):
+    from .models import ProductoRelacionado
+
+    # El stock se vuelve a mirar acá: una compra lo descuenta con update() y no recalcula
+    return (
+        ProductoRelacionado.objects
+        .filter(producto=producto, relacionado__stock__gt=0)
+        .select_related('relacionado')
+    )
+
+
+def _elegir(producto, vecinos, cantidad):
+    minimo, maximo = producto.precio * FRANJA_MINIMA, producto.precio * FRANJA_MAXIMA
+    en_franja = [p for p in vecinos if minimo <= p.precio <= maximo]
+    if len(en_franja) >= cantidad:
+        return random.sample(en_franja, cantidad)
+
+    # No alcanzan los de precio parecido: completamos con los más cercanos del resto (ya vienen ordenados)
+    resto = [p for p in vecinos if not minimo <= p.precio <= maximo]
+    random.shuffle(en_franja)
+    return en_franja + resto[:cantidad - len(en_franja)]
@@ -0,0 +1,68 @@
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+from .models import Producto, Variante, ReservaStock
+
+# Lo mismo que dura un carrito sin actividad: si el carrito vence, sus reservas también
+VIGENCIA_RESERVA = timedelta(hours=2)
+
+
+def reservas_vigentes(producto_ids, excluir_token=None):
+    """
+    Unidades reservadas y no vencidas, agrupadas por (producto_id, variante_id).
+    Con `excluir_token` no cuenta las del propio carrito. Es una sola consulta agrupada.
+    """
+    qs = ReservaStock.objects.filter(producto_id__in=producto_ids, vence__gt=timezone.now())
+    if excluir_token:
+        qs = qs.exclude(token_carrito=excluir_token)
+    return {
+        (fila['producto_id'], fila['variante_id']): fila['total']
+        for fila in qs.order_by().values('producto_id', 'variante_id').annotate(total=Sum('cantidad'))
+    }
+
+
+def reservar(token, linea, producto, variante, cantidad, nombre, validar=True):
+    """
+    Deja reservadas `cantidad` unidades para la línea del carrito (reemplaza la reserva anterior).
+    Si `validar`, bloquea la fila con stock y lanza ValueError si no alcanza lo que queda libre.
+    """
+    with transaction.atomic():
+        if validar:
+            modelo = Variante if variante else Producto
+            stock = modelo.objects.select_for_update().values_list('stock', flat=True).get(
+                pk=variante.id if variante else producto.id
+            )
+            clave = (producto.id, variante.id if variante else None)
+            disponible = stock - reservas_vigentes([producto.id], excluir_token=token).get(clave, 0)
+            if cantidad > disponible:
+                raise ValueError(f"Lo sentimos, solo quedan {max(disponible, 0)} unidades de {nombre}.")
+
+        ReservaStock.objects.update_or_create(
+            token_carrito=token, linea=linea,
+            defaults={
+                'producto': producto,
+                'variante': variante,
+                'cantidad': cantidad,
+                'vence': timezone.now() + VIGENCIA_RESERVA,
+            },
+        )
+
+
+def renovar(token):
+    # El carrito tuvo actividad: sus reservas vuelven a durar VIGENCIA_RESERVA
+    ReservaStock.objects.filter(token_carrito=token).update(vence=timezone.now() + VIGENCIA_RESERVA)
+
+
+def liberar(token, linea=None):
+    qs = ReservaStock.objects.filter(token_carrito=token)
+    if linea is not None:
+        qs = qs.filter(linea=linea)
+    qs.delete()
+
+
+def liberar_vencidas():
+    """
+    Borra en lote las reservas vencidas. Devuelve cuántas se liberaron.
+    """
+    return ReservaStock.objects.filter(vence__lte=timezone.now()).delete()[0]
@@ -1,7 +1,105 @@
+from collections import defaultdict
 from django.db import transaction
+from django.db.models import Case, When, F, Q
 from .models import Orden, DetalleOrden, Producto, Variante, Cupon
+from .cache import invalidar_catalogo
+from . import reservas
 
-def procesar_compra(usuario, carrito, datos_orden, cupon_id=None):
+
+def _descontar(modelo, cantidades):
+    """
+    Resta las cantidades {id: n} con UN solo UPDATE condicional:
+    solo se tocan las filas que todavía tienen stock suficiente.
+    Devuelve True si se pudieron descontar todas.
+    """
+    condicion = Q()
+    for pk, cantidad in cantidades.items():
+        condicion |= Q(pk=pk, stock__gte=cantidad)
+    actualizadas = modelo.objects.filter(condicion).update(
+        stock=Case(*[When(pk=pk, then=F('stock') - cantidad) for pk, cantidad in cantidades.items()])
+    )
+    return actualizadas == len(cantidades)
+
+
+def confirmar_items_orden(orden, items, token=None):
+    """
+    Valida el stock, crea los DetalleOrden y descuenta el stock de los items
+    del carrito (dicts con producto_id, variante_id y cantidad).
+
+    Con `token` la compra convierte las reservas de ese carrito (tienda/reservas.py):
+    las unidades ya estaban apartadas, así que no bloqueamos las filas y el UPDATE
+    condicional alcanza. Sin token bloquea todos los productos y variantes en una
+    consulta por tabla, siempre en orden de id, para que dos compras simultáneas
+    no se bloqueen mutuamente. Tiene que llamarse dentro de transaction.atomic().
+    Lanza ValueError si algún producto no existe o no tiene stock suficiente.
+    """
+    items = [
+        (int(item["producto_id"]), item.get("variante_id"), int(item["cantidad"]))
+        for item in items
+    ]
+
+    # Una sola consulta por tabla, con los locks (si hacen falta) tomados en orden de id
+    ids_productos = {pid for pid, _, _ in items}
+    ids_variantes = {vid for _, vid, _ in items if vid}
+    qs_productos, qs_variantes = Producto.objects.all(), Variante.objects.all()
+    if token is None:
+        qs_productos, qs_variantes = qs_productos.select_for_update(), qs_variantes.select_for_update()
+    productos = {p.id: p for p in qs_productos.filter(id__in=ids_productos).order_by('id')}
+    variantes = {v.id: v for v in qs_variantes.filter(id__in=ids_variantes).order_by('id')} if ids_variantes else {}
+
+    # Lo que tienen apartado otros carritos no se puede vender
+    reservado = reservas.reservas_vigentes(ids_productos, excluir_token=token)
+
+    # Sumamos por fila: el mismo producto puede venir en más de una línea
+    por_producto = defaultdict(int)
+    por_variante = defaultdict(int)
+    detalles = []
+    for producto_id, variante_id, cantidad in items:
+        producto = productos.get(producto_id)
+        variante_obj = variantes.get(variante_id) if variante_id else None
+        if producto is None or (variante_id and (variante_obj is None or variante_obj.producto_id != producto_id)):
+            raise ValueError("Uno de los productos de tu carrito ya no está disponible.")
+
+        if variante_obj:
+            por_variante[variante_obj.id] += cantidad
+            stock_actual, pedido = variante_obj.stock, por_variante[variante_obj.id]
+            stock_actual -= reservado.get((producto.id, variante_obj.id), 0)
+            nombre_ref = f"{producto.nombre} ({variante_obj.nombre})"
+        else:
+            por_producto[producto.id] += cantidad
+            stock_actual, pedido = producto.stock, por_producto[producto.id]
+            stock_actual -= reservado.get((producto.id, None), 0)
+            nombre_ref = producto.nombre
+
+        if stock_actual < pedido:
+            raise ValueError(f"Lo sentimos, ya no hay suficiente stock de {nombre_ref}.")
+
+        detalles.append(DetalleOrden(
+            orden=orden,
+            producto=producto,
+            variante=variante_obj,
+            cantidad=cantidad,
+            precio_unitario=producto.precio_actual,
+        ))
+
+    DetalleOrden.objects.bulk_create(detalles)
+
+    # El UPDATE condicional es la última defensa: en bases sin locks de fila
+    # (SQLite ignora select_for_update) otra compra pudo ganar la carrera
+    if (por_producto and not _descontar(Producto, por_producto)) or \
+            (por_variante and not _descontar(Variante, por_variante)):
+        raise ValueError("Lo sentimos, otro cliente compró las últimas unidades mientras pagabas.")
+
+    # La reserva se convirtió en venta
+    if token:
+        reservas.liberar(token)
+
+    # update() no dispara señales: avisamos a la cache del catálogo que cambió el stock
+    transaction.on_commit(invalidar_catalogo)
+    return detalles
+
+
+def procesar_compra(usuario, carrito, datos_orden, cupon_id=None, token=None):
     """
     Procesa la compra: crea la orden, valida stock, crea detalles y actualiza stock.
     Retorna la orden creada.
@@ -20,47 +118,10 @@ def procesar_compra(usuario, carrito, datos_orden, cupon_id=None):
             telefono=datos_orden.get('telefono', '')
         )
 
-        # 2. Procesar Items del Carrito
-        for key, item in carrito.items():
-            # Bloqueamos el producto para evitar condiciones de carrera
-            producto = Producto.objects.select_for_update().get(id=item["producto_id"])
-            variante_id = item.get("variante_id")
-            variante_obj = None
-            cantidad = int(item["cantidad"])
-
-            if variante_id:
-                # Bloqueamos la variante también
-                variante_obj = Variante.objects.select_for_update().get(id=variante_id)
-                stock_actual = variante_obj.stock
-                nombre_ref = f"{producto.nombre} ({variante_obj.nombre})"
-            else:
-                stock_actual = producto.stock
-                nombre_ref = producto.nombre
-
-            # 3. Validar Stock
-            if stock_actual < cantidad:
-                raise ValueError(f"Lo sentimos, ya no hay suficiente stock de {nombre_ref}.")
-
-            precio_final_unitario = producto.precio_actual
-
-            # 4. Crear Detalle de Orden
-            DetalleOrden.objects.create(
-                orden=orden,
-                producto=producto,
-                variante=variante_obj,
-                cantidad=cantidad,
-                precio_unitario=precio_final_unitario
-            )
-
-            # 5. Actualizar Stock
-            if variante_obj:
-                variante_obj.stock -= cantidad
-                variante_obj.save()
-            else:
-                producto.stock -= cantidad
-                producto.save()
-
-        # 6. Registrar uso del cupón (si existe)
+        # 2. Validar stock, crear los detalles y descontar (todo en lote)
+        confirmar_items_orden(orden, carrito.values(), token=token)
+
+        # 3. Registrar uso del cupón (si existe)
         if cupon_id:
             try:
                 cupon_usado = Cupon.objects.select_for_update().get(id=cupon_id)
@@ -0,0 +1,101 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Producto, Variante, Categoria, Review
+from .busqueda import obtener_motor
+from .autocompletado import indice_autocompletado
+from .cache import invalidar_catalogo
+from .relacionados import recalcular_categoria
+
+
+# --- ÍNDICE DE BÚSQUEDA ---
+@receiver(post_save, sender=Producto)
+def indexar_producto(sender, instance, raw=False, **kwargs):
+    # raw=True cuando se carga un fixture (loaddata): lo reindexa el comando reindexar_busqueda
+    if not raw:
+        obtener_motor().indexar(instance)
+
+@receiver(post_delete, sender=Producto)
+def desindexar_producto(sender, instance, **kwargs):
+    obtener_motor().eliminar(instance.id)
+
+
+# --- AUTOCOMPLETADO EN MEMORIA ---
+@receiver(post_save, sender=Producto)
+def actualizar_autocompletado(sender, instance, raw=False, **kwargs):
+    if not raw:
+        # Solo parcheamos el índice si la transacción se confirma
+        transaction.on_commit(lambda: indice_autocompletado.actualizar(instance))
+
+@receiver(post_delete, sender=Producto)
+def quitar_de_autocompletado(sender, instance, **kwargs):
+    producto_id = instance.id
+    transaction.on_commit(lambda: indice_autocompletado.quitar(producto_id))
+
+
+# --- GENERACIÓN DEL CATÁLOGO (invalida los fragmentos cacheados) ---
+@receiver(post_save, sender=Producto)
+@receiver(post_delete, sender=Producto)
+@receiver(post_save, sender=Variante)
+@receiver(post_delete, sender=Variante)
+@receiver(post_save, sender=Categoria)
+@receiver(post_delete, sender=Categoria)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidar_fragmentos_catalogo(sender, raw=False, **kwargs):
+    if not raw:
+        transaction.on_commit(invalidar_catalogo)
+
+
+# --- PRODUCTOS RELACIONADOS PRECALCULADOS ---
+def _datos_relacion(categoria_id, precio, stock):
+    # Lo único que cambia los vecinos: categoría, precio y si hay stock
+    return (categoria_id, precio, stock > 0)
+
+@receiver(post_save, sender=Producto)
+def recalcular_relacionados(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    # Los valores con que se cargó la instancia (RastreoCambiosMixin): no hace falta consultar
+    if not created and not instance.cambio('categoria', 'precio', 'stock'):
+        return
+    anteriores = None
+    if not created:
+        anteriores = _datos_relacion(
+            instance.valor_original('categoria'), instance.valor_original('precio'), instance.valor_original('stock') or 0
+        )
+    actuales = _datos_relacion(instance.categoria_id, instance.precio, instance.stock)
+    if anteriores == actuales:
+        return
+
+    categorias = {instance.categoria_id}
+    if anteriores is not None:
+        # Si cambió de categoría, la vieja también pierde un vecino
+        categorias.add(anteriores[0])
+    for categoria_id in categorias:
+        transaction.on_commit(lambda c=categoria_id: recalcular_categoria(c))
+
+@receiver(post_delete, sender=Producto)
+def recalcular_relacionados_al_borrar(sender, instance, **kwargs):
+    categoria_id = instance.categoria_id
+    transaction.on_commit(lambda: recalcular_categoria(categoria_id))
+
+
+# --- RESUMEN DE CALIFICACIONES (contadores en Producto) ---
+@receiver(post_save, sender=Review)
+def sumar_calificacion(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        Producto.objects.filter(pk=instance.producto_id).registrar_calificacion(instance.calificacion)
+        return
+    # Edición (por ejemplo, desde el admin): se descuenta la versión anterior y se suma la nueva
+    if instance.cambio('producto', 'calificacion'):
+        anterior = (instance.valor_original('producto'), instance.valor_original('calificacion'))
+        if None not in anterior:
+            Producto.objects.filter(pk=anterior[0]).registrar_calificacion(anterior[1], -1)
+        Producto.objects.filter(pk=instance.producto_id).registrar_calificacion(instance.calificacion)
+
+@receiver(post_delete, sender=Review)
+def restar_calificacion(sender, instance, **kwargs):
+    Producto.objects.filter(pk=instance.producto_id).registrar_calificacion(instance.calificacion, -1)
@@ -0,0 +1,174 @@
+import hashlib
+import os
+import posixpath
+import re
+import time
+from collections import Counter
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.utils.deconstruct import deconstructible
+
+# joyas/3f/3fa9...c1.jpg
+PATRON_NOMBRE = re.compile(r'^(?:.+/)?([0-9a-f]{2})/\1[0-9a-f]{62}\.\w+$')
+
+# Carpetas donde viven los archivos subidos por la tienda (las recorre el recolector de huérfanos)
+CARPETAS_MEDIA = ('joyas', 'perfiles', 'derivadas')
+
+
+def hash_contenido(contenido):
+    """
+    sha256 del archivo leído por partes (no carga fotos enteras en memoria).
+    """
+    resumen = hashlib.sha256()
+    if hasattr(contenido, 'seek'):
+        contenido.seek(0)
+    for parte in contenido.chunks() if hasattr(contenido, 'chunks') else iter(lambda: contenido.read(65536), b''):
+        resumen.update(parte)
+    if hasattr(contenido, 'seek'):
+        contenido.seek(0)
+    return resumen.hexdigest()
+
+
+@deconstructible
+class AlmacenamientoPorContenido(FileSystemStorage):
+    """
+    Guarda cada archivo con el hash de su contenido como nombre: joyas/3f/3fa9...c1.jpg
+    Si alguien sube una foto idéntica a otra que ya existe, no se escribe nada:
+    las dos filas apuntan al mismo archivo. Por eso nunca hay que borrar un archivo
+    directamente: usar liberar_archivo(), que primero cuenta las referencias.
+    """
+
+    def nombre_por_contenido(self, name, content):
+        carpeta = posixpath.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        resumen = hash_contenido(content)
+        return posixpath.join(carpeta, resumen[:2], f"{resumen}{extension}")
+
+    def _save(self, name, content):
+        nombre = self.nombre_por_contenido(name, content)
+        if tocar(self, nombre):
+            # Mismo contenido = mismo archivo: deduplicado. Queda con fecha nueva para que el
+            # recolector no lo tome por un huérfano viejo antes de que se confirme la fila que lo usa
+            return nombre
+        try:
+            return super()._save(nombre, content)
+        except _YaGuardado:
+            # Otro proceso lo escribió entre el exists() y el open(): es el mismo contenido
+            return nombre
+
+    def get_available_name(self, name, max_length=None):
+        # El nombre definitivo sale del contenido en _save(); no hace falta inventar sufijos al azar.
+        # FileSystemStorage._save() lo vuelve a pedir si el archivo apareció mientras tanto:
+        # con un nombre por contenido eso significa que ya está guardado (y no hay que reintentar)
+        if es_nombre_por_contenido(name) and self.exists(name):
+            raise _YaGuardado(name)
+        return name
+
+
+class _YaGuardado(Exception):
+    pass
+
+
+almacenamiento_media = AlmacenamientoPorContenido()
+
+
+def tocar(storage, nombre):
+    """
+    Actualiza la fecha de modificación de `nombre` (como `touch`). Devuelve False si no existe.
+    """
+    try:
+        os.utime(storage.path(nombre))
+    except FileNotFoundError:
+        return False
+    except NotImplementedError:
+        # Storage sin archivos locales: solo se puede ver si existe
+        return storage.exists(nombre)
+    return True
+
+
+def es_nombre_por_contenido(nombre):
+    return bool(PATRON_NOMBRE.match(nombre or ''))
+
+
+def archivos_referenciados():
+    """
+    Cuenta cuántas veces se usa cada archivo: fotos de productos y perfiles,
+    sus derivadas y los originales que todavía esperan su trabajo de compresión.
+    Devuelve un Counter {nombre: referencias}.
+    """
+    from .models import Producto, Perfil, TrabajoImagen
+
+    referencias = Counter()
+    for modelo, campo in ((Producto, 'imagen'), (Perfil, 'foto')):
+        for nombre, manifiesto in modelo.objects.exclude(**{campo: ''}).values_list(campo, f'{campo}_derivadas').iterator():
+            if nombre:
+                referencias[nombre] += 1
+            for versiones in (manifiesto or {}).get('formatos', {}).values():
+                for version in versiones:
+                    referencias[version['nombre']] += 1
+    for nombre in TrabajoImagen.objects.filter(estado__in=['PENDIENTE', 'PROCESANDO']).values_list('archivo', flat=True):
+        referencias[nombre] += 1
+    return referencias
+
+
+def referencias_de(nombre):
+    """
+    Cantidad de filas que apuntan a `nombre` (una consulta por columna, sin recorrer todo).
+    """
+    from .models import Producto, Perfil, TrabajoImagen
+
+    return (
+        Producto.objects.filter(imagen=nombre).count()
+        + Perfil.objects.filter(foto=nombre).count()
+        + TrabajoImagen.objects.filter(estado__in=['PENDIENTE', 'PROCESANDO'], archivo=nombre).count()
+    )
+
+
+def liberar_archivo(storage, nombre, tocado_antes_de=None):
+    """
+    Borra el archivo solo si ya nadie lo usa. Devuelve True si se borró.
+    Con `tocado_antes_de`, tampoco si se modificó después: alguien volvió a subir el mismo
+    contenido (ver AlmacenamientoPorContenido._save) y su fila todavía puede no estar confirmada.
+    """
+    if not nombre:
+        return False
+    if tocado_antes_de is not None:
+        try:
+            if storage.get_modified_time(nombre) > tocado_antes_de:
+                return False
+        except FileNotFoundError:
+            return False
+    # Las referencias se cuentan justo antes de borrar
+    if referencias_de(nombre):
+        return False
+    storage.delete(nombre)
+    return True
+
+
+def recolectar_huerfanos(antiguedad_minima=3600, simular=False, storage=None):
+    """
+    Borra los archivos de CARPETAS_MEDIA que no usa ninguna fila. Los más nuevos que
+    `antiguedad_minima` segundos se respetan: pueden ser de una subida en curso.
+    Devuelve (cantidad, bytes) de lo que se borró (o se borraría, si `simular`).
+    """
+    storage = storage or default_storage
+    referencias = archivos_referenciados()
+    limite = time.time() - antiguedad_minima
+    cantidad = liberados = 0
+
+    pendientes = [carpeta for carpeta in CARPETAS_MEDIA if storage.exists(carpeta)]
+    while pendientes:
+        carpeta = pendientes.pop()
+        subcarpetas, archivos = storage.listdir(carpeta)
+        pendientes.extend(posixpath.join(carpeta, sub) for sub in subcarpetas)
+        for archivo in archivos:
+            nombre = posixpath.join(carpeta, archivo)
+            if referencias[nombre] or storage.get_modified_time(nombre).timestamp() > limite:
+                continue
+            # Las referencias se contaron al empezar: se vuelven a mirar justo antes de borrar
+            if referencias_de(nombre):
+                continue
+            cantidad += 1
+            liberados += storage.size(nombre)
+            if not simular:
+                storage.delete(nombre)
+    return cantidad, liberados
@@ -0,0 +1,61 @@
+from django import template
+from django.core.files.storage import default_storage
+from django.utils.html import format_html, format_html_join
+
+register = template.Library()
+
+TIPOS = {'avif': 'image/avif', 'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+
+
+def _srcset(versiones):
+    return ', '.join(f"{default_storage.url(v['nombre'])} {v['ancho']}w" for v in versiones)
+
+
+def _estilo_marcador(manifiesto, ajuste):
+    # La versión borrosa de 20 px hace de fondo del <img> hasta que llega la foto.
+    # `ajuste` tiene que ser el object-fit de la clase CSS para que ocupe el mismo lugar que la foto.
+    if not manifiesto.get('lqip'):
+        return ''
+    return f"background: url({manifiesto['lqip']}) center / {ajuste} no-repeat;"
+
+
+@register.simple_tag
+def imagen_responsiva(objeto, campo='imagen', sizes='100vw', alt='', clase='', lazy=True, ajuste='contain'):
+    """
+    Emite un <picture> con un <source> por formato (srcset con todos los anchos)
+    y un <img> de respaldo con su ancho y alto reales (el navegador reserva el lugar)
+    y el marcador borroso de fondo. Si la foto todavía no tiene derivadas (o son de otra foto)
+    devuelve un <img> simple con el archivo original.
+
+    Uso: {% imagen_responsiva joya 'imagen' sizes="(max-width: 600px) 50vw, 280px" alt=joya.nombre clase="card-img" %}
+    """
+    archivo = getattr(objeto, campo, None)
+    if not archivo:
+        return ''
+    carga = 'lazy' if lazy else 'eager'
+    manifiesto = getattr(objeto, f'{campo}_derivadas', None) or {}
+    formatos = manifiesto.get('formatos') or {}
+
+    if manifiesto.get('origen') != archivo.name:
+        return format_html('<img src="{}" alt="{}" class="{}" loading="{}">', archivo.url, alt, clase, carga)
+    estilo = _estilo_marcador(manifiesto, ajuste)
+    if not formatos:
+        return format_html(
+            '<img src="{}" width="{}" height="{}" alt="{}" class="{}" loading="{}" style="{}">',
+            archivo.url, manifiesto['ancho'], manifiesto['alto'], alt, clase, carga, estilo,
+        )
+
+    # El último formato es el de respaldo (normalmente JPEG); los anteriores van como <source>
+    nombres = list(formatos)
+    respaldo = formatos[nombres[-1]]
+    fuentes = format_html_join(
+        '', '<source type="{}" srcset="{}" sizes="{}">',
+        ((TIPOS.get(f, f'image/{f}'), _srcset(formatos[f]), sizes) for f in nombres[:-1]),
+    )
+    mediana = respaldo[min(1, len(respaldo) - 1)]
+    alto = round(manifiesto['alto'] * mediana['ancho'] / manifiesto['ancho'])
+    return format_html(
+        '<picture style="display: contents;">{}<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" alt="{}" class="{}" loading="{}" style="{}"></picture>',
+        fuentes, default_storage.url(mediana['nombre']), _srcset(respaldo), sizes,
+        mediana['ancho'], alto, alt, clase, carga, estilo,
+    )
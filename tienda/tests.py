@@ -1,11 +1,34 @@
 # --- IMPORTACIONES NECESARIAS PARA LOS TESTS DE CONCURRENCIA ---
+import os
 import threading
 import time
-from django.test import TransactionTestCase, Client
+from decimal import Decimal
+from datetime import timedelta
+from django.utils import timezone
+from django.test import TestCase, TransactionTestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.db import connection
 from django.urls import reverse
+from django.template import Template, Context
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from io import StringIO
 from django.contrib.auth.models import User
-from tienda.models import Producto, Orden
+from django.core.cache import cache
+from tienda.models import (
+    Producto, Orden, DetalleOrden, Categoria, ProductoRelacionado, Review, Variante, ReservaStock, TrabajoImagen, Favorito,
+)
+from tienda.calificaciones import recalcular_calificaciones
+from tienda.services import procesar_compra
+from tienda.reservas import liberar_vencidas
+from tienda.imagenes import procesar_pendientes
+from tienda.storage import es_nombre_por_contenido, recolectar_huerfanos
+from tienda.paginacion import PRODUCTOS_POR_PAGINA, PaginaCursor
+from tienda.autocompletado import indice_autocompletado
+from tienda.cache import generacion_catalogo, invalidar_catalogo, soltar_lock, tomar_lock
+from tienda.relacionados import relacionados_de, vecinos_por_producto
+from tienda.consultas import PresupuestoConsultasMixin, PresupuestoExcedido, huella
 
 # --- CLASE DE PRUEBAS DE RIESGO ---
 class PruebasDeRiesgoStock(TransactionTestCase):
@@ -118,4 +141,1443 @@ class PruebasDeRiesgoStock(TransactionTestCase):
         if es_vulnerable:
             print(">>> VULNERABILIDAD CONFIRMADA: Sobreventa detectada.")
 
-        self.assertTrue(es_vulnerable, "El sistema permitió vender más productos de los que existían.")
\ No newline at end of file
+        self.assertTrue(es_vulnerable, "El sistema permitió vender más productos de los que existían.")
+
+    def test_escenario_3_compras_concurrentes_en_lote(self):
+        """
+        ESCENARIO 3: Varios compradores pagan a la vez carritos con los mismos
+        productos cargados en distinto orden. Mide cuánto tarda y verifica que
+        nunca se venda de más ni quede una orden a medias.
+        """
+        print("\n--- Iniciando Test: Compras Concurrentes en Lote ---")
+        productos = [Producto.objects.create(nombre=f"Anillo Lote {i}", precio=500, stock=4) for i in range(3)]
+        compradores = [User.objects.create_user(username=f'lote_{i}', password='123') for i in range(6)]
+
+        # Los carritos se llenan antes: lo único simultáneo es el pago
+        clientes = []
+        for i, comprador in enumerate(compradores):
+            cliente = Client()
+            cliente.login(username=comprador.username, password='123')
+            for producto in (productos if i % 2 else productos[::-1]):
+                cliente.get(reverse('agregar_carrito', args=[producto.id]))
+            clientes.append(cliente)
+
+        def pagar(cliente):
+            datos = {'direccion': 'X', 'ciudad': 'X', 'codigo_postal': '1', 'telefono': '1'}
+            cliente.post(reverse('finalizar_compra'), datos)
+            connection.close()
+
+        hilos = [threading.Thread(target=pagar, args=(cliente,)) for cliente in clientes]
+        inicio = time.perf_counter()
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        duracion = time.perf_counter() - inicio
+
+        ordenes = Orden.objects.filter(usuario__in=compradores).prefetch_related('items')
+        print(f"{len(hilos)} compras simultáneas en {duracion:.2f}s, órdenes confirmadas: {len(ordenes)}")
+
+        for orden in ordenes:
+            self.assertEqual(len(orden.items.all()), 3, "Quedó una orden con detalles a medias.")
+        for producto in productos:
+            producto.refresh_from_db()
+            vendidos = sum(d.cantidad for o in ordenes for d in o.items.all() if d.producto_id == producto.id)
+            self.assertGreaterEqual(producto.stock, 0)
+            self.assertEqual(producto.stock + vendidos, 4)
+
+
+# --- PAGINACIÓN POR CURSOR DEL CATÁLOGO ---
+class PaginacionCatalogoTests(TestCase):
+    """
+    El catálogo se recorre página a página con un cursor, sin repetir ni saltear joyas.
+    """
+
+    def setUp(self):
+        # Precios repetidos a propósito para probar el desempate por id
+        for i in range(7):
+            Producto.objects.create(nombre=f"Joya {i}", precio=100 * (i % 3 + 1), stock=5)
+
+    def recorrer(self, orden):
+        vistos = []
+        cursor = None
+        while True:
+            qs = Producto.objects.buscar("joya").ordenar(orden)
+            pagina = PaginaCursor(qs, orden, cursor=cursor, por_pagina=3)
+            vistos.extend(p.id for p in pagina)
+            cursor = pagina.siguiente_cursor
+            if not cursor:
+                return vistos
+
+    def test_recorre_todos_los_ordenes_sin_repetir(self):
+        for orden in ['reciente', 'precio_asc', 'precio_desc', 'relevancia']:
+            esperado = list(Producto.objects.buscar("joya").ordenar(orden).values_list('id', flat=True))
+            self.assertEqual(self.recorrer(orden), esperado, orden)
+
+    def test_cursor_invalido_vuelve_a_la_primera_pagina(self):
+        respuesta = self.client.get(reverse('catalogo'), {'cursor': 'basura!!'})
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(len(respuesta.context['pagina']), 7)
+
+    def test_endpoint_scroll_infinito(self):
+        primera = PaginaCursor(Producto.objects.all().ordenar('precio_asc'), 'precio_asc', por_pagina=5)
+        respuesta = self.client.get(reverse('catalogo_pagina_ajax'), {
+            'orden': 'precio_asc',
+            'cursor': primera.siguiente_cursor,
+        })
+        datos = respuesta.json()
+        self.assertEqual(datos['cantidad'], 2)
+        self.assertIsNone(datos['siguiente'])
+
+
+
+# --- BÚSQUEDA DE TEXTO COMPLETO ---
+class BusquedaProductosTests(TestCase):
+    """
+    buscar() usa el índice de texto completo: ignora acentos, entiende plurales
+    y ordena por relevancia (el nombre pesa más que la descripción).
+    """
+
+    def setUp(self):
+        self.anillo = Producto.objects.create(nombre="Anillo Dorado", precio=500, descripcion="Oro 18k")
+        self.collar = Producto.objects.create(nombre="Collar de perlas", precio=800, descripcion="Combina con anillos dorados")
+        self.aros = Producto.objects.create(nombre="Aros de plata", precio=300, descripcion="Plata 925")
+
+    def test_ignora_acentos_y_plurales(self):
+        ids = set(Producto.objects.buscar("ANILLOS dorádos").values_list('id', flat=True))
+        self.assertEqual(ids, {self.anillo.id, self.collar.id})
+
+    def test_ordena_por_relevancia(self):
+        resultado = list(Producto.objects.buscar("anillo").ordenar('relevancia'))
+        self.assertEqual(resultado, [self.anillo, self.collar])
+
+    def test_indice_sigue_los_cambios(self):
+        self.aros.nombre = "Aros dorados"
+        self.aros.save()
+        self.anillo.delete()
+        ids = set(Producto.objects.buscar("dorado").values_list('id', flat=True))
+        self.assertEqual(ids, {self.collar.id, self.aros.id})
+
+    def test_sin_tope_de_resultados_y_en_una_consulta(self):
+        from tienda.busqueda import obtener_motor
+
+        Producto.objects.bulk_create([Producto(nombre=f"Anillo liso {i}", precio=100) for i in range(600)])
+        obtener_motor().reconstruir(Producto.objects.all())
+        self.assertEqual(Producto.objects.buscar("anillo").count(), 602)
+
+        # La coincidencia y la relevancia las resuelve la base: una sola consulta por página
+        pagina = PaginaCursor(Producto.objects.buscar("anillo").ordenar('relevancia'), 'relevancia')
+        with self.assertNumQueries(1):
+            self.assertEqual(len(pagina), PRODUCTOS_POR_PAGINA)
+        self.assertTrue(pagina.hay_mas)
+
+
+# --- AUTOCOMPLETADO EN MEMORIA ---
+class AutocompletadoTests(TransactionTestCase):
+    """
+    El buscador del header responde desde memoria y se mantiene al día con las señales.
+    (TransactionTestCase porque el índice se parchea recién en el commit.)
+    """
+
+    def setUp(self):
+        indice_autocompletado.invalidar()
+        self.anillo = Producto.objects.create(nombre="Anillo Dorado", precio=500)
+        Producto.objects.create(nombre="Aros de plata", precio=300)
+
+    def buscar(self, q):
+        return [r['nombre'] for r in self.client.get(reverse('buscar_productos_ajax'), {'q': q}).json()['resultados']]
+
+    def test_prefijo_de_cualquier_palabra_sin_consultas(self):
+        indice_autocompletado.construir()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.buscar("DORÁ"), ["Anillo Dorado"])
+
+    def test_sin_indice_usa_el_prefijo_normalizado(self):
+        # Simulamos una reconstrucción en curso para que no arranque el hilo
+        indice_autocompletado._reconstruyendo = True
+        try:
+            self.assertEqual(self.buscar("ANÍLLO do"), ["Anillo Dorado"])
+        finally:
+            indice_autocompletado._reconstruyendo = False
+
+    def test_se_actualiza_con_las_senales(self):
+        indice_autocompletado.construir()
+        self.anillo.nombre = "Anillo Plateado"
+        self.anillo.save()
+        Producto.objects.create(nombre="Dije dorado", precio=100)
+        self.assertEqual(self.buscar("dorado"), ["Dije dorado"])
+        self.anillo.delete()
+        self.assertEqual(self.buscar("anillo"), [])
+        # Los cambios de este proceso ya están parcheados: no hace falta reconstruir
+        self.assertFalse(indice_autocompletado._vencido())
+
+    def test_solo_los_productos_lo_vencen(self):
+        from unittest import mock
+        from tienda.autocompletado import CLAVE_VERSION
+
+        indice_autocompletado.construir()
+        Variante.objects.create(producto=self.anillo, nombre="Talle 12", stock=1)
+        Review.objects.create(producto=self.anillo, usuario=User.objects.create_user('r', password='x'),
+                              calificacion=5, comentario="Lindo")
+        with mock.patch('tienda.autocompletado.REVISAR_CADA', 0):
+            self.assertFalse(indice_autocompletado._vencido())
+            # Otro worker cambió un producto
+            cache.set(CLAVE_VERSION, 'de otro proceso', None)
+            self.assertTrue(indice_autocompletado._vencido())
+
+    def test_entre_revisiones_no_lee_la_cache(self):
+        from unittest import mock
+
+        indice_autocompletado.construir()
+        with mock.patch('tienda.autocompletado.cache') as cache_compartida:
+            self.assertEqual(self.buscar("dora"), ["Anillo Dorado"])
+        cache_compartida.get.assert_not_called()
+
+
+# --- CLAVES DE BÚSQUEDA NORMALIZADAS ---
+class ClavesBusquedaTests(TestCase):
+
+    def test_se_calculan_al_guardar(self):
+        joya = Producto.objects.create(nombre="  Anillo   DORÁDO ", precio=1, descripcion="Oro Rosé")
+        self.assertEqual(joya.nombre_busqueda, "anillo dorado")
+        self.assertEqual(joya.texto_busqueda, "anillo dorado oro rose")
+
+        joya.nombre = "Anillo Plateado"
+        joya.save(update_fields=['nombre'])
+        joya.refresh_from_db()
+        self.assertEqual(joya.nombre_busqueda, "anillo plateado")
+        self.assertEqual(list(Producto.objects.empiezan_con("ANILLO pla")), [joya])
+
+
+# --- FACETAS DEL CATÁLOGO ---
+class FacetasCatalogoTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.anillos = Categoria.objects.create(nombre="Anillos", slug="anillos")
+        self.aros = Categoria.objects.create(nombre="Aros", slug="aros")
+        Producto.objects.create(nombre="Anillo A", precio=1000, stock=0, categoria=self.anillos)
+        Producto.objects.create(nombre="Anillo B", precio=7000, stock=2, en_oferta=True, categoria=self.anillos)
+        Producto.objects.create(nombre="Aro C", precio=150000, stock=5, categoria=self.aros)
+
+    def test_una_sola_consulta(self):
+        with self.assertNumQueries(1):
+            facetas = Producto.objects.all().facetas(categoria_id=self.anillos.id)
+
+        self.assertEqual(facetas['categorias'], {self.anillos.id: 2, self.aros.id: 1})
+        self.assertEqual((facetas['total'], facetas['en_stock'], facetas['en_oferta']), (2, 1, 1))
+        self.assertEqual([f['cantidad'] for f in facetas['precios']], [1, 1, 0, 0, 0, 0])
+
+        # También sobre una búsqueda (que trae la anotación de relevancia)
+        self.assertEqual(Producto.objects.buscar("anillo").facetas()['total'], 2)
+
+    def test_catalogo_muestra_conteos_y_cachea(self):
+        respuesta = self.client.get(reverse('catalogo'), {'max_price': 10000})
+        self.assertEqual(respuesta.context['barra']['facetas']['categorias'], {self.anillos.id: 2})
+        self.assertContains(respuesta, "(2)")
+
+        # update() no dispara señales: la segunda visita sale de la cache con los conteos viejos
+        Producto.objects.filter(nombre="Aro C").update(precio=500)
+        respuesta = self.client.get(reverse('catalogo'), {'max_price': 10000})
+        self.assertContains(respuesta, "Aros <small style=\"opacity: 0.6;\">(0)</small>", html=False)
+
+
+    def test_filtros_equivalentes_comparten_las_facetas(self):
+        from django.test import RequestFactory
+        from tienda.views import _clave_facetas
+
+        def clave(**filtros):
+            return _clave_facetas(RequestFactory().get('/', filtros))
+
+        self.assertEqual(clave(categoria='Anillos', min_price='100'), clave(categoria='anillos', min_price='100.00'))
+        self.assertEqual(clave(q='  Anillo Dorádo'), clave(q='anillo dorado'))
+        self.assertNotEqual(clave(min_price='100'), clave(max_price='100'))
+
+        # La categoría se filtra igual que se cachea: sin importar mayúsculas
+        respuesta = self.client.get(reverse('catalogo'), {'categoria': 'Anillos'})
+        self.assertEqual([joya.nombre for joya in respuesta.context['joyas']], ["Anillo B", "Anillo A"])
+
+# --- CACHE DE FRAGMENTOS VERSIONADA ---
+class CacheCatalogoTests(TransactionTestCase):
+    """
+    Los visitantes anónimos reciben el catálogo desde la cache y cualquier cambio
+    en productos, variantes, categorías o reseñas pasa a una nueva generación.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.joya = Producto.objects.create(nombre="Anillo Cacheado", precio=500, stock=3)
+
+    def test_los_tests_no_usan_la_cache_de_la_tienda(self):
+        from django.conf import settings
+        # EjecutorPruebas la manda a una carpeta temporal: el cache.clear() de arriba no borra la real
+        self.assertNotEqual(settings.CACHES['default']['LOCATION'], os.path.join(settings.TIENDA_CACHE_DIR, 'general'))
+        self.assertFalse(settings.TIENDA_LOCKS_DIR.startswith(settings.TIENDA_CACHE_DIR))
+        self.assertTrue(cache.make_key('x').startswith(settings.CACHES['default']['KEY_PREFIX']))
+
+    def test_catalogo_anonimo_sale_de_la_cache(self):
+        self.client.get(reverse('catalogo'))
+        with self.assertNumQueries(0):
+            self.client.get(reverse('catalogo'))
+
+    def test_guardar_producto_invalida(self):
+        generacion = generacion_catalogo()
+        self.assertContains(self.client.get(reverse('catalogo')), "Anillo Cacheado")
+
+        self.joya.nombre = "Anillo Renovado"
+        self.joya.save()
+
+        self.assertNotEqual(generacion_catalogo(), generacion)
+        self.assertContains(self.client.get(reverse('catalogo')), "Anillo Renovado")
+
+    def test_detalle_anonimo_sale_de_la_cache(self):
+        url = reverse('detalle', args=[self.joya.id])
+        self.client.get(url)
+        # Solo queda el get_object_or_404 del producto
+        with self.assertNumQueries(1):
+            self.client.get(url)
+
+
+# --- PRODUCTOS RELACIONADOS PRECALCULADOS ---
+class RelacionadosTests(TestCase):
+
+    def setUp(self):
+        self.collares = Categoria.objects.create(nombre="Collares", slug="collares")
+        self.aros = Categoria.objects.create(nombre="Aros", slug="aros")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.joya = Producto.objects.create(nombre="Collar Base", precio=1000, stock=2, categoria=self.collares)
+            self.cercanos = [
+                Producto.objects.create(nombre=f"Collar {precio}", precio=precio, stock=1, categoria=self.collares)
+                for precio in (600, 900, 1200, 1800)
+            ]
+            self.lejano = Producto.objects.create(nombre="Collar Lujo", precio=9000, stock=1, categoria=self.collares)
+            Producto.objects.create(nombre="Aro", precio=1000, stock=1, categoria=self.aros)
+
+    def test_vecinos_por_precio_mas_parecido(self):
+        vecinos = vecinos_por_producto([(1, 100, 1), (2, 110, 1), (3, 300, 1), (4, 95, 0), (5, 80, 1)], k=3)
+        self.assertEqual(vecinos[1], [2, 5, 3])
+        # El que no tiene stock tiene vecinos pero no aparece como vecino de nadie
+        self.assertEqual(vecinos[4], [1, 2, 5])
+
+    def test_una_sola_consulta_y_misma_franja(self):
+        with self.assertNumQueries(1):
+            relacionados = relacionados_de(self.joya)
+        self.assertCountEqual(relacionados, self.cercanos)
+
+    def test_se_recalcula_al_cambiar_precio_o_categoria(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.lejano.precio = 1100
+            self.lejano.save()
+        vecinos = list(ProductoRelacionado.objects.filter(producto=self.joya).values_list('relacionado_id', flat=True))
+        self.assertEqual(vecinos[0], self.lejano.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.lejano.categoria = self.aros
+            self.lejano.save()
+        self.assertFalse(ProductoRelacionado.objects.filter(producto=self.joya, relacionado=self.lejano).exists())
+        self.assertTrue(ProductoRelacionado.objects.filter(producto=self.lejano).exists())
+
+    def test_sin_cambios_relevantes_no_recalcula(self):
+        antes = list(ProductoRelacionado.objects.values_list('id', flat=True))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.joya.descripcion = "Nueva descripción"
+            self.joya.save()
+        # Recalcular borra y vuelve a crear las filas: si no se tocó, los ids son los mismos
+        self.assertEqual(list(ProductoRelacionado.objects.values_list('id', flat=True)), antes)
+
+
+# --- CONTADORES DE RESEÑAS EN PRODUCTO ---
+class CalificacionesTests(TestCase):
+
+    def setUp(self):
+        self.usuario = User.objects.create_user(username='opinador', password='123')
+        self.otro = User.objects.create_user(username='opinador2', password='123')
+        self.joya = Producto.objects.create(nombre="Pulsera Opinada", precio=800, stock=5)
+
+    def test_contadores_siguen_a_las_resenas(self):
+        Review.objects.create(producto=self.joya, usuario=self.usuario, comentario="Linda", calificacion=5)
+        review = Review.objects.create(producto=self.joya, usuario=self.otro, comentario="Meh", calificacion=2)
+        self.joya.refresh_from_db()
+        self.assertEqual((self.joya.calificaciones_cantidad, self.joya.calificaciones_suma), (2, 7))
+        self.assertAlmostEqual(self.joya.calificacion_promedio, 3.5)
+        self.assertEqual((self.joya.estrellas_5, self.joya.estrellas_2), (1, 1))
+
+        # Borrar desde la vista eliminar_review también descuenta
+        self.client.login(username='opinador2', password='123')
+        self.client.get(reverse('eliminar_review', args=[review.id]))
+        self.joya.refresh_from_db()
+        self.assertEqual((self.joya.calificaciones_cantidad, self.joya.estrellas_2), (1, 0))
+        self.assertAlmostEqual(self.joya.calificacion_promedio, 5.0)
+
+    def test_save_de_una_instancia_vieja_no_pisa_los_contadores(self):
+        vieja = Producto.objects.get(pk=self.joya.pk)
+        Review.objects.create(producto=self.joya, usuario=self.usuario, comentario="Linda", calificacion=4)
+        vieja.stock = 3
+        vieja.save()
+        self.joya.refresh_from_db()
+        self.assertEqual((self.joya.stock, self.joya.calificaciones_cantidad), (3, 1))
+
+    def test_recalcular_desde_cero(self):
+        Review.objects.create(producto=self.joya, usuario=self.usuario, comentario="Linda", calificacion=4)
+        Producto.objects.update(calificaciones_cantidad=0, calificaciones_suma=0, calificacion_promedio=0, estrellas_4=0)
+        recalcular_calificaciones()
+        self.joya.refresh_from_db()
+        self.assertEqual(self.joya.resumen_calificaciones()['cantidad'], 1)
+        self.assertEqual(self.joya.resumen_calificaciones()['promedio'], 4.0)
+
+    def test_restar_no_baja_de_cero(self):
+        review = Review.objects.create(producto=self.joya, usuario=self.usuario, comentario="Linda", calificacion=4)
+        # Contadores desfasados (p. ej. por un update() a mano): borrar la reseña no los deja negativos
+        Producto.objects.update(calificaciones_cantidad=0, calificaciones_suma=0, calificacion_promedio=0, estrellas_4=0)
+        review.delete()
+        self.joya.refresh_from_db()
+        self.assertEqual((self.joya.calificaciones_cantidad, self.joya.calificaciones_suma, self.joya.estrellas_4), (0, 0, 0))
+        self.assertEqual(self.joya.calificacion_promedio, 0)
+
+    def test_ordenar_por_calificacion(self):
+        mejor = Producto.objects.create(nombre="Pulsera Top", precio=900, stock=5)
+        Review.objects.create(producto=mejor, usuario=self.usuario, comentario="Top", calificacion=5)
+        Review.objects.create(producto=self.joya, usuario=self.usuario, comentario="Ok", calificacion=3)
+        pagina = PaginaCursor(Producto.objects.ordenar('calificacion'), 'calificacion', por_pagina=1)
+        self.assertEqual(pagina.productos, [mejor])
+        siguiente = PaginaCursor(Producto.objects.ordenar('calificacion'), 'calificacion', pagina.siguiente_cursor, por_pagina=1)
+        self.assertEqual(siguiente.productos, [self.joya])
+
+
+# --- PRECIOS DEL CARRITO EN LOTE ---
+def carrito_de(cliente):
+    # Contenido del carrito del cliente (vive en el almacén, la sesión solo tiene el token)
+    from tienda import almacen_carrito
+    return almacen_carrito.leer(cliente.session.get('carrito_token'))[0]
+
+
+class CarritoLineasTests(TestCase):
+
+    def setUp(self):
+        self.productos = [
+            Producto.objects.create(nombre=f"Dije {i}", precio=100 + i, stock=10) for i in range(10)
+        ]
+        self.oferta = self.productos[0]
+        self.oferta.en_oferta = True
+        self.oferta.precio_oferta = 50
+        self.oferta.save()
+        self.variante = Variante.objects.create(producto=self.productos[1], nombre="Plata", stock=1)
+
+    def _llenar(self, cantidad):
+        for producto in self.productos[:cantidad]:
+            self.client.get(reverse('agregar_carrito', args=[producto.id]))
+
+    def _consultas_ver_carrito(self):
+        with CaptureQueriesContext(connection) as consultas:
+            self.client.get(reverse('ver_carrito'))
+        return len(consultas)
+
+    def test_consultas_no_dependen_de_la_cantidad_de_lineas(self):
+        self._llenar(2)
+        con_dos = self._consultas_ver_carrito()
+        self._llenar(10)
+        self.assertEqual(self._consultas_ver_carrito(), con_dos)
+
+    def test_total_usa_precio_actual_y_quita_huerfanos(self):
+        self._llenar(2)
+        self.client.get(reverse('agregar_carrito', args=[self.productos[1].id]), {'variante': self.variante.id})
+        self.productos[1].delete()
+
+        respuesta = self.client.get(reverse('ver_carrito'))
+        self.assertEqual(respuesta.context['total'], Decimal('50'))
+        self.assertEqual(list(carrito_de(self.client)), [str(self.oferta.id)])
+
+
+# --- CONFIRMACIÓN DE STOCK EN LOTE ---
+class ConfirmarItemsOrdenTests(TestCase):
+
+    def setUp(self):
+        self.usuario = User.objects.create_user(username='cliente_lote', password='123')
+        self.anillo = Producto.objects.create(nombre="Anillo", precio=1000, stock=3)
+        self.collar = Producto.objects.create(nombre="Collar", precio=2000, stock=5, en_oferta=True, precio_oferta=1500)
+        self.talle = Variante.objects.create(producto=self.collar, nombre="45cm", stock=1)
+
+    def _items(self, *lineas):
+        return [{"producto_id": p.id, "variante_id": v.id if v else None, "cantidad": c} for p, v, c in lineas]
+
+    def test_descuenta_en_lote_con_consultas_fijas(self):
+        carrito = {str(i): item for i, item in enumerate(self._items(
+            (self.collar, self.talle, 1), (self.anillo, None, 2), (self.collar, None, 1),
+        ))}
+        # Orden + 2 SELECT FOR UPDATE + reservas de otros + bulk_create + 2 UPDATE (más savepoints)
+        with CaptureQueriesContext(connection) as consultas:
+            orden = procesar_compra(self.usuario, carrito, {'total': 5500})
+        self.assertLessEqual(len([q for q in consultas if 'SAVEPOINT' not in q['sql']]), 7)
+
+        self.assertEqual(orden.items.count(), 3)
+        self.assertEqual(set(orden.items.values_list('precio_unitario', flat=True)), {Decimal('1000'), Decimal('1500')})
+        self.anillo.refresh_from_db(); self.collar.refresh_from_db(); self.talle.refresh_from_db()
+        self.assertEqual((self.anillo.stock, self.collar.stock, self.talle.stock), (1, 4, 0))
+
+    def test_sin_stock_no_toca_nada(self):
+        carrito = {'a': self._items((self.anillo, None, 2))[0], 'b': self._items((self.anillo, None, 2))[0]}
+        with self.assertRaisesMessage(ValueError, "Anillo"):
+            procesar_compra(self.usuario, carrito, {'total': 4000})
+        self.anillo.refresh_from_db()
+        self.assertEqual(self.anillo.stock, 3)
+        self.assertFalse(Orden.objects.exists())
+
+
+# --- RESERVAS DE STOCK DESDE EL CARRITO ---
+class ReservasStockTests(TestCase):
+
+    def setUp(self):
+        self.joya = Producto.objects.create(nombre="Broche Escaso", precio=700, stock=2)
+        self.comprador = User.objects.create_user(username='reserva_a', password='123')
+        self.otro = Client()
+
+    def test_agregar_reserva_y_bloquea_a_otros_carritos(self):
+        self.client.get(reverse('agregar_carrito', args=[self.joya.id]))
+        self.client.get(reverse('agregar_carrito', args=[self.joya.id]))
+        self.assertEqual(ReservaStock.objects.get().cantidad, 2)
+
+        # El segundo carrito ya no puede llevarse ninguna unidad
+        respuesta = self.otro.get(reverse('agregar_carrito', args=[self.joya.id]), follow=True)
+        self.assertContains(respuesta, "solo quedan 0 unidades")
+        self.assertEqual(carrito_de(self.otro), {})
+
+        # Al restar se libera una para el otro
+        self.client.get(reverse('restar_carrito', args=[self.joya.id]))
+        self.otro.get(reverse('agregar_carrito', args=[self.joya.id]))
+        self.assertEqual(sorted(ReservaStock.objects.values_list('cantidad', flat=True)), [1, 1])
+
+        self.client.get(reverse('eliminar_carrito', args=[self.joya.id]))
+        self.assertEqual(ReservaStock.objects.count(), 1)
+
+    def test_la_compra_convierte_la_reserva(self):
+        self.client.login(username='reserva_a', password='123')
+        self.client.get(reverse('agregar_carrito', args=[self.joya.id]))
+        datos = {'direccion': 'X', 'ciudad': 'X', 'codigo_postal': '1', 'telefono': '1'}
+        self.client.post(reverse('finalizar_compra'), datos)
+
+        self.joya.refresh_from_db()
+        self.assertEqual(self.joya.stock, 1)
+        self.assertFalse(ReservaStock.objects.exists())
+
+    def test_las_vencidas_no_cuentan_y_se_barren(self):
+        self.client.get(reverse('agregar_carrito', args=[self.joya.id]))
+        self.client.get(reverse('agregar_carrito', args=[self.joya.id]))
+        ReservaStock.objects.update(vence=timezone.now() - timedelta(minutes=1))
+
+        self.otro.get(reverse('agregar_carrito', args=[self.joya.id]))
+        self.assertEqual(len(carrito_de(self.otro)), 1)
+        self.assertEqual(liberar_vencidas(), 1)
+
+
+# --- CARRITO FUERA DE LA SESIÓN ---
+class AlmacenCarritoTests(TestCase):
+
+    def setUp(self):
+        self.anillo = Producto.objects.create(nombre="Anillo Liso", precio=300, stock=5)
+        self.aros = Producto.objects.create(nombre="Aros", precio=200, stock=5)
+        self.talle = Variante.objects.create(producto=self.aros, nombre="Chico", stock=5)
+
+    def test_codificacion_ida_y_vuelta(self):
+        from tienda import almacen_carrito
+
+        items = {
+            '1': {'producto_id': 1, 'variante_id': None, 'cantidad': 2},
+            '2_7': {'producto_id': 2, 'variante_id': 7, 'cantidad': 1},
+        }
+        self.assertEqual(almacen_carrito.codificar(items, 1700000000), "1700000000|1::2|2:7:1")
+        self.assertEqual(almacen_carrito.decodificar(almacen_carrito.codificar(items, 1700000000)), (items, 1700000000))
+
+    def test_la_sesion_solo_guarda_el_token(self):
+        from django.contrib.sessions.models import Session
+
+        self.client.get(reverse('agregar_carrito', args=[self.anillo.id]))
+        self.assertEqual(set(self.client.session.keys()) - {'_messages'}, {'carrito_token'})
+        fila = Session.objects.get()
+
+        # Agregar más no vuelve a escribir la sesión (solo el almacén)
+        self.client.get(reverse('agregar_carrito', args=[self.anillo.id]))
+        self.client.get(reverse('agregar_carrito', args=[self.aros.id]), {'variante': self.talle.id})
+        self.assertEqual(Session.objects.get().expire_date, fila.expire_date)
+        self.assertEqual(carrito_de(self.client), {
+            str(self.anillo.id): {'producto_id': self.anillo.id, 'variante_id': None, 'cantidad': 2},
+            f"{self.aros.id}_{self.talle.id}": {'producto_id': self.aros.id, 'variante_id': self.talle.id, 'cantidad': 1},
+        })
+
+    def test_migra_el_carrito_viejo_de_la_sesion(self):
+        sesion = self.client.session
+        sesion['carrito'] = {str(self.anillo.id): {
+            'producto_id': self.anillo.id, 'variante_id': None, 'cantidad': 3, 'precio': '300', 'nombre': 'Anillo Liso',
+        }}
+        sesion['carrito_ultimo_acceso'] = timezone.now().isoformat()
+        sesion.save()
+
+        respuesta = self.client.get(reverse('ver_carrito'))
+        self.assertEqual(respuesta.context['total'], Decimal('900'))
+        self.assertNotIn('carrito', self.client.session)
+        self.assertEqual(carrito_de(self.client)[str(self.anillo.id)]['cantidad'], 3)
+
+    def test_sin_cambios_no_escribe(self):
+        from unittest import mock
+
+        self.client.get(reverse('agregar_carrito', args=[self.anillo.id]))
+        with mock.patch('tienda.almacen_carrito.guardar') as guardar:
+            self.client.get(reverse('ver_carrito'))
+            self.client.get(reverse('catalogo'))
+        guardar.assert_not_called()
+
+    def test_vaciar_borra_la_entrada(self):
+        from tienda.models import ContenidoCarrito
+
+        self.client.get(reverse('agregar_carrito', args=[self.anillo.id]))
+        self.assertEqual(ContenidoCarrito.objects.count(), 1)
+        self.client.get(reverse('eliminar_carrito', args=[self.anillo.id]))
+        self.assertFalse(ContenidoCarrito.objects.exists())
+
+    def test_la_limpieza_de_la_cache_no_se_lleva_el_carrito(self):
+        self.client.get(reverse('agregar_carrito', args=[self.anillo.id]))
+        cache.clear()
+        self.assertEqual(carrito_de(self.client)[str(self.anillo.id)]['cantidad'], 1)
+
+    def test_los_vencidos_no_se_leen_y_se_barren(self):
+        from tienda.models import ContenidoCarrito
+
+        self.client.get(reverse('agregar_carrito', args=[self.anillo.id]))
+        ContenidoCarrito.objects.update(vence=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(carrito_de(self.client), {})
+
+        salida = StringIO()
+        call_command('liberar_reservas', stdout=salida)
+        self.assertFalse(ContenidoCarrito.objects.exists())
+        self.assertIn("1 carritos vencidos", salida.getvalue())
+
+
+# --- DATOS DE LA BARRA PEREZOSOS ---
+class ContextoEncabezadoTests(TestCase):
+
+    def setUp(self):
+        self.joya = Producto.objects.create(nombre="Colgante", precio=400, stock=5)
+        self.usuario = User.objects.create_user(username='barra', password='123')
+
+    def _request(self):
+        from django.contrib.sessions.backends.db import SessionStore
+        from django.test import RequestFactory
+
+        request = RequestFactory().get('/')
+        request.session = SessionStore()
+        request.user = self.usuario
+        return request
+
+    def test_no_consulta_si_el_template_no_lo_usa(self):
+        from django.template import RequestContext
+
+        request = self._request()
+        with CaptureQueriesContext(connection) as consultas:
+            Template("hola").render(RequestContext(request))
+        self.assertEqual(len(consultas), 0)
+
+    def test_se_calcula_una_vez_por_request(self):
+        from django.template import RequestContext
+
+        request = self._request()
+        plantilla = Template("{{ encabezado.favoritos_cantidad }}-{{ encabezado.carrito_total }}")
+        with CaptureQueriesContext(connection) as consultas:
+            self.assertEqual(plantilla.render(RequestContext(request)), "0-0.00")
+            plantilla.render(RequestContext(request))
+        self.assertEqual(len(consultas), 1)
+
+    def test_barra_muestra_carrito_y_favoritos(self):
+        from tienda.models import Favorito
+
+        self.client.get(reverse('agregar_carrito', args=[self.joya.id]))
+        self.assertContains(self.client.get(reverse('catalogo')), reverse('ver_carrito'))
+        self.assertEqual(self.client.get(reverse('catalogo')).context['encabezado'].carrito_lineas, 1)
+
+        Favorito.objects.create(usuario=self.usuario, producto=self.joya)
+        self.client.login(username='barra', password='123')
+        respuesta = self.client.get(reverse('catalogo'))
+        self.assertEqual(respuesta.context['encabezado'].favoritos_cantidad, 1)
+        self.assertEqual(respuesta.context['encabezado'].avatar_url, '')
+
+
+# --- COMPRESIÓN DE IMÁGENES FUERA DE LA REQUEST ---
+def foto_de_prueba(ancho=1600, alto=1200, nombre="foto.png", orientacion=None):
+    from io import BytesIO
+    from PIL import Image
+    from django.core.files.uploadedfile import SimpleUploadedFile
+
+    buffer = BytesIO()
+    img = Image.new('RGB', (ancho, alto), (200, 160, 40))
+    if nombre.endswith('.jpg'):
+        exif = Image.Exif()
+        if orientacion:
+            exif[0x0112] = orientacion
+        img.save(buffer, format='JPEG', exif=exif)
+        return SimpleUploadedFile(nombre, buffer.getvalue(), content_type='image/jpeg')
+    img.save(buffer, format='PNG')
+    return SimpleUploadedFile(nombre, buffer.getvalue(), content_type='image/png')
+
+
+class MediaTemporalMixin:
+    """
+    Cada test escribe sus archivos en un MEDIA_ROOT temporal.
+    """
+
+    def setUp(self):
+        import tempfile
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        ajustes = override_settings(MEDIA_ROOT=self.media.name)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+
+class ImagenesTests(MediaTemporalMixin, TestCase):
+
+    @override_settings(TIENDA_IMAGENES_MODO='cola')
+    def test_guarda_el_original_y_la_cola_lo_reemplaza(self):
+        from PIL import Image
+
+        joya = Producto.objects.create(nombre="Aro Foto", precio=100, stock=1, imagen=foto_de_prueba())
+        self.assertTrue(joya.imagen.name.endswith('.png'))
+        trabajo = TrabajoImagen.objects.get()
+        self.assertEqual((trabajo.estado, trabajo.archivo), ('PENDIENTE', joya.imagen.name))
+        original = joya.imagen.path
+
+        self.assertEqual(procesar_pendientes(), (1, 0))
+        joya.refresh_from_db()
+        self.assertTrue(joya.imagen.name.endswith('.jpg'))
+        self.assertEqual(Image.open(joya.imagen.path).size, (800, 600))
+        self.assertFalse(os.path.exists(original))
+        self.assertEqual(TrabajoImagen.objects.get().estado, 'LISTO')
+
+        # Las derivadas salen del original, así que llegan hasta 1600 px
+        manifiesto = joya.imagen_derivadas
+        self.assertEqual(manifiesto['origen'], joya.imagen.name)
+        self.assertEqual([v['ancho'] for v in manifiesto['formatos']['webp']], [200, 400, 800, 1600])
+        self.assertEqual(Image.open(joya.imagen.storage.path(manifiesto['formatos']['jpeg'][0]['nombre'])).size, (200, 150))
+
+    @override_settings(TIENDA_IMAGENES_MODO='cola')
+    def test_recupera_los_trabajos_de_un_worker_que_murio(self):
+        joya = Producto.objects.create(nombre="Aro Foto", precio=100, stock=1, imagen=foto_de_prueba())
+        # El worker lo tomó y se cortó antes de terminar
+        TrabajoImagen.objects.update(estado='PROCESANDO', intentos=1, tomado_en=timezone.now())
+        self.assertEqual(procesar_pendientes(), (0, 0))
+
+        TrabajoImagen.objects.update(tomado_en=timezone.now() - timedelta(minutes=11))
+        self.assertEqual(procesar_pendientes(), (1, 0))
+        joya.refresh_from_db()
+        self.assertTrue(joya.imagen.name.endswith('.jpg'))
+
+        # Si se cortó en todos los intentos, queda en ERROR
+        Producto.objects.create(nombre="Aro Otra", precio=100, stock=1, imagen=foto_de_prueba(ancho=1000, alto=800))
+        TrabajoImagen.objects.filter(estado='PENDIENTE').update(
+            estado='PROCESANDO', intentos=3, tomado_en=timezone.now() - timedelta(hours=1)
+        )
+        call_command('procesar_imagenes', stdout=StringIO())
+        self.assertEqual(sorted(TrabajoImagen.objects.values_list('estado', flat=True)), ['ERROR', 'LISTO'])
+
+    def test_en_modo_hilo_se_barren_los_pendientes(self):
+        from unittest import mock
+        from tienda import imagenes
+
+        # Un reintento que quedó PENDIENTE: en modo 'hilo' nadie corre procesar_imagenes
+        with self.settings(TIENDA_IMAGENES_MODO='cola'):
+            vieja = Producto.objects.create(nombre="Aro Viejo", precio=100, stock=1, imagen=foto_de_prueba())
+
+        ejecutor = mock.Mock()
+        ejecutor.submit.side_effect = lambda funcion, *args: funcion(*args)
+        with mock.patch.object(imagenes, '_obtener_ejecutor', return_value=ejecutor), \
+                mock.patch.object(imagenes, 'connection'), \
+                mock.patch.object(imagenes, '_programar_barrido') as programar, \
+                mock.patch.object(imagenes, '_ultimo_barrido', None):
+            with self.captureOnCommitCallbacks(execute=True):
+                nueva = Producto.objects.create(nombre="Aro Nuevo", precio=100, stock=1, imagen=foto_de_prueba())
+            # Recién barrido: la próxima subida no vuelve a barrer
+            self.assertFalse(imagenes.barrer_pendientes())
+
+        self.assertEqual(set(TrabajoImagen.objects.values_list('estado', flat=True)), {'LISTO'})
+        for joya in (vieja, nueva):
+            joya.refresh_from_db()
+            self.assertTrue(joya.imagen.name.endswith('.jpg'))
+        programar.assert_not_called()
+
+    @override_settings(TIENDA_IMAGENES_MODO='cola')
+    def test_no_pisa_una_foto_mas_nueva(self):
+        joya = Producto.objects.create(nombre="Aro Foto", precio=100, stock=1, imagen=foto_de_prueba())
+        Producto.objects.filter(pk=joya.pk).update(imagen='joyas/otra.jpg')
+        procesar_pendientes()
+        joya.refresh_from_db()
+        self.assertEqual(joya.imagen.name, 'joyas/otra.jpg')
+
+    @override_settings(TIENDA_IMAGENES_MODO='sincronico')
+    def test_modo_sincronico_y_srcset(self):
+        joya = Producto.objects.create(nombre="Aro Foto", precio=100, stock=1, imagen=foto_de_prueba(ancho=500, alto=500))
+        self.assertTrue(joya.imagen.name.endswith('.png'))  # ya era chica: no se recomprime
+        self.assertEqual(TrabajoImagen.objects.get().estado, 'LISTO')
+
+        # Sin agrandar: 200, 400 y el ancho original
+        html = Template("{% load imagenes_responsivas %}{% imagen_responsiva joya sizes='50vw' alt='x' %}").render(
+            Context({'joya': joya})
+        )
+        self.assertIn('type="image/webp"', html)
+        self.assertIn('-500.jpg 500w', html)
+        self.assertNotIn('800w', html)
+        # Marcador borroso de fondo y el tamaño real para reservar el lugar
+        self.assertIn('background: url(data:image/webp;base64,', html)
+        self.assertIn('width="400" height="400"', html)
+
+    @override_settings(TIENDA_IMAGENES_MODO='sincronico')
+    def test_completar_marcadores(self):
+        joya = Producto.objects.create(nombre="Aro Foto", precio=100, stock=1, imagen=foto_de_prueba(ancho=300, alto=200))
+        manifiesto = dict(joya.imagen_derivadas)
+        marcador = manifiesto.pop('lqip')
+        self.assertLess(len(marcador), 1000)
+        Producto.objects.filter(pk=joya.pk).update(imagen_derivadas=manifiesto)
+
+        call_command('generar_derivadas', stdout=StringIO())
+        joya.refresh_from_db()
+        self.assertEqual(joya.imagen_derivadas['lqip'], marcador)
+        self.assertEqual((joya.imagen_derivadas['ancho'], joya.imagen_derivadas['alto']), (300, 200))
+
+    def test_derivadas_deterministas(self):
+        from tienda.imagenes import generar_derivadas
+
+        with self.settings(TIENDA_IMAGENES_MODO='cola'):
+            joya = Producto.objects.create(nombre="Aro Foto", precio=100, stock=1, imagen=foto_de_prueba())
+        primera = generar_derivadas(joya.imagen)
+        self.assertEqual(generar_derivadas(joya.imagen), primera)
+
+    @override_settings(TIENDA_IMAGENES_MODO='cola', TIENDA_IMAGENES_MAX_PIXELES=5_000_000)
+    def test_foto_grande_del_celular(self):
+        from PIL import Image
+        from tienda.utils import comprimir_imagen
+
+        # 4800x3600 guardada "acostada" con orientación EXIF 6: se ve de 3600x4800.
+        # Son 17 MP, pero el JPEG se decodifica a 1/2 (o menos) y entra en el tope de 5 MP.
+        foto = foto_de_prueba(ancho=4800, alto=3600, nombre="celular.jpg", orientacion=6)
+        optimizada = comprimir_imagen(foto, nuevo_ancho=300)
+        self.assertEqual(optimizada.size, len(optimizada.read()))
+        optimizada.seek(0)
+        self.assertEqual(Image.open(optimizada).size, (300, 400))
+
+        joya = Producto.objects.create(nombre="Aro Foto", precio=100, stock=1, imagen=foto)
+        self.assertEqual(procesar_pendientes(), (1, 0))
+        joya.refresh_from_db()
+        self.assertEqual(Image.open(joya.imagen.path).size, (800, 1067))
+        self.assertEqual((joya.imagen_derivadas['ancho'], joya.imagen_derivadas['alto']), (3600, 4800))
+
+    @override_settings(TIENDA_IMAGENES_MODO='cola', TIENDA_IMAGENES_MAX_PIXELES=5_000_000)
+    def test_foto_que_no_entra_en_memoria(self):
+        from django.core.exceptions import ValidationError
+        from tienda.utils import validar_tamano_imagen
+
+        # Un PNG no se puede decodificar reducido: 2500x2500 supera el tope
+        foto = foto_de_prueba(ancho=2500, alto=2500)
+        with self.assertRaises(ValidationError):
+            validar_tamano_imagen(foto)
+        self.assertEqual(foto.tell(), 0)
+        validar_tamano_imagen(foto_de_prueba(ancho=4800, alto=3600, nombre="celular.jpg"))
+
+        # Si igual llega (por ejemplo, cargada por código), el trabajo falla una vez y no se reintenta
+        Producto.objects.create(nombre="Aro Foto", precio=100, stock=1, imagen=foto)
+        self.assertEqual(procesar_pendientes(), (0, 1))
+        self.assertEqual(TrabajoImagen.objects.get().estado, 'ERROR')
+
+
+# --- ALMACENAMIENTO POR CONTENIDO ---
+@override_settings(TIENDA_IMAGENES_MODO='cola')
+class AlmacenamientoPorContenidoTests(MediaTemporalMixin, TestCase):
+
+    def test_fotos_iguales_comparten_archivo(self):
+        a = Producto.objects.create(nombre="Aro A", precio=100, stock=1, imagen=foto_de_prueba(nombre="IMG_1.png"))
+        b = Producto.objects.create(nombre="Aro B", precio=100, stock=1, imagen=foto_de_prueba(nombre="copia (2).png"))
+        self.assertEqual(a.imagen.name, b.imagen.name)
+        self.assertTrue(es_nombre_por_contenido(a.imagen.name))
+
+        # Al comprimir A, el original no se borra porque B (y su trabajo) todavía lo usan
+        from tienda.imagenes import procesar_trabajo
+        procesar_trabajo(TrabajoImagen.objects.get(objeto_id=a.pk).pk)
+        self.assertTrue(os.path.exists(b.imagen.path))
+
+        procesar_pendientes()
+        a.refresh_from_db(); b.refresh_from_db()
+        self.assertEqual(a.imagen.name, b.imagen.name)
+        self.assertFalse(os.path.exists(os.path.join(self.media.name, 'joyas', 'IMG_1.png')))
+
+    def test_volver_a_subir_un_huerfano_lo_salva_del_recolector(self):
+        from tienda.storage import almacenamiento_media, liberar_archivo
+
+        nombre = almacenamiento_media.save('joyas/aro.jpg', ContentFile(b'x' * 10))
+        hace_dos_horas = time.time() - 7200
+        os.utime(almacenamiento_media.path(nombre), (hace_dos_horas, hace_dos_horas))
+        # Un trabajo que tomó el archivo hace un rato (la hora de los archivos no tiene la precisión del reloj)
+        tomado = timezone.now() - timedelta(seconds=5)
+
+        # Alguien sube el mismo contenido: la fila todavía no está confirmada, pero el archivo ya no es viejo
+        self.assertEqual(almacenamiento_media.save('joyas/otro.jpg', ContentFile(b'x' * 10)), nombre)
+        self.assertEqual(recolectar_huerfanos(antiguedad_minima=3600), (0, 0))
+        self.assertFalse(liberar_archivo(almacenamiento_media, nombre, tocado_antes_de=tomado))
+        self.assertTrue(almacenamiento_media.exists(nombre))
+        self.assertTrue(liberar_archivo(almacenamiento_media, nombre))
+
+    def test_recolector_borra_solo_huerfanos(self):
+        joya = Producto.objects.create(nombre="Aro A", precio=100, stock=1, imagen=foto_de_prueba())
+        procesar_pendientes()
+        huerfano = default_storage.save('joyas/viejo.jpg', ContentFile(b'x' * 10))
+
+        self.assertEqual(recolectar_huerfanos(antiguedad_minima=0, simular=True), (1, 10))
+        self.assertTrue(default_storage.exists(huerfano))
+        self.assertEqual(recolectar_huerfanos(antiguedad_minima=0)[0], 1)
+        self.assertFalse(default_storage.exists(huerfano))
+
+        joya.refresh_from_db()
+        self.assertTrue(default_storage.exists(joya.imagen.name))
+        for version in joya.imagen_derivadas['formatos']['webp']:
+            self.assertTrue(default_storage.exists(version['nombre']))
+
+    def test_migrar_archivos_existentes(self):
+        nombre = default_storage.save('joyas/WhatsApp_Image_abc.png', foto_de_prueba(ancho=300, alto=300))
+        copia = default_storage.save('joyas/WhatsApp_Image_abc_4hAR8S0.png', foto_de_prueba(ancho=300, alto=300))
+        Producto.objects.bulk_create([
+            Producto(nombre="Viejo 1", precio=1, stock=1, imagen=nombre),
+            Producto(nombre="Viejo 2", precio=1, stock=1, imagen=copia),
+        ])
+        call_command('migrar_media_por_contenido', stdout=StringIO())
+
+        nombres = set(Producto.objects.values_list('imagen', flat=True))
+        self.assertEqual(len(nombres), 1)
+        self.assertTrue(es_nombre_por_contenido(nombres.pop()))
+        self.assertFalse(default_storage.exists(nombre) or default_storage.exists(copia))
+
+
+# --- RASTREO DE CAMBIOS (save sin SELECT previo) ---
+@override_settings(TIENDA_IMAGENES_MODO='cola')
+class RastreoCambiosTests(MediaTemporalMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cat = Categoria.objects.create(nombre="Anillos", slug="anillos")
+        self.joya = Producto.objects.create(nombre="Anillo", precio=100, stock=5, categoria=self.cat)
+
+    def test_save_escribe_solo_lo_que_cambio(self):
+        joya = Producto.objects.get(pk=self.joya.pk)
+        self.assertEqual(joya.campos_cambiados(), set())
+        joya.stock = 4
+        with CaptureQueriesContext(connection) as consultas:
+            joya.save()
+        sql = [q['sql'] for q in consultas.captured_queries]
+        self.assertFalse([s for s in sql if s.startswith('SELECT')])
+        actualizacion = next(s for s in sql if s.startswith('UPDATE "tienda_producto"'))
+        self.assertIn('"stock"', actualizacion)
+        self.assertNotIn('"precio"', actualizacion)
+        self.assertEqual(joya.campos_cambiados(), set())
+
+    def test_save_sin_cambios_es_un_save_normal(self):
+        from unittest import mock
+        from django.db.models.signals import post_save
+
+        joya = Producto.objects.get(pk=self.joya.pk)
+        receptor = mock.Mock()
+        post_save.connect(receptor, sender=Producto)
+        self.addCleanup(post_save.disconnect, receptor, sender=Producto)
+        joya.save()
+        receptor.assert_called_once()
+
+        # Una instancia vieja sin cambios no pisa los contadores ni la foto que se actualizaron por afuera
+        usuario = User.objects.create_user(username='opinador', password='123')
+        Review.objects.create(producto=self.joya, usuario=usuario, comentario="Linda", calificacion=5)
+        Producto.objects.filter(pk=joya.pk).update(imagen='joyas/comprimida.jpg')
+        joya.save()
+        fila = Producto.objects.get(pk=joya.pk)
+        self.assertEqual((fila.calificaciones_cantidad, fila.estrellas_5, fila.imagen.name), (1, 1, 'joyas/comprimida.jpg'))
+
+        # Si la fila ya no existe se vuelve a insertar, como con cualquier save()
+        joya.stock = 1
+        Producto.objects.filter(pk=joya.pk).delete()
+        joya.save()
+        self.assertEqual(Producto.objects.get(pk=joya.pk).stock, 1)
+
+    def test_imagen_nueva_se_encola_una_sola_vez(self):
+        joya = Producto.objects.get(pk=self.joya.pk)
+        joya.imagen = foto_de_prueba()
+        joya.save()
+        self.assertEqual(TrabajoImagen.objects.count(), 1)
+
+        joya.precio = 120
+        joya.save()
+        self.assertEqual(TrabajoImagen.objects.count(), 1)
+
+    def test_cambio_de_categoria_recalcula_las_dos(self):
+        otra = Categoria.objects.create(nombre="Aros", slug="aros")
+        with self.captureOnCommitCallbacks(execute=True):
+            vecino = Producto.objects.create(nombre="Anillo 2", precio=110, stock=5, categoria=self.cat)
+        self.assertTrue(ProductoRelacionado.objects.filter(producto=vecino, relacionado=self.joya).exists())
+
+        joya = Producto.objects.get(pk=self.joya.pk)
+        joya.categoria = otra
+        with self.captureOnCommitCallbacks(execute=True):
+            joya.save()
+        self.assertFalse(ProductoRelacionado.objects.filter(producto=vecino).exists())
+
+    def test_editar_resena_mueve_los_contadores(self):
+        usuario = User.objects.create_user(username="ana", password="x")
+        Review.objects.create(producto=self.joya, usuario=usuario, comentario="ok", calificacion=5)
+        resena = Review.objects.get()
+        resena.calificacion = 2
+        resena.save()
+        self.joya.refresh_from_db()
+        self.assertEqual((self.joya.calificaciones_cantidad, self.joya.estrellas_5, self.joya.estrellas_2), (1, 0, 1))
+
+    def test_login_no_toca_el_perfil(self):
+        usuario = User.objects.create_user(username="ana", password="x")
+        usuario = User.objects.get(pk=usuario.pk)
+        # Solo el UPDATE de last_login: ni SELECT ni UPDATE del perfil
+        with self.assertNumQueries(1):
+            usuario.save(update_fields=['last_login'])
+
+        usuario.perfil.telefono = "123"
+        usuario.save()
+        self.assertEqual(User.objects.get(pk=usuario.pk).perfil.telefono, "123")
+
+
+# --- IMPORTACIÓN MASIVA ---
+@override_settings(TIENDA_IMAGENES_MODO='cola')
+class ImportacionTests(MediaTemporalMixin, TestCase):
+
+    def _planilla(self, contenido, nombre='productos.csv'):
+        ruta = os.path.join(self.media.name, nombre)
+        with open(ruta, 'w', encoding='utf-8') as archivo:
+            archivo.write(contenido)
+        return ruta
+
+    def test_importa_y_se_puede_relanzar(self):
+        from tienda.importacion import importar
+
+        with open(os.path.join(self.media.name, 'aro.png'), 'wb') as archivo:
+            archivo.write(foto_de_prueba().read())
+        ruta = self._planilla(
+            "codigo,nombre,precio,stock,categoria,descripcion,precio_oferta,imagen,variantes\n"
+            "A1,Aro Luna,1500,,Aros de Plata,Aro chico,,aro.png,Talle S:2|Talle M:3\n"
+            "A2,Anillo Sol,\"2500,50\",4,Anillos,,2000,,\n"
+            "A3,Sin precio,abc,1,,,,,\n"
+        )
+        resultado = importar(ruta, procesos=1, lote=2)
+        self.assertEqual((resultado.creados, resultado.imagenes, resultado.variantes), (2, 1, 2))
+        self.assertEqual([numero for numero, _ in resultado.errores], [4])
+
+        aro = Producto.objects.get(codigo='A1')
+        self.assertEqual((aro.stock, aro.categoria.slug), (5, 'aros-de-plata'))
+        self.assertTrue(es_nombre_por_contenido(aro.imagen.name))
+        self.assertEqual(aro.imagen_derivadas['origen'], aro.imagen.name)
+        self.assertFalse(TrabajoImagen.objects.exists())
+        anillo = Producto.objects.get(codigo='A2')
+        self.assertEqual((anillo.precio, anillo.precio_actual), (Decimal('2500.50'), Decimal('2000')))
+        self.assertIn(aro, Producto.objects.buscar('luna'))
+
+        # Relanzada con otro stock: actualiza, no duplica ni vuelve a procesar la foto
+        ruta = self._planilla("codigo,nombre,precio,imagen,variantes\nA1,Aro Luna,1600,aro.png,Talle S:7\n")
+        resultado = importar(ruta, procesos=1)
+        self.assertEqual((resultado.creados, resultado.actualizados, resultado.imagenes), (0, 1, 0))
+        self.assertEqual(Producto.objects.count(), 2)
+        self.assertEqual(dict(aro.variantes.values_list('nombre', 'stock')), {'Talle S': 7, 'Talle M': 3})
+        self.assertEqual(Producto.objects.get(codigo='A1').imagen.name, aro.imagen.name)
+
+
+    def test_indexa_el_lote_de_una_vez(self):
+        from tienda.importacion import importar
+
+        filas = ''.join(f"P{i},Pulsera {i},{100 + i}\n" for i in range(30))
+        with CaptureQueriesContext(connection) as consultas:
+            importar(self._planilla("codigo,nombre,precio\n" + filas), procesos=1)
+        indice = [c['sql'] for c in consultas.captured_queries if 'tienda_producto_fts' in c['sql']]
+        self.assertEqual(len(indice), 2, indice)  # un DELETE y un INSERT para las 30
+
+        # Relanzada con otro nombre: el documento se reemplaza
+        importar(self._planilla("codigo,nombre,precio\nP3,Collar Nuevo,103\n"), procesos=1)
+        self.assertEqual(list(Producto.objects.buscar('collar').values_list('codigo', flat=True)), ['P3'])
+        self.assertFalse(Producto.objects.buscar('pulsera').filter(codigo='P3').exists())
+
+    def test_la_foto_del_producto_es_la_derivada_de_800(self):
+        from unittest import mock
+        from PIL import Image
+        from tienda.importacion import importar
+
+        with open(os.path.join(self.media.name, 'aro.png'), 'wb') as archivo:
+            archivo.write(foto_de_prueba().read())
+        ruta = self._planilla("codigo,nombre,precio,imagen\nA1,Aro Luna,1500,aro.png\n")
+        # El original se decodifica una sola vez (en generar_derivadas)
+        with mock.patch('tienda.utils.comprimir_imagen') as comprimir:
+            importar(ruta, procesos=1)
+        comprimir.assert_not_called()
+
+        aro = Producto.objects.get(codigo='A1')
+        derivada = next(v for v in aro.imagen_derivadas['formatos']['jpeg'] if v['ancho'] == 800)
+        with aro.imagen.open('rb') as imagen, default_storage.open(derivada['nombre'], 'rb') as archivo:
+            self.assertEqual(imagen.read(), archivo.read())
+        with Image.open(aro.imagen.path) as img:
+            self.assertEqual((img.format, img.width), ('JPEG', 800))
+
+    def test_si_falla_el_lote_no_quedan_fotos_huerfanas(self):
+        from unittest import mock
+        from tienda.importacion import importar
+
+        with open(os.path.join(self.media.name, 'aro.png'), 'wb') as archivo:
+            archivo.write(foto_de_prueba().read())
+        ruta = self._planilla("codigo,nombre,precio,imagen\nA1,Aro Luna,1500,aro.png\n")
+        with mock.patch('tienda.busqueda.obtener_motor', side_effect=RuntimeError("sin índice")):
+            with self.assertRaises(RuntimeError):
+                importar(ruta, procesos=1)
+
+        self.assertFalse(Producto.objects.exists())
+        for carpeta in ('joyas', 'derivadas'):
+            restantes = [archivos for _, _, archivos in os.walk(os.path.join(self.media.name, carpeta)) if archivos]
+            self.assertEqual(restantes, [], carpeta)
+
+
+# --- MEDIA EN PRODUCCIÓN ---
+class ServirMediaTests(MediaTemporalMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        from tienda.storage import almacenamiento_media
+        self.nombre = almacenamiento_media.save('joyas/aro.jpg', ContentFile(b'0123456789'))
+        self.url = f"/media/{self.nombre}"
+
+    def test_etag_y_304(self):
+        respuesta = self.client.get(self.url)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(b''.join(respuesta.streaming_content), b'0123456789')
+        self.assertIn('immutable', respuesta['Cache-Control'])
+        self.assertEqual(respuesta['Content-Type'], 'image/jpeg')
+
+        repetida = self.client.get(self.url, HTTP_IF_NONE_MATCH=respuesta['ETag'])
+        self.assertEqual(repetida.status_code, 304)
+        self.assertEqual(repetida['ETag'], respuesta['ETag'])
+        self.assertEqual(
+            self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=respuesta['Last-Modified']).status_code, 304
+        )
+
+        # Un nombre viejo (no por contenido) se cachea poco
+        default_storage.save('joyas/viejo.jpg', ContentFile(b'x'))
+        self.assertEqual(self.client.get('/media/joyas/viejo.jpg')['Cache-Control'], 'public, max-age=3600')
+
+    def test_rangos(self):
+        from django.utils.http import http_date, parse_http_date
+
+        parcial = self.client.get(self.url, HTTP_RANGE='bytes=2-5')
+        self.assertEqual(parcial.status_code, 206)
+        self.assertEqual(b''.join(parcial.streaming_content), b'2345')
+        self.assertEqual(parcial['Content-Range'], 'bytes 2-5/10')
+
+        final = self.client.get(self.url, HTTP_RANGE='bytes=-3')
+        self.assertEqual(b''.join(final.streaming_content), b'789')
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=20-').status_code, 416)
+        # If-Range con otra versión: va el archivo entero
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE='"otro"').status_code, 200)
+        # Con fecha, solo si es exactamente la de Last-Modified (una posterior no alcanza)
+        ultima = parcial['Last-Modified']
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE=ultima).status_code, 206)
+        posterior = http_date(parse_http_date(ultima) + 60)
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE=posterior).status_code, 200)
+
+    def test_fuera_de_media_y_proxy(self):
+        self.assertEqual(self.client.get('/media/../manage.py').status_code, 404)
+        self.assertEqual(self.client.get('/media/joyas/no-existe.jpg').status_code, 404)
+
+        with self.settings(TIENDA_MEDIA_MODO='x-accel'):
+            respuesta = self.client.get(self.url)
+        self.assertEqual(respuesta['X-Accel-Redirect'], f"/media-interna/{self.nombre}")
+        self.assertEqual(respuesta.content, b'')
+
+        # Los nombres viejos pueden tener espacios o acentos: van codificados
+        default_storage.save('joyas/aro dorado ñ.jpg', ContentFile(b'x'))
+        with self.settings(TIENDA_MEDIA_MODO='x-accel'):
+            respuesta = self.client.get('/media/joyas/aro%20dorado%20%C3%B1.jpg')
+        self.assertEqual(respuesta['X-Accel-Redirect'], '/media-interna/joyas/aro%20dorado%20%C3%B1.jpg')
+
+
+# --- CACHE COMPARTIDA SIN ESTAMPIDAS ---
+class ObtenerOCalcularTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.llamadas = 0
+
+    def calcular(self):
+        self.llamadas += 1
+        return self.llamadas
+
+    def test_calcula_una_vez(self):
+        from tienda.cache import obtener_o_calcular
+
+        self.assertEqual(obtener_o_calcular('prueba', self.calcular, 60), 1)
+        self.assertEqual(obtener_o_calcular('prueba', self.calcular, 60), 1)
+        self.assertEqual(self.llamadas, 1)
+
+    def test_vencida_con_otro_calculando_devuelve_la_anterior(self):
+        from tienda.cache import obtener_o_calcular
+
+        cache.set('prueba', ('viejo', time.time() - 1, 0.5), 60)
+        lock = tomar_lock('prueba')
+        self.assertEqual(obtener_o_calcular('prueba', self.calcular, 60), 'viejo')
+        self.assertEqual(self.llamadas, 0)
+
+        # Sin nadie calculando, la recalcula este proceso
+        soltar_lock(lock)
+        self.assertEqual(obtener_o_calcular('prueba', self.calcular, 60), 1)
+
+    def test_sin_valor_espera_al_que_calcula(self):
+        from unittest import mock
+        from tienda.cache import obtener_o_calcular
+
+        self.addCleanup(soltar_lock, tomar_lock('prueba'))
+        threading.Timer(0.1, lambda: cache.set('prueba', ('del otro', time.time() + 60, 0), 60)).start()
+        self.assertEqual(obtener_o_calcular('prueba', self.calcular, 60), 'del otro')
+
+        # Si el otro nunca termina, se deja de esperar y se calcula
+        self.addCleanup(soltar_lock, tomar_lock('otra'))
+        with mock.patch('tienda.cache.ESPERA_MAXIMA', 0.1):
+            self.assertEqual(obtener_o_calcular('otra', self.calcular, 60), 1)
+
+    def test_el_lock_lo_toma_uno_solo(self):
+        tomados = []
+        barrera = threading.Barrier(8)
+
+        def tomar():
+            barrera.wait()
+            tomados.append(tomar_lock('carrera'))
+
+        hilos = [threading.Thread(target=tomar) for _ in range(8)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        ganadores = [ruta for ruta in tomados if ruta]
+        self.assertEqual(len(ganadores), 1)
+        soltar_lock(ganadores[0])
+        otra_vez = tomar_lock('carrera')
+        self.assertIsNotNone(otra_vez)
+        soltar_lock(otra_vez)
+
+    def test_lock_de_un_proceso_muerto_se_recupera(self):
+        ruta = tomar_lock('abandonado')
+        self.addCleanup(soltar_lock, ruta)
+        self.assertIsNone(tomar_lock('abandonado'))
+        hace_rato = time.time() - 120
+        os.utime(ruta, (hace_rato, hace_rato))
+        self.assertEqual(tomar_lock('abandonado', tiempo=60), ruta)
+
+    def test_invalidar_avanza_la_generacion_en_la_base(self):
+        from tienda.cache import CLAVE_GENERACION
+        from tienda.models import Generacion
+
+        inicial = generacion_catalogo()
+        invalidar_catalogo()
+        invalidar_catalogo()
+        self.assertEqual(generacion_catalogo(), inicial + 2)
+        self.assertEqual(Generacion.objects.get(nombre=CLAVE_GENERACION).valor, inicial + 2)
+
+        # Si la cache pierde la copia, se vuelve a leer la de la base (no arranca de cero)
+        cache.clear()
+        self.assertEqual(generacion_catalogo(), inicial + 2)
+
+    def test_dashboard_usa_la_cache(self):
+        User.objects.create_user(username="admin", password="x", is_staff=True)
+        self.client.login(username="admin", password="x")
+        self.client.get(reverse('dashboard_admin'))
+        self.assertIsNotNone(cache.get('dashboard_stats'))
+
+
+# --- VISTAS ASYNC (ASGI) ---
+@override_settings(ROOT_URLCONF='tormenta.urls_asgi')
+class VistasAsyncTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.joya = Producto.objects.create(nombre="Collar Perlas", precio=900, stock=3)
+        User.objects.create_user(username='async', password='123')
+
+    def test_rutas_de_solo_lectura_son_async(self):
+        import asyncio
+        from django.urls import resolve
+
+        for url in ('/', f'/producto/{self.joya.id}/', '/busqueda-ajax/', '/sitemap.xml'):
+            self.assertTrue(asyncio.iscoroutinefunction(resolve(url).func), url)
+        self.assertFalse(asyncio.iscoroutinefunction(resolve(reverse('ver_carrito')).func))
+
+    async def test_catalogo_y_detalle(self):
+        respuesta = await self.async_client.get('/')
+        self.assertContains(respuesta, "Collar Perlas")
+
+        respuesta = await self.async_client.get(f'/producto/{self.joya.id}/')
+        self.assertContains(respuesta, "Collar Perlas")
+        self.assertEqual((await self.async_client.get('/producto/999999/')).status_code, 404)
+
+    async def test_catalogo_con_busqueda(self):
+        # El motor de texto completo consulta con un cursor: no puede correr en el event loop
+        await Producto.objects.acreate(nombre="Anillo Dorado", precio=500, stock=1)
+        respuesta = await self.async_client.get('/', {'q': 'collar'})
+        self.assertContains(respuesta, "Collar Perlas")
+        self.assertNotContains(respuesta, "Anillo Dorado")
+
+    async def test_consulta_con_el_orm_async_solo_lo_que_no_esta_en_cache(self):
+        from unittest import mock
+        from tienda.paginacion import PaginaCursor
+
+        with mock.patch.object(PaginaCursor, 'acargar', autospec=True, side_effect=PaginaCursor.acargar) as acargar:
+            self.assertContains(await self.async_client.get('/'), "Collar Perlas")
+            acargar.assert_called_once()
+            # Segunda visita: la grilla sale del fragmento guardado, la página ni se consulta
+            self.assertContains(await self.async_client.get('/'), "Collar Perlas")
+            acargar.assert_called_once()
+
+        with mock.patch('tienda.vistas_async.arelacionados_de', return_value=[]) as relacionados:
+            await self.async_client.get(f'/producto/{self.joya.id}/')
+            await self.async_client.get(f'/producto/{self.joya.id}/')
+        relacionados.assert_called_once()
+
+    async def test_detalle_publica_la_resena_con_la_vista_sync(self):
+        await self.async_client.alogin(username='async', password='123')
+        respuesta = await self.async_client.post(f'/producto/{self.joya.id}/', {'calificacion': 5, 'comentario': 'Hermoso'})
+        self.assertEqual(respuesta.status_code, 302)
+        self.assertEqual(await Review.objects.filter(producto=self.joya).acount(), 1)
+
+    async def test_buscador_sin_indice_usa_el_orm_async(self):
+        from tienda.autocompletado import IndiceAutocompletado
+
+        indice = IndiceAutocompletado()
+        indice._reconstruyendo = True  # que no arranque el hilo de reconstrucción
+        self.assertEqual([t[1] for t in await indice.abuscar("colla")], ["Collar Perlas"])
+
+        # Con el índice armado responde desde memoria
+        from asgiref.sync import sync_to_async
+        await sync_to_async(indice_autocompletado.construir)()
+        respuesta = await self.async_client.get('/busqueda-ajax/', {'q': 'colla'})
+        self.assertEqual([r['nombre'] for r in respuesta.json()['resultados']], ["Collar Perlas"])
+
+    async def test_sitemap(self):
+        respuesta = await self.async_client.get('/sitemap.xml')
+        self.assertContains(respuesta, f'/producto/{self.joya.id}/')
+
+    @override_settings(TIENDA_PRESUPUESTO_ACTIVO=True, TIENDA_CONSULTAS_ENCABEZADO=True)
+    async def test_las_consultas_se_cuentan_tambien_en_async(self):
+        respuesta = await self.async_client.get(f'/producto/{self.joya.id}/')
+        self.assertGreater(int(respuesta['X-Consultas']), 0)
+
+
+# --- PRESUPUESTO DE CONSULTAS POR PÁGINA ---
+@override_settings(TIENDA_PRESUPUESTO_ACTIVO=True, TIENDA_PRESUPUESTO_ESTRICTO=True, TIENDA_CONSULTAS_ENCABEZADO=True)
+class PresupuestoConsultasTests(PresupuestoConsultasMixin, TestCase):
+    """
+    Con el modo estricto, una página que se pasa de su presupuesto o repite consultas lanza
+    PresupuestoExcedido: los datos tienen varias filas para que un N+1 se note.
+    """
+
+    def setUp(self):
+        self.usuario = User.objects.create_user(username='presupuesto', password='123')
+        self.productos = [Producto.objects.create(nombre=f"Pulsera {i}", precio=100 + i, stock=9) for i in range(8)]
+        for producto in self.productos[:4]:
+            Variante.objects.create(producto=producto, nombre="Chica", stock=3)
+            Variante.objects.create(producto=producto, nombre="Grande", stock=3)
+        for _ in range(5):
+            orden = Orden.objects.create(usuario=self.usuario, total=300)
+            for producto in self.productos[:4]:
+                DetalleOrden.objects.create(orden=orden, producto=producto, cantidad=1, precio_unitario=100)
+        for producto in self.productos:
+            Favorito.objects.create(usuario=self.usuario, producto=producto)
+        self.client.login(username='presupuesto', password='123')
+        for producto in self.productos[4:]:
+            self.client.get(reverse('agregar_carrito', args=[producto.id]))
+
+    def test_huella_sin_valores(self):
+        self.assertEqual(
+            huella("SELECT * FROM t WHERE id IN (%s, %s, %s) AND nombre = 'a''b'  LIMIT 21"),
+            "SELECT * FROM t WHERE id IN (...) AND nombre = ? LIMIT ?",
+        )
+
+    def test_las_transacciones_no_cuentan_como_n_mas_1(self):
+        from tienda.consultas import RegistroConsultas
+
+        registro = RegistroConsultas()
+        for _ in range(3):
+            registro.anotar('BEGIN', 0)
+            registro.anotar('SAVEPOINT "s1_x1"', 0)
+            registro.anotar('COMMIT', 0)
+        self.assertEqual((registro.cantidad, registro.repetidas()), (9, []))
+
+    def test_paginas_dentro_del_presupuesto_y_sin_n_mas_1(self):
+        paginas = [
+            reverse('catalogo'), reverse('detalle', args=[self.productos[0].id]), reverse('ver_carrito'),
+            reverse('mis_compras'), reverse('mis_favoritos'), reverse('dashboard_admin'),
+        ]
+        for url in paginas:
+            respuesta = self.client.get(url)
+            self.assertEqual(respuesta['X-Consultas-Repetidas'], '0', url)
+            self.assertTrue(int(respuesta['X-Consultas']) > 0, url)
+
+    def test_las_tarjetas_marcan_favoritos_con_una_consulta(self):
+        # (el script de la página también nombra la clase: contamos la diferencia)
+        con_favoritos = self.client.get(reverse('catalogo')).content.count(b'ri-heart-fill')
+        Favorito.objects.all().delete()
+        sin_favoritos = self.client.get(reverse('catalogo')).content.count(b'ri-heart-fill')
+        self.assertEqual(con_favoritos - sin_favoritos, len(self.productos))
+
+    def test_pasarse_del_presupuesto_falla(self):
+        presupuestos = {'catalogo': 1}
+        with self.settings(TIENDA_PRESUPUESTO_CONSULTAS=presupuestos):
+            with self.assertRaisesMessage(PresupuestoExcedido, "presupuesto de 1 consultas"):
+                self.client.get(reverse('catalogo'))
+
+    def test_sin_activar_el_middleware_no_se_instala(self):
+        with self.settings(TIENDA_PRESUPUESTO_ACTIVO=False, TIENDA_PRESUPUESTO_CONSULTAS={'catalogo': 1}):
+            respuesta = Client().get(reverse('catalogo'))
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertNotIn('X-Consultas', respuesta)
+
+    def test_assert_presupuesto_detecta_n_mas_1(self):
+        with self.assertRaisesMessage(AssertionError, "N+1"):
+            with self.assertPresupuesto():
+                for producto in self.productos:
+                    Producto.objects.get(pk=producto.pk)
+        with self.assertPresupuesto(1) as registro:
+            list(Producto.objects.all())
+        self.assertEqual(registro.cantidad, 1)
+
+
+# --- BENCHMARK REPRODUCIBLE ---
+class MedicionTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        # El buscador responde desde el índice ya armado (sin el hilo de reconstrucción)
+        indice_autocompletado._reconstruyendo = True
+        self.addCleanup(setattr, indice_autocompletado, '_reconstruyendo', False)
+
+    def test_la_misma_semilla_siembra_el_mismo_catalogo(self):
+        from tienda.medicion import catalogo_sembrado, sembrar
+
+        cantidades = sembrar(30, semilla=3)
+        self.assertEqual(cantidades['productos'], 30)
+        self.assertEqual(cantidades['ordenes'], 3)
+        self.assertTrue(catalogo_sembrado(30, 3))
+        self.assertFalse(catalogo_sembrado(30, 4))
+        primera = list(Producto.objects.order_by('codigo').values_list('nombre', 'precio', 'stock'))
+
+        Orden.objects.all().delete()
+        Producto.objects.all().delete()
+        self.assertEqual(sembrar(30, semilla=3), cantidades)
+        self.assertEqual(list(Producto.objects.order_by('codigo').values_list('nombre', 'precio', 'stock')), primera)
+
+    def test_recorre_todos_los_escenarios_sin_errores(self):
+        from tienda.medicion import Medicion, sembrar
+
+        sembrar(30, semilla=1)
+        indice_autocompletado.construir()
+        resultados = Medicion(repeticiones=2).correr()
+        self.assertEqual(list(resultados), list(Medicion.ESCENARIOS))
+        for escenario, r in resultados.items():
+            self.assertEqual((r['requests'], r['errores']), (2, 0), escenario)
+            self.assertLessEqual(r['p50_ms'], r['p99_ms'], escenario)
+        # El buscador contesta desde el índice en memoria; el checkout sí escribe en la base
+        self.assertEqual(resultados['buscar']['consultas_media'], 0)
+        self.assertGreater(resultados['finalizar_compra']['consultas_media'], 0)
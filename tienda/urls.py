@@ -4,6 +4,7 @@ from django.contrib.auth import views as auth_views
 
 urlpatterns = [
     path('', views.catalogo, name='catalogo'),
+    path('catalogo/pagina/', views.catalogo_pagina_ajax, name='catalogo_pagina_ajax'),
     path('registro/', views.registro, name='registro'),
     path('accounts/login/', auth_views.LoginView.as_view(template_name='tienda/login.html'), name='login'),
     
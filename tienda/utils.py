@@ -1,47 +1,151 @@
-from PIL import Image
+from PIL import Image, ImageOps, ExifTags
 from io import BytesIO
+from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.core.files.uploadedfile import InMemoryUploadedFile
-import sys
+import re
+import unicodedata
+
+# Tope de píxeles que se decodifican por foto (setting TIENDA_IMAGENES_MAX_PIXELES).
+# Cada píxel ocupa 3 o 4 bytes en memoria: 24 millones son ~100 MB por foto como mucho.
+MAX_PIXELES = 24_000_000
+
+# Orientaciones EXIF que giran la foto 90°: el ancho visible es el alto guardado
+ORIENTACIONES_GIRADAS = (5, 6, 7, 8)
+
+
+class ImagenDemasiadoGrande(ValueError):
+    pass
+
+
+def max_pixeles():
+    return getattr(settings, 'TIENDA_IMAGENES_MAX_PIXELES', MAX_PIXELES)
+
+
+def orientacion(img):
+    return img.getexif().get(ExifTags.Base.Orientation, 1)
+
+
+def tamano_visible(img):
+    """
+    (ancho, alto) de la foto tal como se ve, ya aplicada la orientación EXIF.
+    Solo lee el encabezado: no decodifica nada.
+    """
+    ancho, alto = img.size
+    return (alto, ancho) if orientacion(img) in ORIENTACIONES_GIRADAS else (ancho, alto)
+
+
+def pixeles_a_decodificar(img, ancho_maximo=None):
+    """
+    Cuántos píxeles hay que decodificar para llevar `img` a `ancho_maximo`.
+    Un JPEG se puede decodificar directo a 1/2, 1/4 u 1/8 (draft); el resto se decodifica entero.
+    """
+    ancho, alto = img.size
+    if img.format != 'JPEG' or not ancho_maximo:
+        return ancho * alto
+    escala = 1
+    while escala < 8 and tamano_visible(img)[0] // (escala * 2) >= ancho_maximo:
+        escala *= 2
+    return (ancho // escala) * (alto // escala)
+
+
+def reducir_imagen(img, ancho_maximo=None):
+    """
+    Decodifica `img` (recién abierta con Image.open) ocupando la menor memoria posible:
+    los JPEG se reducen mientras se decodifican (draft) y el resto con reduce() antes del LANCZOS.
+    Devuelve la foto derecha (orientación EXIF aplicada) y con a lo sumo `ancho_maximo` de ancho.
+    Lanza ImagenDemasiadoGrande si igual habría que decodificar más de max_pixeles().
+    """
+    ancho_visible, _ = tamano_visible(img)
+    if ancho_maximo and ancho_visible > ancho_maximo:
+        # draft() pide el tamaño guardado (antes de girar); no hace nada si no es JPEG
+        escala = ancho_maximo / ancho_visible
+        img.draft(img.mode, (round(img.width * escala), round(img.height * escala)))
+
+    if img.width * img.height > max_pixeles():
+        raise ImagenDemasiadoGrande(
+            f"La imagen tiene {img.width}x{img.height} píxeles; el máximo es {max_pixeles():,} píxeles."
+        )
+
+    img.load()
+    ImageOps.exif_transpose(img, in_place=True)
+    if ancho_maximo and img.width > ancho_maximo:
+        alto = max(1, round(img.height * ancho_maximo / img.width))
+        # reducing_gap: primero reduce() por un factor entero (rápido) y después LANCZOS
+        img = img.resize((ancho_maximo, alto), Image.Resampling.LANCZOS, reducing_gap=3.0)
+    return img
+
+
+def validar_tamano_imagen(archivo):
+    """
+    Validador de los ImageField: rechaza al subirlas las fotos que después no se podrían procesar.
+    """
+    if not archivo:
+        return
+    posicion = archivo.tell() if hasattr(archivo, 'tell') else None
+    try:
+        img = Image.open(archivo)
+        # El ancho más grande que se genera es el de las derivadas: para ese hay que poder decodificarla
+        anchos = getattr(settings, 'TIENDA_IMAGENES_ANCHOS', None) or (1600,)
+        if pixeles_a_decodificar(img, max(anchos)) > max_pixeles():
+            ancho, alto = tamano_visible(img)
+            raise ValidationError(
+                f"La imagen es demasiado grande ({ancho}x{alto} píxeles). Subí una versión más chica."
+            )
+    except (OSError, ValueError, Image.DecompressionBombError):
+        # Que no es una imagen ya lo informa el propio ImageField
+        return
+    finally:
+        if posicion is not None:
+            archivo.seek(posicion)
+
 
 def comprimir_imagen(imagen, nuevo_ancho=800):
     """
-    Recibe una imagen (InMemoryUploadedFile), la redimensiona y comprime.
-    Retorna la imagen optimizada lista para guardar en el modelo.
+    Recibe una imagen (archivo subido o del storage), la endereza, la redimensiona y la comprime.
+    Retorna la imagen optimizada lista para guardar en el modelo
+    (o la misma imagen si ya era chica y no estaba girada).
     """
-    # 1. Abrir la imagen usando Pillow
+    # 1. Abrir la imagen: Pillow solo lee el encabezado, todavía no decodifica
     img = Image.open(imagen)
-    
-    # 2. Convertir a RGB (necesario si la imagen es PNG con transparencia o CMYK)
-    if img.mode in ('RGBA', 'P', 'CMYK'):
-        img = img.convert('RGB')
 
-    # 3. Calcular nueva altura manteniendo la proporción
-    ancho_original, alto_original = img.size
-    
-    # Si la imagen ya es más chica que el objetivo, no la tocamos
-    if ancho_original <= nuevo_ancho:
+    # Si la imagen ya es más chica que el objetivo y está derecha, no la tocamos
+    ancho_original, _ = tamano_visible(img)
+    if ancho_original <= nuevo_ancho and orientacion(img) == 1:
         return imagen
 
-    ratio = nuevo_ancho / float(ancho_original)
-    nuevo_alto = int(float(alto_original) * ratio)
+    # 2. Decodificar ya reducida y derecha (la orientación queda aplicada en los píxeles)
+    img = reducir_imagen(img, nuevo_ancho)
 
-    # 4. Redimensionar (Usamos LANCZOS para alta calidad)
-    img = img.resize((nuevo_ancho, nuevo_alto), Image.Resampling.LANCZOS)
+    # 3. Convertir a RGB (necesario si la imagen es PNG con transparencia o CMYK)
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
 
-    # 5. Guardar en memoria (BytesIO)
+    # 4. Guardar en memoria (BytesIO)
     output = BytesIO()
     # quality=85 es un estándar excelente: reduce peso sin perder nitidez visible
     img.save(output, format='JPEG', quality=85, optimize=True)
     output.seek(0)
 
-    # 6. Crear el nuevo objeto de archivo para Django
+    # 5. Crear el nuevo objeto de archivo para Django (con el tamaño real de los bytes)
     nueva_imagen = InMemoryUploadedFile(
         output,
         'ImageField',
         f"{imagen.name.split('.')[0]}.jpg", # Forzamos extensión .jpg
         'image/jpeg',
-        sys.getsizeof(output),
+        output.getbuffer().nbytes,
         None
     )
 
-    return nueva_imagen
\ No newline at end of file
+    return nueva_imagen
+
+def normalizar_texto(texto):
+    """
+    Pasa el texto a minúsculas, le saca los acentos y colapsa los espacios.
+    "  Anillo  Dorádo " -> "anillo dorado"
+    """
+    if not texto:
+        return ""
+    texto = unicodedata.normalize('NFKD', str(texto).lower())
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return re.sub(r'\s+', ' ', texto).strip()
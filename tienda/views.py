@@ -8,43 +8,141 @@ from .forms import CheckoutForm, UserUpdateForm, PerfilUpdateForm, ReviewForm
 from django.http import JsonResponse
 from django.contrib import messages
 from django.utils import timezone
-from decimal import Decimal
+from decimal import Decimal, InvalidOperation
 from django.contrib.admin.views.decorators import staff_member_required
-from django.db.models import Count, Sum, Avg, Q
+from django.db.models import Count, Sum, Avg, Q, Prefetch
 import json
+import hashlib
 from django.contrib.auth.models import User
-from datetime import datetime, timedelta
+from datetime import timedelta
 from django.db import transaction
-from django.core.cache import cache
+from django.template.loader import render_to_string
+from .paginacion import PaginaCursor
+from .autocompletado import indice_autocompletado
+from .cache import generacion_catalogo, fragmento_versionado, obtener_o_calcular
+from .relacionados import relacionados_de
+from .services import confirmar_items_orden
+from .utils import normalizar_texto
+from django.utils.functional import SimpleLazyObject
+
+def _precio(valor):
+    try:
+        precio = Decimal(valor.strip())
+    except (AttributeError, InvalidOperation):
+        return None
+    return precio if precio.is_finite() else None
+
+def _filtros_catalogo(request):
+    """
+    Los filtros de la URL ya normalizados, tal como los aplica el queryset: el texto como lo
+    compara el buscador, la categoría en minúsculas (los slugs lo están) y los precios como
+    Decimal (None si no son un número).
+    """
+    return {
+        'q': normalizar_texto(request.GET.get('q')),
+        'categoria': (request.GET.get('categoria') or '').strip().lower(),
+        'min_price': _precio(request.GET.get('min_price')),
+        'max_price': _precio(request.GET.get('max_price')),
+    }
 
-def catalogo(request):
-    # 1. Obtener parámetros de la URL
-    query = request.GET.get('q')
-    categoria_slug = request.GET.get('categoria')
-    min_price = request.GET.get('min_price')
-    max_price = request.GET.get('max_price')
-    orden = request.GET.get('orden', 'reciente')
-
-    # 2. Usar nuestro nuevo Manager para filtrar (Código Limpio)
-    productos = (
+def _filtrar_catalogo(request):
+    """
+    Aplica los filtros de la URL al catálogo. Lo comparten la página y el endpoint de scroll infinito.
+    Devuelve la página, los filtros para el link "ver más" y el queryset sin la categoría (para las facetas).
+    """
+    filtros_catalogo = _filtros_catalogo(request)
+    query = filtros_catalogo['q']
+    # Si hay búsqueda, por defecto mostramos primero lo más relevante
+    orden = request.GET.get('orden') or ('relevancia' if query else 'reciente')
+
+    sin_categoria = (
         Producto.objects
         .buscar(query)
-        .filtrar_por_categoria(categoria_slug)
-        .filtrar_por_precio(min_price, max_price)
-        .ordenar(orden)
+        .filtrar_por_precio(filtros_catalogo['min_price'], filtros_catalogo['max_price'])
     )
-
-    # 3. Datos adicionales para el template
-    categorias = Categoria.objects.all()
+    productos = sin_categoria.filtrar_por_categoria(filtros_catalogo['categoria']).ordenar(orden)
+
+    # Los parámetros actuales sin el cursor, para armar el link a la página siguiente
+    filtros = request.GET.copy()
+    filtros.pop('cursor', None)
+
+    pagina = PaginaCursor(productos, orden, cursor=request.GET.get('cursor'))
+    return pagina, filtros.urlencode(), sin_categoria
+
+def _clave_facetas(request):
+    """
+    Identifica la combinación de filtros que afecta a las facetas (todo menos el orden y el cursor).
+    Sale de los filtros normalizados: "Anillo" y "anillo", o 100 y 100.00, comparten la entrada.
+    """
+    filtros = _filtros_catalogo(request)
+    precios = [str(filtros[campo].normalize()) if filtros[campo] is not None else '' for campo in ('min_price', 'max_price')]
+    return hashlib.md5(json.dumps([filtros['q'], *precios, filtros['categoria']]).encode()).hexdigest()
+
+def _barra_catalogo(clave_facetas, sin_categoria, categoria_slug):
+    """
+    Categorías con sus conteos y facetas de precio. Se evalúa recién si el template
+    la necesita (si los fragmentos están en cache, no se ejecuta ninguna consulta).
+    """
+    categorias = list(Categoria.objects.all())
+    categoria_id = next((c.id for c in categorias if c.slug == categoria_slug), None)
+
+    facetas = fragmento_versionado(
+        'facetas', [clave_facetas],
+        lambda: sin_categoria.facetas(categoria_id=categoria_id)
+    )
+    for cat in categorias:
+        cat.cantidad = facetas['categorias'].get(cat.id, 0)
+
+    return {'categorias': categorias, 'facetas': facetas}
+
+def _contexto_catalogo(request, generacion):
+    """
+    Arma el contexto del catálogo sin ejecutar ninguna consulta: todo se evalúa recién
+    en el template, y solo si el fragmento no está en cache. La usan la vista sync y la async
+    (que antes de renderizar trae con el ORM async lo que los fragmentos no tienen).
+    """
+    # 1. Filtrar y paginar por cursor (nunca traemos el catálogo entero)
+    pagina, filtros_query, sin_categoria = _filtrar_catalogo(request)
+    categoria_slug = _filtros_catalogo(request)['categoria'] or None
+    clave_facetas = _clave_facetas(request)
+
+    # 2. Datos adicionales para el template. Todo es perezoso: si el fragmento
+    # está en cache (clave con la generación del catálogo) no se consulta la base.
+    barra = SimpleLazyObject(lambda: _barra_catalogo(clave_facetas, sin_categoria, categoria_slug))
     # Mantenemos la lógica de ofertas aparte como estaba
     ofertas = Producto.objects.filter(en_oferta=True)[:5]
 
-    return render(request, 'tienda/index.html', {
-        'joyas': productos,
+    return {
+        'joyas': pagina,
+        'pagina': pagina,
+        'filtros_query': filtros_query,
+        'barra': barra,
+        'clave_facetas': clave_facetas,
+        'generacion': generacion,
         'ofertas': ofertas,
-        'categorias': categorias,
         'categoria_actual': categoria_slug,
-    })
+    }
+
+def catalogo(request):
+    return render(request, 'tienda/index.html', _contexto_catalogo(request, generacion_catalogo()))
+
+def catalogo_pagina_ajax(request):
+    """
+    Devuelve la página siguiente del catálogo para el scroll infinito.
+    """
+    def armar_pagina():
+        pagina, filtros_query, _ = _filtrar_catalogo(request)
+        html = render_to_string('tienda/includes/pagina_productos.html', {'joyas': pagina}, request=request)
+        return {
+            'html': html,
+            'cantidad': len(pagina),
+            'siguiente': pagina.siguiente_cursor,
+        }
+
+    if request.user.is_authenticated:
+        # Las tarjetas muestran los favoritos del usuario: no se comparten
+        return JsonResponse(armar_pagina())
+    return JsonResponse(fragmento_versionado('catalogo_pagina', [request.get_full_path()], armar_pagina))
 
 def detalle(request, producto_id):
     joya = get_object_or_404(Producto, pk=producto_id)
@@ -61,37 +159,18 @@ def detalle(request, producto_id):
     else:
         form = ReviewForm()
 
-    reviews = joya.reviews.all().order_by('-fecha')
-    
-    promedio_stars = 0
-    if reviews.exists():
-        promedio_stars = reviews.aggregate(Avg('calificacion'))['calificacion__avg']
-
-    min_price = joya.precio * Decimal('0.5')
-    max_price = joya.precio * Decimal('2.0')
-
-    relacionados = Producto.objects.filter(
-        categoria=joya.categoria,
-        stock__gt=0,
-        precio__gte=min_price,
-        precio__lte=max_price
-    ).exclude(id=joya.id).order_by('?')[:4]
-
-    if relacionados.count() < 4:
-        productos_extra = Producto.objects.filter(
-            categoria=joya.categoria,
-            stock__gt=0
-        ).exclude(id=joya.id).exclude(id__in=[p.id for p in relacionados]).order_by('?')[:4 - relacionados.count()]
-        
-        relacionados = list(relacionados) + list(productos_extra)
+    return render(request, 'tienda/detalle.html', _contexto_detalle(joya, form, generacion_catalogo()))
 
-    return render(request, 'tienda/detalle.html', {
+def _contexto_detalle(joya, form, generacion):
+    # Reseñas y relacionados quedan perezosos: el template los tiene en fragmentos cacheados
+    return {
         'joya': joya,
-        'relacionados': relacionados,
-        'reviews': reviews,
+        'relacionados': SimpleLazyObject(lambda: relacionados_de(joya)),
+        'reviews': joya.reviews.select_related('usuario').order_by('-fecha'),
+        'resumen': joya.resumen_calificaciones(),
         'form': form,
-        'promedio_stars': round(promedio_stars or 0, 1)
-    })
+        'generacion': generacion,
+    }
 
 @login_required
 def eliminar_review(request, review_id):
@@ -128,23 +207,16 @@ def agregar_carrito(request, producto_id):
         variante_obj = get_object_or_404(Variante, id=variante_id)
 
     if variante_obj:
-        cart_id = f"{producto.id}_{variante_obj.id}"
-        stock_disponible = variante_obj.stock
         nombre_producto = f"{producto.nombre} ({variante_obj.nombre})"
     else:
-        cart_id = str(producto.id)
-        stock_disponible = producto.stock
         nombre_producto = producto.nombre
 
-    cantidad_en_carrito = 0
-    if cart_id in carrito.carrito:
-        cantidad_en_carrito = carrito.carrito[cart_id]['cantidad']
-        
-    if cantidad_en_carrito + 1 > stock_disponible:
-        messages.error(request, f"Lo sentimos, solo quedan {stock_disponible} unidades de {nombre_producto}.")
-    else:
+    # agregar() reserva la unidad: falla si el stock libre (stock - reservas de otros carritos) no alcanza
+    try:
         carrito.agregar(producto, variante=variante_obj)
         messages.success(request, f"Agregaste {nombre_producto} al carrito.")
+    except ValueError as e:
+        messages.error(request, str(e))
        
     return redirect("ver_carrito")
 
@@ -203,49 +275,36 @@ def ver_carrito(request):
         porcentaje_barra = 100
 
     segundos_restantes = 0
-    ultimo_acceso = request.session.get("carrito_ultimo_acceso")
+    ultimo_acceso = carrito.ultimo_acceso
     
     if carrito.carrito and ultimo_acceso:
-        try:
-            ahora = timezone.now()
-            tiempo_ultimo = datetime.fromisoformat(ultimo_acceso)
-            expiracion = tiempo_ultimo + timedelta(hours=2)
-            diferencia = expiracion - ahora
-            segundos_restantes = max(0, diferencia.total_seconds())
-        except ValueError:
-            pass
+        expiracion = ultimo_acceso + timedelta(hours=2)
+        diferencia = expiracion - timezone.now()
+        segundos_restantes = max(0, diferencia.total_seconds())
 
     items_visuales = []
     bloquear_checkout = False
 
-    for key, item in carrito.carrito.items():
-        try:
-            producto = Producto.objects.get(id=item["producto_id"])
-            stock_actual = 0
-            
-            if item["variante_id"]:
-                variante = Variante.objects.get(id=item["variante_id"])
-                stock_actual = variante.stock
-            else:
-                stock_actual = producto.stock
-            
-            cantidad_en_carrito = int(item["cantidad"])
-            
-            tiene_stock = stock_actual >= cantidad_en_carrito
-            llegamos_al_limite = cantidad_en_carrito >= stock_actual
-            
-            if not tiene_stock:
-                bloquear_checkout = True
-            
-            item_display = item.copy()
-            item_display['tiene_stock'] = tiene_stock
-            item_display['llegamos_al_limite'] = llegamos_al_limite
-            item_display['stock_real'] = stock_actual
-            
-            items_visuales.append(item_display)
+    for linea in carrito.lineas():
+        stock_actual = linea["stock"]
+        cantidad_en_carrito = linea["cantidad"]
+
+        tiene_stock = stock_actual >= cantidad_en_carrito
+        llegamos_al_limite = cantidad_en_carrito >= stock_actual
 
-        except (Producto.DoesNotExist, Variante.DoesNotExist):
-            continue
+        if not tiene_stock:
+            bloquear_checkout = True
+
+        # Nombre, foto y precio se resuelven ahora: el carrito solo guarda ids y cantidades
+        item_display = linea["item"].copy()
+        item_display['nombre'] = linea["nombre"]
+        item_display['imagen'] = linea["imagen"]
+        item_display['precio'] = linea["precio"]
+        item_display['tiene_stock'] = tiene_stock
+        item_display['llegamos_al_limite'] = llegamos_al_limite
+        item_display['stock_real'] = stock_actual
+
+        items_visuales.append(item_display)
 
     return render(request, 'tienda/carrito.html', {
         'total': total,
@@ -299,42 +358,7 @@ def finalizar_compra(request):
                     orden.total = total_a_pagar
                     orden.save()
 
-                    for key, item in carrito.carrito.items():
-                        producto = Producto.objects.select_for_update().get(id=item["producto_id"])
-                        variante_id = item.get("variante_id")
-                        variante_obj = None
-                        cantidad = int(item["cantidad"])
-
-                        if variante_id:
-                            variante_obj = Variante.objects.select_for_update().get(id=variante_id)
-                            stock_actual = variante_obj.stock
-                            nombre_ref = f"{producto.nombre} ({variante_obj.nombre})"
-                        else:
-                            stock_actual = producto.stock
-                            nombre_ref = producto.nombre
-
-                        if stock_actual < cantidad:
-                            raise ValueError(f"Lo sentimos, ya no hay suficiente stock de {nombre_ref}.")
-
-                        if producto.en_oferta and producto.precio_oferta:
-                            precio_final_unitario = producto.precio_oferta
-                        else:
-                            precio_final_unitario = producto.precio
-
-                        DetalleOrden.objects.create(
-                            orden=orden,
-                            producto=producto,
-                            variante=variante_obj,
-                            cantidad=cantidad,
-                            precio_unitario=precio_final_unitario
-                        )
-
-                        if variante_obj:
-                            variante_obj.stock -= cantidad
-                            variante_obj.save()
-                        else:
-                            producto.stock -= cantidad
-                            producto.save()
+                    confirmar_items_orden(orden, carrito.carrito.values(), token=carrito.token)
 
                     if 'cupon_id' in request.session:
                         try:
@@ -363,6 +387,7 @@ def finalizar_compra(request):
     return render(request, 'tienda/checkout.html', {
         'form': form, 
         'carrito': carrito,
+        'lineas': carrito.lineas(),
         'subtotal': subtotal,
         'descuento': descuento_monto,
         'costo_envio': costo_envio,
@@ -370,7 +395,10 @@ def finalizar_compra(request):
     })
 
 def mis_compras(request):
-    ordenes = Orden.objects.filter(usuario=request.user).order_by('-fecha')
+    ordenes = (
+        Orden.objects.filter(usuario=request.user).order_by('-fecha')
+        .prefetch_related(Prefetch('items', queryset=DetalleOrden.objects.select_related('producto')))
+    )
     return render(request, 'tienda/mis_compras.html', {'ordenes': ordenes})
 
 def editar_perfil(request):
@@ -414,7 +442,7 @@ def toggle_favorito(request, producto_id):
 
 @login_required
 def mis_favoritos(request):
-    favoritos = Favorito.objects.filter(usuario=request.user).order_by('-fecha')
+    favoritos = Favorito.objects.filter(usuario=request.user).select_related('producto').order_by('-fecha')
     return render(request, 'tienda/mis_favoritos.html', {'favoritos': favoritos})
 
 def aplicar_cupon(request):
@@ -441,43 +469,40 @@ def aplicar_cupon(request):
             
     return redirect('ver_carrito')
 
+def _estadisticas_dashboard():
+    total_usuarios = User.objects.count()
+    total_ordenes = Orden.objects.count()
+    ingresos_totales = Orden.objects.aggregate(Sum('total'))['total__sum'] or 0
+    low_stock_count = Producto.objects.filter(stock__lte=3).count()
+
+    promedio_calidad = Review.objects.aggregate(Avg('calificacion'))['calificacion__avg'] or 0
+
+    ordenes_por_estado = Orden.objects.values('estado').annotate(cantidad=Count('id'))
+    labels_estados = [x['estado'] for x in ordenes_por_estado]
+    data_estados = [x['cantidad'] for x in ordenes_por_estado]
+
+    top_productos = DetalleOrden.objects.values('producto__nombre').annotate(
+        total_vendido=Sum('cantidad')
+    ).order_by('-total_vendido')[:5]
+    labels_top = [x['producto__nombre'] for x in top_productos]
+    data_top = [x['total_vendido'] for x in top_productos]
+
+    return {
+        'total_usuarios': total_usuarios,
+        'total_ordenes': total_ordenes,
+        'ingresos_totales': ingresos_totales,
+        'low_stock_count': low_stock_count,
+        'promedio_calidad': promedio_calidad,
+        'labels_estados': labels_estados,
+        'data_estados': data_estados,
+        'labels_top': labels_top,
+        'data_top': data_top,
+    }
+
 @staff_member_required
 def dashboard_admin(request):
-    # Intentar obtener datos del cache
-    cache_key = 'dashboard_stats'
-    stats = cache.get(cache_key)
-
-    if not stats:
-        total_usuarios = User.objects.count()
-        total_ordenes = Orden.objects.count()
-        ingresos_totales = Orden.objects.aggregate(Sum('total'))['total__sum'] or 0
-        low_stock_count = Producto.objects.filter(stock__lte=3).count()
-
-        promedio_calidad = Review.objects.aggregate(Avg('calificacion'))['calificacion__avg'] or 0
-
-        ordenes_por_estado = Orden.objects.values('estado').annotate(cantidad=Count('id'))
-        labels_estados = [x['estado'] for x in ordenes_por_estado]
-        data_estados = [x['cantidad'] for x in ordenes_por_estado]
-
-        top_productos = DetalleOrden.objects.values('producto__nombre').annotate(
-            total_vendido=Sum('cantidad')
-        ).order_by('-total_vendido')[:5]
-        labels_top = [x['producto__nombre'] for x in top_productos]
-        data_top = [x['total_vendido'] for x in top_productos]
-        
-        stats = {
-            'total_usuarios': total_usuarios,
-            'total_ordenes': total_ordenes,
-            'ingresos_totales': ingresos_totales,
-            'low_stock_count': low_stock_count,
-            'promedio_calidad': promedio_calidad,
-            'labels_estados': labels_estados,
-            'data_estados': data_estados,
-            'labels_top': labels_top,
-            'data_top': data_top,
-        }
-        # Cache por 15 minutos
-        cache.set(cache_key, stats, 60 * 15)
+    # Cache compartida entre workers por 15 minutos; cuando vence la recalcula uno solo
+    stats = obtener_o_calcular('dashboard_stats', _estadisticas_dashboard, 60 * 15)
 
     # Optimización N+1: Usar select_related para traer relaciones en una sola query
     ultimas_reviews = Review.objects.select_related('usuario', 'producto').order_by('-fecha')[:3]
@@ -497,19 +522,21 @@ def dashboard_admin(request):
         'data_top': json.dumps(stats['data_top']),
     })
 
+def _resultado_busqueda(producto_id, nombre, precio, imagen):
+    return {
+        'id': producto_id,
+        'nombre': nombre,
+        'precio': precio,
+        'imagen': imagen,
+        'url': f"/producto/{producto_id}/"
+    }
+
 def buscar_productos_ajax(request):
     query = request.GET.get('q', '')
     resultados = []
     
     if len(query) > 2:
-        productos = Producto.objects.filter(nombre__icontains=query)[:5]
-        for p in productos:
-            resultados.append({
-                'id': p.id,
-                'nombre': p.nombre,
-                'precio': str(p.precio),
-                'imagen': p.imagen.url if p.imagen else '',
-                'url': f"/producto/{p.id}/"
-            })
+        # Respondemos desde el índice en memoria: no hay consulta a la base por cada tecla
+        resultados = [_resultado_busqueda(*tupla) for tupla in indice_autocompletado.buscar(query, limite=5)]
     
-    return JsonResponse({'resultados': resultados})
\ No newline at end of file
+    return JsonResponse({'resultados': resultados})
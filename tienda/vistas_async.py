@@ -0,0 +1,101 @@
+"""
+Versiones async de las páginas de solo lectura (catálogo, detalle, buscador y sitemap)
+para cuando la tienda corre con ASGI (tormenta/asgi.py + tormenta/urls_asgi.py).
+
+El contexto se arma igual que en tienda/views.py (querysets perezosos), y antes de
+renderizar se traen con el ORM async los datos de los fragmentos que no están en cache:
+la página del catálogo, las ofertas, el producto con sus variantes, las reseñas y los
+relacionados. El template se renderiza en un hilo (sync_to_async); lo que queda perezoso
+(la barra de facetas, que calcula con su propio lock) se consulta ahí. Las vistas que
+modifican datos siguen siendo las de tienda/views.py: Django las adapta solo.
+"""
+from asgiref.sync import sync_to_async
+from django.contrib.sitemaps.views import sitemap as sitemap_sync
+from django.core.cache import InvalidCacheBackendError, caches
+from django.core.cache.utils import make_template_fragment_key
+from django.db.models import QuerySet
+from django.http import JsonResponse
+from django.shortcuts import aget_object_or_404, render
+from .autocompletado import indice_autocompletado
+from .busqueda import obtener_motor
+from .cache import ageneracion_catalogo
+from .forms import ReviewForm
+from .models import Producto
+from .relacionados import arelacionados_de
+from . import views
+
+_render = sync_to_async(render)
+
+
+async def _fragmento_guardado(nombre, *partes):
+    """
+    True si el {% cache nombre partes %} del template ya está guardado: lo que tiene adentro
+    no hace falta consultarlo. Si vence justo antes del render, el template lo consulta igual.
+    """
+    try:
+        fragmentos = caches['template_fragments']
+    except InvalidCacheBackendError:
+        fragmentos = caches['default']
+    return await fragmentos.ahas_key(make_template_fragment_key(nombre, partes))
+
+
+async def catalogo(request):
+    # El motor de búsqueda se elige mirando las tablas de la base, una sola vez por proceso
+    await sync_to_async(obtener_motor)()
+    generacion = await ageneracion_catalogo()
+    contexto = views._contexto_catalogo(request, generacion)
+
+    if not await _fragmento_guardado('catalogo_ofertas', generacion):
+        contexto['ofertas'] = [oferta async for oferta in contexto['ofertas']]
+    if not await _fragmento_guardado('catalogo_grilla', generacion, request.get_full_path()):
+        await contexto['pagina'].acargar()
+    # La barra (categorías y facetas) queda perezosa: se calcula en el hilo del render, con su lock
+    return await _render(request, 'tienda/index.html', contexto)
+
+
+async def detalle(request, producto_id):
+    if request.method == 'POST':
+        # Publicar una reseña escribe en la base: lo resuelve la vista sync
+        return await sync_to_async(views.detalle)(request, producto_id)
+
+    generacion = await ageneracion_catalogo()
+    productos = Producto.objects.all()
+    if not await _fragmento_guardado('detalle_variantes', generacion, producto_id):
+        productos = productos.prefetch_related('variantes')
+    joya = await aget_object_or_404(productos, pk=producto_id)
+    contexto = views._contexto_detalle(joya, ReviewForm(), generacion)
+
+    # El fragmento de reseñas depende del usuario; queda cargado para el render (no lo vuelve a buscar)
+    request.user = await request.auser()
+    if not await _fragmento_guardado('detalle_reviews', generacion, joya.id, request.user.id):
+        contexto['reviews'] = [review async for review in contexto['reviews']]
+    if not await _fragmento_guardado('detalle_relacionados', generacion, joya.id):
+        contexto['relacionados'] = await arelacionados_de(joya)
+    return await _render(request, 'tienda/detalle.html', contexto)
+
+
+async def buscar_productos_ajax(request):
+    query = request.GET.get('q', '')
+    resultados = []
+
+    if len(query) > 2:
+        tuplas = await indice_autocompletado.abuscar(query, limite=5)
+        resultados = [views._resultado_busqueda(*tupla) for tupla in tuplas]
+
+    return JsonResponse({'resultados': resultados})
+
+
+async def sitemap(request, sitemaps, **kwargs):
+    """
+    Trae los items de cada sección con el ORM async y después arma el XML
+    con la vista de django.contrib.sitemaps, que ya no necesita consultar.
+    """
+    precargados = {}
+    for seccion, mapa in sitemaps.items():
+        mapa = mapa() if callable(mapa) else mapa
+        items = mapa.items()
+        if isinstance(items, QuerySet):
+            items = [obj async for obj in items]
+        mapa.items = lambda items=items: items
+        precargados[seccion] = mapa
+    return await sync_to_async(sitemap_sync)(request, precargados, **kwargs)
@@ -12,5 +12,9 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tormenta.settings')
+# Rutas con las vistas async (tormenta/urls_asgi.py)
+os.environ.setdefault('TIENDA_ASGI', '1')
 
+# Se arranca, por ejemplo, con:
+#   uvicorn tormenta.asgi:application --workers 2
 application = get_asgi_application()
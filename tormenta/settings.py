@@ -1,6 +1,8 @@
 
 from pathlib import Path
+import hashlib
 import os 
+import tempfile
 from dotenv import load_dotenv
 import dj_database_url
 
@@ -41,6 +43,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'tienda.consultas.PresupuestoConsultasMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'csp.middleware.CSPMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -54,6 +57,14 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'tormenta.urls'
 
+# Con ASGI (tormenta/asgi.py lo activa) las páginas de solo lectura usan vistas async.
+# WhiteNoise no es async: obligaría a pasar cada request por un hilo, así que ahí se saca
+# y los estáticos salen de STATIC_ROOT por tormenta/urls_asgi.py (o, mejor, por el nginx de adelante).
+TIENDA_ASGI = os.getenv('TIENDA_ASGI') == '1'
+if TIENDA_ASGI:
+    ROOT_URLCONF = 'tormenta.urls_asgi'
+    MIDDLEWARE.remove('whitenoise.middleware.WhiteNoiseMiddleware')
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -64,6 +75,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'tienda.context_processors.carrito_context',
             ],
         },
     },
@@ -137,6 +149,66 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Configuración de Archivos Multimedia (Fotos)
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Quién manda los bytes de media/: 'django' (tienda/media.py, sirve solo), 'x-accel' (nginx) o 'x-sendfile' (Apache).
+# Con 'x-accel' nginx necesita una location interna que apunte a MEDIA_ROOT:
+#   location /media-interna/ { internal; alias /ruta/a/media/; }
+TIENDA_MEDIA_MODO = os.getenv('TIENDA_MEDIA_MODO', 'django')
+TIENDA_MEDIA_PREFIJO_INTERNO = '/media-interna/'
+
+# Compresión de fotos subidas: 'hilo' (en segundo plano), 'cola' (comando procesar_imagenes) o 'sincronico'.
+# En 'hilo' cada proceso reintenta solo los trabajos fallidos y los que dejó colgados un reinicio
+# (tienda/imagenes.py: barrer_pendientes), pero recién con la próxima foto que se suba: si las
+# subidas son esporádicas conviene un cron con `python manage.py procesar_imagenes`.
+TIENDA_IMAGENES_MODO = os.getenv('TIENDA_IMAGENES_MODO', 'hilo')
+# Versiones responsivas de cada foto (srcset). Agregar 'avif' adelante si el Pillow del servidor lo soporta.
+TIENDA_IMAGENES_ANCHOS = (200, 400, 800, 1600)
+TIENDA_IMAGENES_FORMATOS = ('webp', 'jpeg')
+# Tope de píxeles decodificados por foto (~4 bytes por píxel de memoria). Los JPEG grandes
+# se decodifican ya reducidos, así que el tope casi siempre lo alcanzan PNG o TIFF enormes.
+TIENDA_IMAGENES_MAX_PIXELES = 24_000_000
+
+# Cache compartida por todos los workers de gunicorn (sin servicios externos): archivos en disco.
+# Con una sola LocMem por proceso cada worker recalculaba el dashboard y el catálogo por su cuenta
+# y las invalidaciones del catálogo no llegaban a los demás.
+TIENDA_CACHE_DIR = os.getenv('TIENDA_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'tormenta_cache'))
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(TIENDA_CACHE_DIR, 'general'),
+        # Un prefijo por base: dos instalaciones en la misma máquina no comparten generación ni fragmentos
+        'KEY_PREFIX': hashlib.md5(str(DATABASES['default'].get('NAME', '')).encode()).hexdigest()[:8],
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {
+            # Fragmentos del catálogo por página y filtros: el tope por defecto (300) se queda corto
+            'MAX_ENTRIES': 5000,
+            'CULL_FREQUENCY': 4,
+        },
+    },
+}
+# Locks entre workers para recalcular la cache una sola vez (tienda/cache.py: tomar_lock)
+TIENDA_LOCKS_DIR = os.path.join(TIENDA_CACHE_DIR, 'locks')
+# Los tests usan una cache y unos locks en una carpeta temporal propia (los cache.clear()
+# de los tests no tocan la cache de la tienda que corre en la misma máquina)
+TEST_RUNNER = 'tienda.ejecutor_pruebas.EjecutorPruebas'
+
+# Máximo de consultas por request de cada página (por nombre de URL); ver tienda/consultas.py.
+# Al pasarse (o al repetir una consulta, N+1) se avisa en el log; con TIENDA_PRESUPUESTO_ESTRICTO
+# se lanza una excepción. TIENDA_CONSULTAS_ENCABEZADO (por defecto, DEBUG) agrega X-Consultas.
+# El middleware solo se instala con TIENDA_PRESUPUESTO_ACTIVO (por defecto, igual que DEBUG).
+TIENDA_PRESUPUESTO_ACTIVO = os.getenv('TIENDA_PRESUPUESTO_ACTIVO', str(DEBUG)).strip() == 'True'
+TIENDA_PRESUPUESTO_CONSULTAS = {
+    'catalogo': 10,
+    'catalogo_pagina_ajax': 6,
+    'detalle': 9,
+    'buscar_productos_ajax': 2,
+    'ver_carrito': 8,
+    'agregar_carrito': 20,
+    'finalizar_compra': 20,
+    'mis_compras': 8,
+    'mis_favoritos': 6,
+    'dashboard_admin': 15,
+    'django.contrib.sitemaps.views.sitemap': 4,
+}
 
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
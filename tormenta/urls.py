@@ -1,9 +1,9 @@
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.conf import settings
-from django.conf.urls.static import static
 from django.contrib.auth import views as auth_views
 from tienda import views
+from tienda.media import servir_media
 from django.contrib.sitemaps.views import sitemap
 from tienda.sitemaps import ProductoSitemap, StaticViewSitemap
 from django.views.generic.base import TemplateView
@@ -26,6 +26,7 @@ urlpatterns = [
 
     path('registro/', views.registro, name='registro'),
     path('', views.catalogo, name='catalogo'), # <--- Página principal
+    path('catalogo/pagina/', views.catalogo_pagina_ajax, name='catalogo_pagina_ajax'), # <--- Scroll infinito
     path('producto/<int:producto_id>/', views.detalle, name='detalle'), # <--- Página de detalle
     path('perfil/editar/', views.editar_perfil, name='editar_perfil'),
 
@@ -54,6 +55,8 @@ urlpatterns = [
 ]
 
 
-# Configuración para ver las imágenes (siempre al final)
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+# Fotos subidas (siempre al final). Se sirven también en producción, con ETag, Range y caché larga;
+# con un nginx adelante conviene TIENDA_MEDIA_MODO = 'x-accel' (ver tienda/media.py)
+urlpatterns += [
+    re_path(rf"^{settings.MEDIA_URL.strip('/')}/(?P<ruta>.+)$", servir_media, name='media'),
+]
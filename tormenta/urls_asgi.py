@@ -0,0 +1,22 @@
+"""
+Rutas cuando la tienda corre con ASGI (ver tormenta/asgi.py): las páginas de solo lectura
+usan las vistas async de tienda/vistas_async.py; todo lo demás es igual que en tormenta/urls.py.
+"""
+from django.conf import settings
+from django.urls import path, re_path
+from django.views.static import serve
+from tienda import vistas_async
+from .urls import sitemaps, urlpatterns as urlpatterns_wsgi
+
+# Van primero: Django usa la primera ruta que coincide
+urlpatterns = [
+    path('', vistas_async.catalogo, name='catalogo'),
+    path('producto/<int:producto_id>/', vistas_async.detalle, name='detalle'),
+    path('busqueda-ajax/', vistas_async.buscar_productos_ajax, name='buscar_productos_ajax'),
+    path('sitemap.xml', vistas_async.sitemap, {'sitemaps': sitemaps}, name='django.contrib.sitemaps.views.sitemap'),
+] + urlpatterns_wsgi
+
+# Sin WhiteNoise, los estáticos ya recolectados (collectstatic) salen de STATIC_ROOT
+urlpatterns += [
+    re_path(rf"^{settings.STATIC_URL.strip('/')}/(?P<path>.+)$", serve, {'document_root': settings.STATIC_ROOT}),
+]